@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import boto3
+from video_processor import VideoProcessor, available_cpus
+
+# 离线性能基准：在本地S3模拟服务上运行完整的元数据和代理文件流程
+#
+# 用法:
+#   pip install -r requirements-bench.txt
+#   python benchmark.py --output bench.json
+#   python benchmark.py --output new.json --baseline bench.json
+#   python benchmark.py --endpoint http://localhost:9000   # 使用MinIO等S3兼容服务
+
+BENCH_BUCKET = "benchmark"
+
+# 默认测试矩阵：时长（秒）x 分辨率高度 x 编码器
+DEFAULT_DURATIONS = [10, 60]
+DEFAULT_HEIGHTS = [720, 1080]
+DEFAULT_CODECS = ["libx264"]
+
+
+def generate_test_video(path, duration, height, codec):
+    """使用ffmpeg的testsrc和sine生成合成测试视频"""
+    width = height * 16 // 9
+    cmd = [
+        "ffmpeg",
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc=duration={duration}:size={width}x{height}:rate=30",
+        "-f",
+        "lavfi",
+        "-i",
+        f"sine=frequency=440:duration={duration}",
+        "-c:v",
+        codec,
+        "-c:a",
+        "aac",
+        "-shortest",
+        "-y",
+        path,
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+class ResourceSampler:
+    """后台采样当前进程及其子进程（ffmpeg）的RSS和临时目录占用的峰值"""
+
+    def __init__(self, temp_dir, interval=0.05):
+        self.temp_dir = temp_dir
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.peak_rss = max(self.peak_rss, self._tree_rss())
+            self.peak_disk = max(self.peak_disk, self._disk_usage())
+            self.stopped.wait(self.interval)
+
+    def _tree_rss(self):
+        # 读取/proc统计本进程和直接子进程的RSS，其他平台返回0
+        pid = os.getpid()
+        total = 0
+        try:
+            for entry in os.listdir("/proc"):
+                if not entry.isdigit():
+                    continue
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        fields = f.read().rsplit(")", 1)[1].split()
+                except OSError:
+                    continue
+                if int(entry) == pid or int(fields[1]) == pid:
+                    # stat第24列为RSS页数
+                    total += int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        except FileNotFoundError:
+            return 0
+        return total
+
+    def _disk_usage(self):
+        total = 0
+        for root, _, files in os.walk(self.temp_dir):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+
+def start_local_s3():
+    """启动moto的本地S3服务，返回(服务对象, 地址)"""
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    return server, f"http://{host}:{port}"
+
+
+def run_case(temp_dir, size, stage, func):
+    """运行一个用例并收集阶段耗时、吞吐量和资源峰值"""
+    start = time.time()
+    with ResourceSampler(temp_dir) as sampler:
+        result = func()
+    elapsed = time.time() - start
+    if stage == "metadata":
+        stages = {"probe": result["probe"]["time"]}
+    else:
+        stages = result["processing_times"]
+    return {
+        "stages": stages,
+        "elapsed": round(elapsed, 3),
+        "throughput_mbps": round(size / (1024 * 1024) / elapsed, 2),
+        "peak_rss_mb": round(sampler.peak_rss / (1024 * 1024), 1),
+        "peak_temp_disk_mb": round(sampler.peak_disk / (1024 * 1024), 1),
+    }
+
+
+def compare(results, baseline):
+    """打印与基线相比的耗时变化"""
+    print("\n与基线对比（elapsed）:")
+    for case, current in results["cases"].items():
+        previous = baseline.get("cases", {}).get(case)
+        if not previous:
+            print(f"  {case}: 基线中不存在")
+            continue
+        before, after = previous["elapsed"], current["elapsed"]
+        change = (after - before) / before * 100 if before else 0
+        print(f"  {case}: {before}s -> {after}s ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="视频处理流程性能基准")
+    parser.add_argument("--durations", type=int, nargs="+", default=DEFAULT_DURATIONS)
+    parser.add_argument("--heights", type=int, nargs="+", default=DEFAULT_HEIGHTS)
+    parser.add_argument("--codecs", nargs="+", default=DEFAULT_CODECS)
+    parser.add_argument("--endpoint", help="S3兼容服务地址，不指定则启动moto本地服务")
+    parser.add_argument("--output", help="结果JSON文件路径")
+    parser.add_argument("--baseline", help="用于对比的基线JSON文件路径")
+    args = parser.parse_args()
+
+    server = None
+    endpoint = args.endpoint
+    if endpoint is None:
+        server, endpoint = start_local_s3()
+
+    # 模拟服务接受任意凭证
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        s3_client = boto3.client("s3", endpoint_url=endpoint, region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BENCH_BUCKET)
+
+        processor = VideoProcessor(region_name="us-east-1", endpoint_url=endpoint)
+        scratch_dir = os.path.join(work_dir, "scratch")
+        os.makedirs(scratch_dir)
+        processor.temp_dir = scratch_dir
+
+        results = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "cpus": available_cpus(),
+            "cases": {},
+        }
+        for codec in args.codecs:
+            for height in args.heights:
+                for duration in args.durations:
+                    name = f"{codec}_{height}p_{duration}s"
+                    source = os.path.join(work_dir, f"{name}.mp4")
+                    print(f"生成测试视频: {name}")
+                    generate_test_video(source, duration, height, codec)
+                    size = os.path.getsize(source)
+                    object_key = f"source/{name}.mp4"
+                    s3_client.upload_file(source, BENCH_BUCKET, object_key)
+                    os.remove(source)
+
+                    for stage, func in (
+                        (
+                            "metadata",
+                            lambda: processor.process_video(BENCH_BUCKET, object_key),
+                        ),
+                        (
+                            "proxy",
+                            lambda: processor.process_and_upload_proxy(
+                                BENCH_BUCKET, object_key
+                            ),
+                        ),
+                    ):
+                        case = f"{name}/{stage}"
+                        print(f"运行: {case}")
+                        results["cases"][case] = run_case(
+                            scratch_dir, size, stage, func
+                        )
+                        results["cases"][case]["source_mb"] = round(
+                            size / (1024 * 1024), 1
+                        )
+
+        output = json.dumps(results, ensure_ascii=False, indent=2)
+        print(output)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output)
+        if args.baseline:
+            with open(args.baseline) as f:
+                compare(results, json.load(f))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if server is not None:
+            server.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from video_processor import VideoProcessor, available_cpus
+
+# 对比单进程编码与分段并行编码的耗时
+# 用法: python benchmark_encode.py [时长秒数] [分辨率高度]
+
+
+def generate_test_video(path, duration, height):
+    """使用ffmpeg的testsrc和sine生成合成测试视频"""
+    width = height * 16 // 9
+    cmd = [
+        "ffmpeg",
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc=duration={duration}:size={width}x{height}:rate=30",
+        "-f",
+        "lavfi",
+        "-i",
+        f"sine=frequency=440:duration={duration}",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "veryfast",
+        "-c:a",
+        "aac",
+        "-shortest",
+        "-y",
+        path,
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+def count_frames(path):
+    """统计输出文件的视频帧数"""
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-count_packets",
+            "-show_entries",
+            "stream=nb_read_packets",
+            "-of",
+            "csv=p=0",
+            path,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return int(result.stdout.strip())
+
+
+if __name__ == "__main__":
+    duration = int(sys.argv[1]) if len(sys.argv) > 1 else 120
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 1080
+
+    processor = VideoProcessor()
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        source = os.path.join(work_dir, "source.mp4")
+        print(f"生成测试视频: {duration}秒 {height}p")
+        generate_test_video(source, duration, height)
+
+        results = {"duration": duration, "height": height, "cpus": available_cpus()}
+
+        start = time.time()
+        single = processor.create_proxy_with_counter(
+            source, os.path.join(work_dir, "single.mp4")
+        )
+        results["single"] = round(time.time() - start, 2)
+
+        start = time.time()
+        chunked = processor.create_proxy_chunked(
+            source, os.path.join(work_dir, "chunked.mp4")
+        )
+        results["chunked"] = round(time.time() - start, 2)
+
+        results["speedup"] = round(results["single"] / results["chunked"], 2)
+        results["frames"] = {
+            "single": count_frames(single),
+            "chunked": count_frames(chunked),
+        }
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
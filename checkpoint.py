@@ -0,0 +1,86 @@
+import os
+import hashlib
+import logging
+from botocore.exceptions import ClientError
+from transfer import ACCESS_DENIED_CODES, MISSING_KEY_CODES
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 检查点对象的前缀，建议为其配置S3生命周期规则清理中断后不再重试的任务
+CHECKPOINT_PREFIX = "checkpoints/"
+
+
+class SegmentCheckpoint:
+    def __init__(self, s3_client, bucket_name, prefix):
+        """
+        分段编码的检查点：每段编码完成后上传到S3，重试时下载已完成的分段，
+        只重新编码缺失的部分
+
+        Args:
+            s3_client: boto3 S3客户端
+            bucket_name (str): S3存储桶名称
+            prefix (str): 本任务检查点对象的前缀
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.restored = 0
+        self.saved = 0
+
+    @classmethod
+    def for_source(cls, s3_client, bucket_name, object_key, source_etag, params):
+        """
+        按源视频内容（ETag）和生成参数确定检查点位置，内容或参数变化后不会误用旧分段
+        """
+        token = hashlib.sha256(f"{source_etag}\n{params}".encode()).hexdigest()[:16]
+        stem = os.path.splitext(object_key)[0]
+        return cls(s3_client, bucket_name, f"{CHECKPOINT_PREFIX}{stem}/{token}/")
+
+    def restore(self, name, file_path):
+        """
+        下载已完成的分段
+
+        Returns:
+            bool: 存在检查点并已下载到file_path时返回True
+        """
+        try:
+            self.s3_client.download_file(self.bucket_name, self.prefix + name, file_path)
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code in MISSING_KEY_CODES:
+                return False
+            if code in ACCESS_DENIED_CODES:
+                # 没有s3:ListBucket权限时不存在的键也返回403
+                logger.warning(f"读取检查点被拒绝，重新编码该分段: {self.prefix}{name}")
+                return False
+            raise
+        self.restored += 1
+        logger.info(f"从检查点恢复分段: {self.prefix}{name}")
+        return True
+
+    def save(self, name, file_path):
+        """
+        上传编码完成的分段，失败只记录日志（不影响本次编码，只是重试时需要重新编码）
+        """
+        try:
+            self.s3_client.upload_file(file_path, self.bucket_name, self.prefix + name)
+            self.saved += 1
+        except Exception as e:
+            logger.warning(f"保存检查点失败: {self.prefix}{name} {e}")
+
+    def clear(self):
+        """
+        任务成功后删除本任务的所有检查点
+        """
+        try:
+            paginator = self.s3_client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self.prefix):
+                objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+                if objects:
+                    self.s3_client.delete_objects(
+                        Bucket=self.bucket_name, Delete={"Objects": objects}
+                    )
+        except Exception as e:
+            logger.warning(f"删除检查点失败: {self.prefix} {e}")
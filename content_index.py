@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ContentIndex:
+    def __init__(self, db_path):
+        """
+        内容摘要到已生成代理文件的本地索引
+
+        同一内容（摘要相同）以相同编码参数生成的代理文件可以直接服务端复制，
+        不需要重新转码。
+
+        Args:
+            db_path (str): sqlite数据库路径
+        """
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS content_index (
+                digest TEXT NOT NULL,
+                params TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                base_key TEXT NOT NULL,
+                proxy_keys TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (digest, params)
+            )
+            """
+        )
+        self.db.commit()
+        logger.info(f"内容索引已启用: {db_path}")
+
+    @classmethod
+    def from_env(cls):
+        """
+        根据环境变量CONTENT_INDEX_DB创建索引，未设置时返回None（不启用去重）
+        """
+        db_path = os.environ.get("CONTENT_INDEX_DB")
+        return cls(db_path) if db_path else None
+
+    def get(self, digest, params):
+        """
+        查询相同内容和参数的已有代理文件
+
+        Returns:
+            dict: bucket、base_key（代理文件键前缀）和proxy_keys，不存在时返回None
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT bucket, base_key, proxy_keys FROM content_index "
+                "WHERE digest = ? AND params = ?",
+                (digest, params),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"bucket": row[0], "base_key": row[1], "proxy_keys": json.loads(row[2])}
+
+    def put(self, digest, params, bucket_name, base_key, proxy_keys):
+        """
+        记录内容摘要对应的代理文件
+        """
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO content_index VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    digest,
+                    params,
+                    bucket_name,
+                    base_key,
+                    json.dumps(proxy_keys),
+                    time.time(),
+                ),
+            )
+            self.db.commit()
+
+    def remove(self, digest, params):
+        """
+        删除失效的索引条目（例如代理文件已被删除）
+        """
+        with self.lock:
+            self.db.execute(
+                "DELETE FROM content_index WHERE digest = ? AND params = ?",
+                (digest, params),
+            )
+            self.db.commit()
@@ -0,0 +1,387 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from scheduler import aged_cost
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class DurableQueue:
+    def __init__(self, db_path, max_attempts=None, history_limit=None, scheduling=None):
+        """
+        基于sqlite的持久任务队列，API进程只写入任务，独立的工作进程按租约领取执行
+
+        工作进程领取任务时获得一段时间的租约并定期续约（心跳）；进程崩溃或被杀后
+        租约过期，任务由其他工作进程重新领取。同一台机器上的多个工作进程可以共用
+        同一个数据库文件（WAL模式）。
+
+        Args:
+            db_path (str): sqlite数据库路径
+            max_attempts (int, optional): 租约过期后重新领取的最多次数，默认读取环境变量
+                JOB_MAX_ATTEMPTS，未设置时为3
+            history_limit (int, optional): 保留的已结束任务数量上限
+            scheduling (str, optional): 领取顺序，默认读取环境变量JOB_SCHEDULER：
+                "cost"（与本进程调度器相同的规则，参见claim）或 "fifo"（按入队顺序）
+        """
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        self.max_attempts = max_attempts or int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+        self.history_limit = history_limit or int(
+            os.environ.get("JOB_HISTORY_LIMIT", "1000")
+        )
+        self.scheduling = scheduling or os.environ.get("JOB_SCHEDULER", "cost")
+        if self.scheduling not in ("cost", "fifo"):
+            raise ValueError(f"不支持的调度方式: {self.scheduling}")
+        self.aging_seconds = float(os.environ.get("SCHEDULER_AGING_SECONDS", "60"))
+        self.lock = threading.Lock()
+        # 自动提交模式，写操作显式使用BEGIN IMMEDIATE，多进程并发时等待锁而不是失败
+        self.db = sqlite3.connect(
+            db_path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                func TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                with_progress INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                tenant TEXT,
+                cost REAL
+            )
+            """
+        )
+        # 旧版本创建的数据库没有调度字段
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in (("tenant", "TEXT"), ("cost", "REAL")):
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)"
+        )
+        logger.info(f"持久任务队列: {db_path}")
+
+    @classmethod
+    def from_env(cls):
+        """
+        根据环境变量JOB_QUEUE_DB创建队列
+        """
+        db_path = os.environ.get("JOB_QUEUE_DB")
+        if not db_path:
+            raise Exception("环境变量JOB_QUEUE_DB未设置")
+        return cls(db_path)
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.db
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def enqueue(
+        self,
+        kind,
+        func_name,
+        args=(),
+        kwargs=None,
+        with_progress=False,
+        tenant=None,
+        cost=None,
+    ):
+        """
+        写入一个任务
+
+        Args:
+            kind (str): 任务类型，例如 "create-proxy"
+            func_name (str): tasks模块中的任务函数名
+            args (tuple): 位置参数（必须可以JSON序列化）
+            kwargs (dict, optional): 关键字参数（必须可以JSON序列化）
+            with_progress (bool): 为True时工作进程向任务传入进度回调
+            tenant (str, optional): 公平分配的租户（对象键前缀），不指定时不参与代价调度
+            cost (float, optional): 入队时估算的代价，参见scheduler.estimate_cost
+
+        Returns:
+            str: 任务ID
+        """
+        job_id = uuid.uuid4().hex
+        payload = json.dumps({"args": list(args), "kwargs": kwargs or {}})
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO jobs (id, kind, func, payload, with_progress, status, "
+                "created_at, tenant, cost) VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (
+                    job_id,
+                    kind,
+                    func_name,
+                    payload,
+                    int(with_progress),
+                    time.time(),
+                    tenant,
+                    cost,
+                ),
+            )
+            # 只淘汰已结束的任务，排队和运行中的任务始终保留
+            db.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs "
+                "WHERE status IN ('succeeded', 'failed', 'cancelled') "
+                "ORDER BY finished_at DESC LIMIT -1 OFFSET ?)",
+                (self.history_limit,),
+            )
+        return job_id
+
+    def claim(self, worker_id, lease_seconds):
+        """
+        领取下一个可执行任务：租约已过期的运行中任务优先，然后是排队中的任务
+
+        scheduling为 "fifo" 时按入队顺序领取；为 "cost" 时按入队时记录的前缀和代价：
+        未指定前缀的任务（元数据、缩略图）按入队顺序先领取，与本进程模式下不经调度器
+        一致；其余任务从运行中代价之和最小的前缀中选取等待后有效代价最小的任务。
+        线程数准入由工作进程的并发数（JOB_WORKERS）和每个任务的ffmpeg线程数决定。
+
+        Returns:
+            dict: id、kind、func、args、kwargs、with_progress、attempts，没有任务时返回None
+        """
+        now = time.time()
+        with self._transaction() as db:
+            # 多次租约过期（例如每次都导致工作进程崩溃）的任务不再重试
+            db.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, lease_owner = NULL, "
+                "error = '工作进程多次中断，已放弃重试' "
+                "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            if self.scheduling == "cost":
+                row = db.execute(
+                    "SELECT id, kind, func, payload, with_progress, attempts, status "
+                    "FROM jobs WHERE status = 'running' AND lease_expires < ? "
+                    "ORDER BY created_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    row = self._select_by_cost(db, now)
+            else:
+                row = db.execute(
+                    "SELECT id, kind, func, payload, with_progress, attempts, status "
+                    "FROM jobs WHERE status = 'queued' "
+                    "OR (status = 'running' AND lease_expires < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+            if row is None:
+                return None
+            job_id, kind, func_name, payload, with_progress, attempts, status = row
+            db.execute(
+                "UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, started_at = COALESCE(started_at, ?) "
+                "WHERE id = ?",
+                (worker_id, now + lease_seconds, now, job_id),
+            )
+        if status == "running":
+            logger.warning(f"任务租约已过期，重新执行: {kind} {job_id} 第{attempts + 1}次")
+        payload = json.loads(payload)
+        return {
+            "id": job_id,
+            "kind": kind,
+            "func": func_name,
+            "args": payload["args"],
+            "kwargs": payload["kwargs"],
+            "with_progress": bool(with_progress),
+            "attempts": attempts + 1,
+        }
+
+    def _select_by_cost(self, db, now):
+        queued = db.execute(
+            "SELECT id, tenant, cost, created_at FROM jobs WHERE status = 'queued' "
+            "ORDER BY created_at"
+        ).fetchall()
+        if not queued:
+            return None
+        unscheduled = [row for row in queued if row[1] is None]
+        if unscheduled:
+            job_id = unscheduled[0][0]
+        else:
+            usage = dict(
+                db.execute(
+                    "SELECT tenant, SUM(cost) FROM jobs WHERE status = 'running' "
+                    "AND tenant IS NOT NULL GROUP BY tenant"
+                ).fetchall()
+            )
+            tenant = min({row[1] for row in queued}, key=lambda t: (usage.get(t) or 0, t))
+            # 同一前缀内按等待后的有效代价选取，相同时先入队的优先（min保持原顺序）
+            job_id = min(
+                (row for row in queued if row[1] == tenant),
+                key=lambda row: aged_cost(row[2] or 0, now - row[3], self.aging_seconds),
+            )[0]
+        return db.execute(
+            "SELECT id, kind, func, payload, with_progress, attempts, status FROM jobs "
+            "WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+
+    def heartbeat(self, job_id, worker_id, lease_seconds, progress=None):
+        """
+        续约并写入最新进度
+
+        Returns:
+            bool: 仍持有租约时返回True（租约已被其他工作进程接管时返回False）
+        """
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET lease_expires = ?, progress = COALESCE(?, progress) "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (
+                    time.time() + lease_seconds,
+                    json.dumps(progress) if progress is not None else None,
+                    job_id,
+                    worker_id,
+                ),
+            )
+            return cursor.rowcount == 1
+
+    def _finish(self, job_id, worker_id, status, result=None, error=None):
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ?, "
+                "lease_owner = NULL, lease_expires = NULL "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (
+                    status,
+                    time.time(),
+                    json.dumps(result) if result is not None else None,
+                    error,
+                    job_id,
+                    worker_id,
+                ),
+            )
+            if cursor.rowcount != 1:
+                logger.warning(f"任务租约已失效，忽略结果: {job_id}")
+                return False
+            return True
+
+    def complete(self, job_id, worker_id, result):
+        """
+        记录任务结果（只有仍持有租约的工作进程可以写入）
+        """
+        return self._finish(job_id, worker_id, "succeeded", result=result)
+
+    def fail(self, job_id, worker_id, error):
+        """
+        记录任务失败（任务本身抛出的异常不重试，只有租约过期才会重新执行）
+        """
+        return self._finish(job_id, worker_id, "failed", error=error)
+
+    def get(self, job_id):
+        """
+        获取任务状态，格式与JobManager.get相同
+
+        Returns:
+            dict: 任务状态，不存在时返回None
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id, kind, status, created_at, started_at, finished_at, "
+                "progress, result, error, attempts, lease_owner FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        (
+            job_id,
+            kind,
+            status,
+            created_at,
+            started_at,
+            finished_at,
+            progress,
+            result,
+            error,
+            attempts,
+            lease_owner,
+        ) = row
+
+        timing = {}
+        if started_at is not None:
+            timing["queued"] = round(started_at - created_at, 2)
+            timing["running"] = round((finished_at or time.time()) - started_at, 2)
+
+        return {
+            "id": job_id,
+            "kind": kind,
+            "status": status,
+            "timing": timing,
+            "progress": json.loads(progress) if progress else None,
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "attempts": attempts,
+            "worker": lease_owner,
+        }
+
+    def finished(self, job_ids):
+        """
+        用一次查询读取多个任务中已结束的任务（供等待结果的轮询线程使用）
+
+        Args:
+            job_ids (list): 任务ID
+
+        Returns:
+            dict: 任务ID -> (status, result, error)；已结束和不存在的任务才包含在内，
+                不存在的任务status为None
+        """
+        rows = []
+        # sqlite单条语句的参数个数有上限，分批查询
+        for i in range(0, len(job_ids), 500):
+            chunk = job_ids[i : i + 500]
+            with self.lock:
+                rows += self.db.execute(
+                    f"SELECT id, status, result, error FROM jobs "
+                    f"WHERE id IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+        found = {row[0] for row in rows}
+        finished = {job_id: (None, None, None) for job_id in job_ids if job_id not in found}
+        for job_id, status, result, error in rows:
+            if status in FINISHED_STATUSES:
+                finished[job_id] = (status, json.loads(result) if result else None, error)
+        return finished
+
+    def stats(self, by_kind=False):
+        """
+        返回各状态的任务数量
+
+        Args:
+            by_kind (bool): 为True时按 (任务类型, 状态) 分组
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status"
+            ).fetchall()
+        counts = {}
+        for kind, status, count in rows:
+            key = (kind, status) if by_kind else status
+            counts[key] = counts.get(key, 0) + count
+        return counts
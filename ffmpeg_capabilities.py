@@ -0,0 +1,168 @@
+import os
+import re
+import glob
+import shutil
+import subprocess
+import threading
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 常见发行版的字体位置，fontconfig不可用时依次尝试
+SYSTEM_FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
+    "/usr/share/fonts/noto/NotoSans-Regular.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/System/Library/Fonts/Supplemental/Arial.ttf",
+]
+
+# 编码器/滤镜列表每行开头的能力标志，例如 "V....D"、"TSC"、"..."
+FLAGS_PATTERN = re.compile(r"^[A-Z.|]+$")
+
+# 随代码一起部署的字体目录
+BUNDLED_FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+
+_font_path = None
+_font_resolved = False
+_capabilities = None
+_lock = threading.Lock()
+
+
+def resolve_font():
+    """
+    确定帧数计数器使用的字体文件，只解析一次，不访问网络
+
+    依次使用：环境变量FONT_PATH、代码目录下fonts/中的字体、fontconfig（fc-match）
+    匹配的无衬线字体、常见系统字体路径。
+
+    Returns:
+        str: 字体文件路径，都找不到时返回None（drawtext使用ffmpeg内置的fontconfig默认字体）
+    """
+    global _font_path, _font_resolved
+    if _font_resolved:
+        return _font_path
+    with _lock:
+        if _font_resolved:
+            return _font_path
+        candidates = [os.environ.get("FONT_PATH")]
+        candidates += sorted(glob.glob(os.path.join(BUNDLED_FONT_DIR, "*.[ot]tf")))
+        if shutil.which("fc-match"):
+            try:
+                result = subprocess.run(
+                    ["fc-match", "-f", "%{file}", "sans-serif"],
+                    capture_output=True,
+                    text=True,
+                    timeout=5,
+                )
+                candidates.append(result.stdout.strip())
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.warning(f"fc-match执行失败: {e}")
+        candidates += SYSTEM_FONT_PATHS
+
+        _font_path = next((p for p in candidates if p and os.path.isfile(p)), None)
+        if _font_path:
+            logger.info(f"帧数计数器字体: {_font_path}")
+        else:
+            logger.warning("未找到字体文件，drawtext将使用ffmpeg默认字体")
+        _font_resolved = True
+        return _font_path
+
+
+def _list_names(args):
+    # -encoders/-filters的输出：说明行（"V..... = Video"）之后每行为 "标志 名称 描述"
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", *args], capture_output=True, text=True, timeout=30
+    )
+    names = set()
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) < 2 or parts[1] == "=" or parts[0].endswith(":"):
+            continue
+        if FLAGS_PATTERN.match(parts[0]):
+            names.add(parts[1])
+    return names
+
+
+def get_capabilities(refresh=False):
+    """
+    探测ffmpeg版本、编码器和滤镜，结果在进程内缓存
+
+    Returns:
+        dict: available、version、encoders、filters，以及drawtext、libx264等常用能力
+    """
+    global _capabilities
+    if _capabilities is not None and not refresh:
+        return _capabilities
+    with _lock:
+        if _capabilities is not None and not refresh:
+            return _capabilities
+        capabilities = {
+            "available": False,
+            "version": None,
+            "encoders": [],
+            "filters": [],
+            "drawtext": False,
+            "libx264": False,
+            "error": None,
+        }
+        try:
+            result = subprocess.run(
+                ["ffmpeg", "-version"], capture_output=True, text=True, timeout=30
+            )
+            if result.returncode != 0:
+                capabilities["error"] = result.stderr
+            else:
+                encoders = _list_names(["-encoders"])
+                filters = _list_names(["-filters"])
+                capabilities.update(
+                    {
+                        "available": True,
+                        "version": result.stdout.split("\n")[0],
+                        "encoders": sorted(encoders),
+                        "filters": sorted(filters),
+                        "drawtext": "drawtext" in filters,
+                        "libx264": "libx264" in encoders,
+                    }
+                )
+        except (OSError, subprocess.SubprocessError) as e:
+            capabilities["error"] = str(e)
+        if capabilities["available"]:
+            logger.info(
+                f"ffmpeg能力: {capabilities['version']} drawtext={capabilities['drawtext']} "
+                f"libx264={capabilities['libx264']}"
+            )
+        else:
+            logger.error(f"ffmpeg不可用: {capabilities['error']}")
+        _capabilities = capabilities
+        return capabilities
+
+
+def check_proxy_request(add_text, renditions=None):
+    """
+    根据缓存的ffmpeg能力检查代理任务能否执行，提交任务前调用
+
+    Returns:
+        str: 不能执行的原因，可以执行时返回None
+    """
+    capabilities = get_capabilities()
+    if not capabilities["available"]:
+        return "ffmpeg不可用"
+    encoders = set(capabilities["encoders"])
+    counters = [add_text]
+    codecs = ["libx264"]
+    if renditions:
+        # 指定多个输出时只生成这些输出，默认值与_normalize_rendition一致
+        videos = [r for r in renditions if r.get("type", "video") == "video"]
+        counters = [r.get("counter", add_text) for r in videos]
+        codecs = [r.get("codec", "libx264") for r in videos]
+    if any(counters) and not capabilities["drawtext"]:
+        return "ffmpeg不支持drawtext滤镜，无法添加帧数计数器"
+    missing = sorted({codec for codec in codecs if codec not in encoders})
+    if missing:
+        return f"ffmpeg不支持编码器: {', '.join(missing)}"
+    return None
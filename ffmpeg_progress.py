@@ -0,0 +1,80 @@
+import re
+import time
+
+# ffmpeg在stderr头部输出的输入时长，例如 "Duration: 00:01:02.03"
+DURATION_PATTERN = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+def parse_duration(line):
+    """
+    从ffmpeg的stderr行中解析输入时长
+
+    Returns:
+        float: 时长（秒），该行不包含时长时返回None
+    """
+    match = DURATION_PATTERN.search(line)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+class ProgressParser:
+    def __init__(self, duration=None):
+        """
+        增量解析 ffmpeg -progress 输出的 key=value 块
+
+        每个块以 progress=continue 或 progress=end 结束。
+
+        Args:
+            duration (float, optional): 输入时长（秒），用于计算完成百分比和预计剩余时间
+        """
+        self.duration = duration
+        self.fields = {}
+        self.started_at = time.time()
+
+    def feed(self, line):
+        """
+        输入一行进度输出
+
+        Returns:
+            dict: 一个块结束时返回进度快照，否则返回None
+        """
+        line = line.strip()
+        if "=" not in line:
+            return None
+        key, value = line.split("=", 1)
+        self.fields[key] = value.strip()
+        if key != "progress":
+            return None
+        return self.snapshot()
+
+    def snapshot(self):
+        fields = self.fields
+        out_time = None
+        if fields.get("out_time_us", "N/A") not in ("N/A", ""):
+            out_time = max(0, int(fields["out_time_us"])) / 1000000
+        speed = None
+        if fields.get("speed", "N/A").rstrip("x") not in ("N/A", ""):
+            speed = float(fields["speed"].rstrip("x"))
+        fps = None
+        if fields.get("fps") not in (None, "", "N/A"):
+            fps = float(fields["fps"])
+
+        progress = {
+            "frame": int(fields["frame"]) if fields.get("frame", "").isdigit() else None,
+            "fps": fps,
+            "speed": speed,
+            "out_time": round(out_time, 2) if out_time is not None else None,
+            "elapsed": round(time.time() - self.started_at, 2),
+            "percent": None,
+            "eta": None,
+            # 编码速度低于实时，长视频会明显排队
+            "slow": speed is not None and speed < 1,
+            "done": fields.get("progress") == "end",
+        }
+        if self.duration and out_time is not None:
+            progress["percent"] = round(min(100.0, out_time / self.duration * 100), 1)
+            if speed:
+                progress["eta"] = round(max(0.0, (self.duration - out_time) / speed), 1)
+        return progress
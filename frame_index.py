@@ -0,0 +1,127 @@
+import json
+import struct
+import subprocess
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 帧索引（.fidx）二进制格式，全部为小端序：
+#   头部 24字节: b"FIDX", 版本(u16), 保留(u16), 时间基分子(u32), 时间基分母(u32),
+#               帧数(u32), 关键帧数(u32)
+#   帧表:       帧数 x pts(i64)，按显示顺序，第i项即画面中计数器为i的帧
+#   关键帧表:   关键帧数 x (帧号(u32), 字节偏移(u64))，按帧号升序
+# 定位第N帧：在关键帧表中二分查找帧号不大于N的关键帧，从其字节偏移开始Range读取并解码到第N帧。
+FRAME_INDEX_MAGIC = b"FIDX"
+FRAME_INDEX_VERSION = 1
+HEADER = struct.Struct("<4sHHIIII")
+KEYFRAME = struct.Struct("<IQ")
+
+# 帧索引格式对应的扩展名和Content-Type
+FRAME_INDEX_FORMATS = {
+    "binary": (".fidx", "application/octet-stream"),
+    "json": (".fidx.json", "application/json"),
+}
+
+
+def probe_frame_index(file_path):
+    """
+    读取本地代理文件视频流的每帧pts和关键帧字节偏移（只解封装，不解码）
+
+    Args:
+        file_path (str): 本地视频文件路径（已完成写入，faststart后的偏移即最终偏移）
+
+    Returns:
+        dict: time_base（[分子, 分母]）、pts（按显示顺序）、keyframes（[帧号, 字节偏移]）
+    """
+    cmd = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=time_base:packet=pts,pos,flags",
+        "-of",
+        "csv",
+        file_path,
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"读取帧索引失败: {result.stderr}")
+
+    time_base = None
+    packets = []
+    for line in result.stdout.splitlines():
+        parts = line.split(",")
+        if parts[0] == "stream" and len(parts) >= 2:
+            num, den = parts[1].split("/")
+            time_base = [int(num), int(den)]
+        elif parts[0] == "packet" and len(parts) >= 4 and parts[1] != "N/A":
+            pos = int(parts[2]) if parts[2] != "N/A" else None
+            packets.append((int(parts[1]), pos, "K" in parts[3]))
+    if time_base is None:
+        raise Exception(f"没有视频流: {file_path}")
+
+    # packet按解码顺序排列，有B帧时与显示顺序不同
+    packets.sort(key=lambda packet: packet[0])
+    keyframes = [
+        [frame, pos]
+        for frame, (_, pos, key) in enumerate(packets)
+        if key and pos is not None
+    ]
+    return {
+        "time_base": time_base,
+        "pts": [packet[0] for packet in packets],
+        "keyframes": keyframes,
+    }
+
+
+def encode_frame_index(index, fmt="binary"):
+    """
+    把帧索引编码为二进制（格式见模块开头）或JSON
+
+    Returns:
+        bytes: 文件内容
+    """
+    if fmt == "json":
+        return json.dumps(index, separators=(",", ":")).encode()
+    if fmt != "binary":
+        raise ValueError(f"不支持的帧索引格式: {fmt}")
+    pts = index["pts"]
+    keyframes = index["keyframes"]
+    parts = [
+        HEADER.pack(
+            FRAME_INDEX_MAGIC,
+            FRAME_INDEX_VERSION,
+            0,
+            index["time_base"][0],
+            index["time_base"][1],
+            len(pts),
+            len(keyframes),
+        ),
+        struct.pack(f"<{len(pts)}q", *pts),
+    ]
+    parts += [KEYFRAME.pack(frame, pos) for frame, pos in keyframes]
+    return b"".join(parts)
+
+
+def decode_frame_index(data):
+    """
+    解析二进制帧索引，返回与probe_frame_index相同的结构
+    """
+    magic, version, _, num, den, frames, keyframes = HEADER.unpack_from(data)
+    if magic != FRAME_INDEX_MAGIC or version != FRAME_INDEX_VERSION:
+        raise ValueError("不是支持的帧索引文件")
+    offset = HEADER.size
+    pts = list(struct.unpack_from(f"<{frames}q", data, offset))
+    offset += frames * 8
+    return {
+        "time_base": [num, den],
+        "pts": pts,
+        "keyframes": [
+            list(KEYFRAME.unpack_from(data, offset + i * KEYFRAME.size))
+            for i in range(keyframes)
+        ],
+    }
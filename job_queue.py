@@ -0,0 +1,367 @@
+import os
+import threading
+import time
+import uuid
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from scheduler import CostScheduler
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ProgressSink:
+    """
+    进程池模式下的进度回调：写入Manager共享字典，可以被pickle传给工作进程
+    """
+
+    def __init__(self, shared_progress, job_id):
+        self.shared_progress = shared_progress
+        self.job_id = job_id
+
+    def __call__(self, progress):
+        self.shared_progress[self.job_id] = progress
+
+
+class JobManager:
+    def __init__(
+        self, max_workers=None, executor_type=None, history_limit=None, initializer=None
+    ):
+        """
+        初始化任务管理器和工作池
+
+        Args:
+            max_workers (int, optional): 工作池大小，默认读取环境变量JOB_WORKERS
+            executor_type (str, optional): "thread" 或 "process"，默认读取环境变量JOB_EXECUTOR
+            history_limit (int, optional): 保留的已完成任务数量上限
+            initializer (callable, optional): 每个工作进程启动时执行的初始化函数
+        """
+        self.max_workers = max_workers or int(os.environ.get("JOB_WORKERS", "2"))
+        self.executor_type = executor_type or os.environ.get("JOB_EXECUTOR", "thread")
+        self.history_limit = history_limit or int(
+            os.environ.get("JOB_HISTORY_LIMIT", "1000")
+        )
+
+        self.shared_progress = None
+        if self.executor_type == "process":
+            self.manager = multiprocessing.Manager()
+            self.shared_progress = self.manager.dict()
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=initializer
+            )
+        elif self.executor_type == "thread":
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="job-worker"
+            )
+            # 线程共享同一个进程，初始化一次即可；在工作线程中执行，不阻塞启动
+            if initializer is not None:
+                self.executor.submit(initializer)
+        else:
+            raise ValueError(f"不支持的执行器类型: {self.executor_type}")
+
+        # 代理任务经调度器按代价、前缀和核数决定执行顺序（JOB_SCHEDULER=fifo时不启用）
+        self.scheduler = CostScheduler.from_env(self.max_workers)
+
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        logger.info(
+            f"任务管理器已启动: {self.executor_type} x {self.max_workers}"
+        )
+
+    def submit(self, kind, func, *args, with_progress=False, schedule=None, **kwargs):
+        """
+        提交任务到工作池，立即返回任务ID
+
+        Args:
+            kind (str): 任务类型，例如 "create-proxy"
+            func (callable): 任务函数（进程池模式下必须是模块级函数）
+            with_progress (bool): 为True时以progress_callback参数向任务传入进度回调
+            schedule (dict, optional): 调度参数tenant和estimate（参见tasks.proxy_schedule），
+                指定时任务经调度器排队，否则直接进入工作池
+
+        Returns:
+            str: 任务ID
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "progress": None,
+        }
+        if with_progress:
+            if self.executor_type == "thread":
+                kwargs["progress_callback"] = lambda p: self._update(job, progress=p)
+            else:
+                kwargs["progress_callback"] = ProgressSink(self.shared_progress, job_id)
+        with self.lock:
+            self.jobs[job_id] = job
+            self._trim_history()
+
+        def start():
+            # 线程池模式下可以在工作线程中直接更新任务状态
+            if self.executor_type == "thread":
+                return self.executor.submit(self._run, job, func, *args, **kwargs)
+            return self.executor.submit(func, *args, **kwargs)
+
+        if schedule is not None and self.scheduler is not None:
+            future = self.scheduler.submit(
+                start, schedule["tenant"], estimate=schedule.get("estimate")
+            )
+        else:
+            future = start()
+        self._update(job, future=future)
+        future.add_done_callback(lambda f: self._on_done(job, f))
+
+        logger.info(f"任务已提交: {kind} {job_id}")
+        return job_id
+
+    def _update(self, job, **fields):
+        # 工作线程和回调中更新任务状态，与get/stats的读取使用同一把锁
+        with self.lock:
+            job.update(fields)
+
+    def _run(self, job, func, *args, **kwargs):
+        self._update(job, status="running", started_at=time.time())
+        return func(*args, **kwargs)
+
+    def _on_done(self, job, future):
+        finished_at = time.time()
+        if future.cancelled():
+            self._update(job, status="cancelled", finished_at=finished_at)
+            return
+        error = future.exception()
+        if error is not None:
+            self._update(job, status="failed", error=str(error), finished_at=finished_at)
+            logger.error(f"任务失败: {job['kind']} {job['id']} {error}")
+        else:
+            self._update(
+                job, status="succeeded", result=future.result(), finished_at=finished_at
+            )
+            logger.info(f"任务完成: {job['kind']} {job['id']}")
+
+    def _trim_history(self):
+        # 只淘汰已结束的任务，排队和运行中的任务始终保留
+        excess = len(self.jobs) - self.history_limit
+        if excess <= 0:
+            return
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id]["status"] in ("succeeded", "failed", "cancelled"):
+                del self.jobs[job_id]
+                if self.shared_progress is not None:
+                    self.shared_progress.pop(job_id, None)
+                excess -= 1
+
+    def get(self, job_id):
+        """
+        获取任务状态
+
+        Args:
+            job_id (str): 任务ID
+
+        Returns:
+            dict: 任务状态，不存在时返回None
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            status = job["status"]
+            future = job.get("future")
+            # 进程池模式下通过future推断是否已开始运行
+            if status == "queued" and future is not None and future.running():
+                status = "running"
+                if job["started_at"] is None:
+                    job["started_at"] = time.time()
+            # 在锁内复制，之后的读取不会看到工作线程更新了一半的状态
+            job = dict(job)
+
+        progress = job["progress"]
+        if progress is None and self.shared_progress is not None:
+            progress = self.shared_progress.get(job_id)
+
+        timing = {}
+        if job["started_at"] is not None:
+            timing["queued"] = round(job["started_at"] - job["created_at"], 2)
+            end = job["finished_at"] or time.time()
+            timing["running"] = round(end - job["started_at"], 2)
+
+        return {
+            "id": job["id"],
+            "kind": job["kind"],
+            "status": status,
+            "timing": timing,
+            "progress": progress,
+            "result": job["result"],
+            "error": job["error"],
+        }
+
+    def get_future(self, job_id):
+        """
+        获取任务对应的future，可用asyncio.wrap_future在事件循环中等待
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job.get("future") if job else None
+
+    def stats(self, by_kind=False):
+        """
+        返回各状态的任务数量
+
+        Args:
+            by_kind (bool): 为True时按 (任务类型, 状态) 分组
+        """
+        counts = {}
+        with self.lock:
+            jobs = [
+                (job["kind"], job["status"], job.get("future"))
+                for job in self.jobs.values()
+            ]
+        for kind, status, future in jobs:
+            # 进程池模式下通过future推断是否已开始运行
+            if status == "queued" and future is not None and future.running():
+                status = "running"
+            key = (kind, status) if by_kind else status
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def shutdown(self, wait=True):
+        if self.scheduler is not None:
+            self.scheduler.shutdown(wait=wait)
+        self.executor.shutdown(wait=wait)
+        if self.shared_progress is not None:
+            self.manager.shutdown()
+
+
+class DurableJobManager:
+    def __init__(self, queue, poll_interval=0.5):
+        """
+        把任务写入持久队列的任务管理器，接口与JobManager相同
+
+        API进程只负责入队和查询，任务由独立的工作进程（python -m video_processor worker）
+        领取执行，编码能力可以独立于Web副本扩容，重新部署Web服务也不会中断任务。
+
+        Args:
+            queue (DurableQueue): 持久任务队列
+            poll_interval (float): 等待任务结果时轮询队列的间隔（秒）
+        """
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.watcher = threading.Thread(
+            target=self._watch, name="job-watch", daemon=True
+        )
+        self.watcher.start()
+        logger.info("任务管理器已启动: 持久队列，由独立工作进程执行")
+
+    def submit(self, kind, func, *args, with_progress=False, schedule=None, **kwargs):
+        """
+        写入持久队列，立即返回任务ID
+
+        Args:
+            kind (str): 任务类型，例如 "create-proxy"
+            func (callable): tasks模块中的任务函数，按函数名入队
+            with_progress (bool): 为True时工作进程以progress_callback参数传入进度回调
+            schedule (dict, optional): 调度参数tenant和estimate（参见tasks.proxy_schedule），
+                入队时估算代价并与前缀一起写入队列，工作进程按代价和前缀领取
+
+        Returns:
+            str: 任务ID
+        """
+        tenant = cost = None
+        if schedule is not None and self.queue.scheduling == "cost":
+            tenant = schedule["tenant"]
+            if schedule.get("estimate") is not None:
+                try:
+                    cost = schedule["estimate"]()
+                except Exception as e:
+                    logger.warning(f"估算任务代价失败，使用默认代价: {e}")
+            if cost is None:
+                cost = float(os.environ.get("SCHEDULER_DEFAULT_COST", "600"))
+        job_id = self.queue.enqueue(
+            kind,
+            func.__name__,
+            args,
+            kwargs,
+            with_progress=with_progress,
+            tenant=tenant,
+            cost=cost,
+        )
+        logger.info(f"任务已入队: {kind} {job_id}")
+        return job_id
+
+    def get(self, job_id):
+        return self.queue.get(job_id)
+
+    def get_future(self, job_id):
+        """
+        获取在任务结束时完成的future，可用asyncio.wrap_future在事件循环中等待
+        """
+        if self.queue.get(job_id) is None:
+            return None
+        with self.lock:
+            future = self.futures.get(job_id)
+            if future is None:
+                future = Future()
+                future.set_running_or_notify_cancel()
+                self.futures[job_id] = future
+        return future
+
+    def _watch(self):
+        # 所有等待中的future共用这一个轮询线程，每轮用一次查询读取它们的状态
+        while not self.stopped.wait(self.poll_interval):
+            with self.lock:
+                pending = list(self.futures)
+            if not pending:
+                continue
+            try:
+                finished = self.queue.finished(pending)
+            except Exception as e:
+                logger.error(f"查询任务状态失败: {e}")
+                continue
+            for job_id, (status, result, error) in finished.items():
+                with self.lock:
+                    future = self.futures.pop(job_id, None)
+                if future is None:
+                    continue
+                if status is None:
+                    future.set_exception(Exception(f"任务不存在: {job_id}"))
+                elif status == "succeeded":
+                    future.set_result(result)
+                else:
+                    future.set_exception(Exception(error or status))
+
+    def stats(self, by_kind=False):
+        return self.queue.stats(by_kind=by_kind)
+
+    def shutdown(self, wait=True):
+        self.stopped.set()
+        if wait:
+            self.watcher.join()
+
+
+def create_job_manager(initializer=None):
+    """
+    根据环境变量JOB_BACKEND创建任务管理器："local"（默认，在本进程的工作池中执行）
+    或 "queue"（写入JOB_QUEUE_DB持久队列，由独立工作进程执行）
+    """
+    backend = os.environ.get("JOB_BACKEND", "local")
+    if backend == "queue":
+        from durable_queue import DurableQueue
+
+        return DurableJobManager(DurableQueue.from_env())
+    if backend != "local":
+        raise ValueError(f"不支持的任务后端: {backend}")
+    return JobManager(initializer=initializer)
@@ -1,15 +1,91 @@
-from fastapi import FastAPI, HTTPException
+import time
+
+# 尽早记录导入开始时间，进程启动时间不可读时作为冷启动计时的起点
+IMPORT_START = time.time()
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
+from typing import List, Optional
 import os
-import subprocess
-from video_processor import VideoProcessor
+import json
+import asyncio
+from job_queue import create_job_manager
+from watcher import PrefixWatcher, is_source_key, source_extensions
+import ffmpeg_capabilities
+import tasks
+import metrics
 import logging
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+def process_start_time():
+    """
+    读取进程的实际启动时间（包含解释器启动），非Linux平台返回None
+    """
+    try:
+        # /proc/self/stat第22列为进程启动时间（开机后的时钟周期数）
+        with open("/proc/self/stat") as f:
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+PROCESS_START = process_start_time() or IMPORT_START
+
 app = FastAPI()
+metrics.record_startup("import", time.time() - PROCESS_START)
+
+# 任务管理器：工作池大小和类型通过环境变量JOB_WORKERS、JOB_EXECUTOR配置；
+# JOB_BACKEND=queue时只写入持久队列，由独立的工作进程执行
+job_manager = None
+
+# 前缀监听器：设置WATCH_PREFIX时自动为新上传的视频提交代理任务（多副本部署时只在一个副本上设置）
+prefix_watcher = None
+
+@app.on_event("startup")
+async def startup():
+    global job_manager, prefix_watcher
+    # 启动时创建共享的视频处理器，请求路径上不再构造S3客户端
+    job_manager = create_job_manager(initializer=tasks.init_worker)
+    metrics.register_runtime(job_manager, tasks.scratch)
+    prefix_watcher = PrefixWatcher.from_env(job_manager)
+    if prefix_watcher is not None:
+        prefix_watcher.start()
+    # 后台探测ffmpeg能力并缓存，不阻塞接收第一个请求
+    asyncio.get_running_loop().run_in_executor(None, ffmpeg_capabilities.get_capabilities)
+    ready = time.time() - PROCESS_START
+    metrics.record_startup("ready", ready)
+    logger.info(f"服务启动耗时: {ready:.3f}秒")
+
+_first_response_logged = False
+
+@app.middleware("http")
+async def measure_first_response(request: Request, call_next):
+    """
+    记录进程启动到第一个响应的耗时（缩容到零后冷启动计入请求延迟）
+    """
+    global _first_response_logged
+    response = await call_next(request)
+    if not _first_response_logged:
+        _first_response_logged = True
+        elapsed = time.time() - PROCESS_START
+        metrics.record_startup("first_response", elapsed)
+        logger.info(f"启动到首个响应耗时: {elapsed:.3f}秒 ({request.url.path})")
+    return response
+
+@app.on_event("shutdown")
+async def shutdown():
+    if prefix_watcher is not None:
+        prefix_watcher.stop()
+    if job_manager is not None:
+        job_manager.shutdown(wait=False)
 
 @app.get("/")
 async def root():
@@ -28,114 +104,361 @@ async def calculate(num1: float, num2: float):
     }
 
 @app.get("/check-ffmpeg")
-async def check_ffmpeg():
+async def check_ffmpeg(refresh: bool = False):
     """
     检查ffmpeg是否正确安装
+
+    版本、编码器和滤镜只在启动后探测一次并缓存，refresh=true时重新探测
     """
     try:
-        # 运行ffmpeg -version命令
-        result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True)
-        if result.returncode == 0:
-            # 提取版本信息
-            version_info = result.stdout.split('\n')[0]
+        capabilities = await asyncio.to_thread(
+            ffmpeg_capabilities.get_capabilities, refresh
+        )
+        if capabilities["available"]:
             return {
                 "status": "success",
                 "message": "ffmpeg已正确安装",
-                "version": version_info
+                "version": capabilities["version"],
+                "drawtext": capabilities["drawtext"],
+                "libx264": capabilities["libx264"],
+                "font": ffmpeg_capabilities.resolve_font(),
             }
         else:
             return {
                 "status": "error",
                 "message": "ffmpeg安装检查失败",
-                "error": result.stderr
+                "error": capabilities["error"]
             }
     except Exception as e:
         logger.error(f"检查ffmpeg失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"检查ffmpeg失败: {str(e)}")
 
+async def validate_proxy_request(add_text, renditions=None):
+    """
+    根据缓存的ffmpeg能力在提交前拒绝无法执行的代理任务
+    """
+    reason = await asyncio.to_thread(
+        ffmpeg_capabilities.check_proxy_request, add_text, renditions
+    )
+    if reason is None:
+        return
+    capabilities = ffmpeg_capabilities.get_capabilities()
+    raise HTTPException(status_code=400 if capabilities["available"] else 503, detail=reason)
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Prometheus文本格式的指标：各阶段耗时、传输字节数、编码速度、任务队列和临时空间
+    """
+    content, content_type = await asyncio.to_thread(metrics.render)
+    return Response(content=content, media_type=content_type)
+
+@app.get("/watch")
+async def get_watch_status():
+    """
+    前缀监听器的状态：最近一次扫描和索引中各状态的对象数
+    """
+    if prefix_watcher is None:
+        raise HTTPException(status_code=404, detail="未启用前缀监听（环境变量WATCH_PREFIX未设置）")
+    return await asyncio.to_thread(prefix_watcher.status)
+
 # 定义请求模型
+class Rendition(BaseModel):
+    name: Optional[str] = Field(None, description="输出名称，上传为 proxy/<key>_<name>.<ext>")
+    type: str = Field("video", description="输出类型: video、thumbnail、sprite")
+    height: Optional[int] = Field(None, description="输出高度")
+    fps: Optional[float] = Field(None, description="视频帧率")
+    counter: Optional[bool] = Field(None, description="是否添加帧数计数器，默认跟随add_text")
+    codec: Optional[str] = Field(None, description="视频编码器")
+    preset: Optional[str] = Field(None, description="编码预设")
+    crf: Optional[int] = Field(None, description="视频质量参数")
+    audio: Optional[bool] = Field(None, description="是否包含音频")
+    audio_bitrate: Optional[str] = Field(None, description="音频码率")
+    time: Optional[float] = Field(None, description="海报帧时间（秒）")
+    interval: Optional[float] = Field(None, description="拼图取帧间隔（秒）")
+    columns: Optional[int] = Field(None, description="拼图列数")
+    rows: Optional[int] = Field(None, description="拼图行数")
+    format: Optional[str] = Field(None, description="图片格式: jpg、webp、png")
+
 class VideoRequest(BaseModel):
     object_key: str = Field(..., description="S3对象键（路径）")
     add_text: bool = Field(True, description="是否添加帧数计数器")
+    renditions: Optional[List[Rendition]] = Field(
+        None, description="一次解码生成的多个输出，不指定则只生成默认代理文件"
+    )
+    force: bool = Field(False, description="即使已有最新的代理文件也重新编码")
+    output_mode: Optional[str] = Field(
+        None, description="输出方式: file、stream、hls，默认环境变量PROXY_OUTPUT_MODE"
+    )
+
+def get_bucket_name():
+    """
+    从环境变量获取存储桶名称
+    """
+    bucket_name = os.environ.get("AWS_BUCKET_NAME")
+    if not bucket_name:
+        raise HTTPException(status_code=500, detail="环境变量AWS_BUCKET_NAME未设置")
+    return bucket_name
+
+class ThumbnailRequest(BaseModel):
+    object_key: str = Field(..., description="S3对象键（路径）")
+    times: Optional[List[float]] = Field(None, description="取帧时间点（秒）")
+    count: Optional[int] = Field(None, description="均匀分布的帧数，默认10")
+    interval: Optional[float] = Field(None, description="取帧间隔（秒），拼图默认10")
+    height: Optional[int] = Field(None, description="图片高度，默认单帧540、拼图每格90")
+    format: str = Field("jpg", description="图片格式: jpg、webp、png")
+    sprite: bool = Field(False, description="是否拼成拼图并生成WebVTT索引")
+    columns: int = Field(10, description="拼图列数")
+    rows: int = Field(10, description="拼图行数")
+    exact: Optional[bool] = Field(None, description="是否精确到时间点，默认单帧精确、拼图取关键帧")
+
+class BatchRequest(BaseModel):
+    operation: str = Field("proxy", description="批量操作: proxy（创建代理文件）或 metadata（获取元数据）")
+    keys: Optional[List[str]] = Field(None, description="S3对象键列表")
+    prefix: Optional[str] = Field(None, description="对象键前缀，会分页列出前缀下的源视频（跳过输出前缀和非视频文件）")
+    add_text: bool = Field(True, description="是否添加帧数计数器")
+    concurrency: Optional[int] = Field(None, description="同时执行的任务数上限")
 
 @app.post("/process-video")
 async def process_video(request: VideoRequest):
     """
-    处理S3中的视频文件
+    提交视频处理任务，立即返回任务ID
     
+    后台任务会：
     1. 从S3下载视频
     2. 获取视频元数据
     3. 删除临时文件
-    4. 返回元数据
+    结果通过 GET /jobs/{job_id} 查询
     """
+    bucket_name = get_bucket_name()
     try:
-        # 从环境变量获取存储桶名称
-        bucket_name = os.environ.get("AWS_BUCKET_NAME")
-        if not bucket_name:
-            raise HTTPException(status_code=500, detail="环境变量AWS_BUCKET_NAME未设置")
-            
-        # 获取AWS凭证（优先从环境变量获取）
-        aws_access_key_id = os.environ.get("AWS_ACCESS_KEY_ID")
-        aws_secret_access_key = os.environ.get("AWS_SECRET_ACCESS_KEY")
-        region_name = os.environ.get("AWS_REGION", "us-east-1")
-        
-        # 初始化视频处理器
-        processor = VideoProcessor(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name
+        logger.info(f"提交视频处理任务: {bucket_name}/{request.object_key}")
+        job_id = await asyncio.to_thread(
+            job_manager.submit,
+            "process-video",
+            tasks.run_process_video,
+            bucket_name,
+            request.object_key,
         )
-        
-        # 处理视频
-        logger.info(f"开始处理视频: {bucket_name}/{request.object_key}")
-        metadata = processor.process_video(bucket_name, request.object_key)
-        
         return {
-            "status": "success",
-            "message": "视频处理成功",
-            "metadata": metadata
+            "status": "accepted",
+            "message": "视频处理任务已提交",
+            "job_id": job_id
         }
     except Exception as e:
-        logger.error(f"视频处理失败: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"视频处理失败: {str(e)}")
+        logger.error(f"提交视频处理任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"提交视频处理任务失败: {str(e)}")
 
 @app.post("/create-proxy")
 async def create_proxy(request: VideoRequest):
     """
-    为S3中的视频创建代理文件（720p 30fps带帧数计数器）
+    提交代理文件创建任务（540p 30fps带帧数计数器），立即返回任务ID
     
+    后台任务会：
     1. 从S3下载视频
-    2. 创建720p 30fps的代理文件，并添加帧数计数器
+    2. 创建540p 30fps的代理文件，并添加帧数计数器
     3. 上传代理文件到S3
-    4. 返回原始文件和代理文件的信息
+    结果（包含processing_times）通过 GET /jobs/{job_id} 查询
+    """
+    bucket_name = get_bucket_name()
+    renditions = (
+        [r.model_dump(exclude_none=True) for r in request.renditions]
+        if request.renditions
+        else None
+    )
+    if request.output_mode not in (None, "file", "stream", "hls"):
+        raise HTTPException(status_code=400, detail=f"不支持的输出方式: {request.output_mode}")
+    await validate_proxy_request(request.add_text, renditions)
+    try:
+        logger.info(f"提交代理文件创建任务: {bucket_name}/{request.object_key}")
+        job_id = await asyncio.to_thread(
+            job_manager.submit,
+            "create-proxy",
+            tasks.run_create_proxy,
+            bucket_name,
+            request.object_key,
+            with_progress=True,
+            schedule=tasks.proxy_schedule(
+                bucket_name, request.object_key, request.add_text, renditions
+            ),
+            add_text=request.add_text,
+            renditions=renditions,
+            force=request.force,
+            output_mode=request.output_mode,
+        )
+        return {
+            "status": "accepted",
+            "message": "代理文件创建任务已提交",
+            "job_id": job_id
+        }
+    except Exception as e:
+        logger.error(f"提交代理文件创建任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"提交代理文件创建任务失败: {str(e)}")
+
+@app.post("/thumbnails")
+async def create_thumbnails(request: ThumbnailRequest):
+    """
+    提交缩略图任务，立即返回任务ID
+
+    通过预签名URL在各时间点定位取帧（不下载整个视频），上传到
+    thumbnails/<key>/ 前缀下：单帧为thumb_NNNN.<format>，拼图为sprite_NNN.<format>
+    和sprite.vtt
     """
+    if request.format not in ("jpg", "webp", "png"):
+        raise HTTPException(status_code=400, detail=f"不支持的图片格式: {request.format}")
+    if request.format == "webp":
+        capabilities = await asyncio.to_thread(ffmpeg_capabilities.get_capabilities)
+        if "libwebp" not in capabilities["encoders"]:
+            raise HTTPException(status_code=400, detail="ffmpeg不支持编码器: libwebp")
+    bucket_name = get_bucket_name()
+    options = request.model_dump(exclude={"object_key", "format"}, exclude_none=True)
+    options["fmt"] = request.format
     try:
-        # 从环境变量获取存储桶名称
-        bucket_name = os.environ.get("AWS_BUCKET_NAME")
-        if not bucket_name:
-            raise HTTPException(status_code=500, detail="环境变量AWS_BUCKET_NAME未设置")
-            
-        # 获取AWS凭证
-        aws_access_key_id = os.environ.get("AWS_ACCESS_KEY_ID")
-        aws_secret_access_key = os.environ.get("AWS_SECRET_ACCESS_KEY")
-        region_name = os.environ.get("AWS_REGION", "us-east-1")
-        
-        # 初始化视频处理器
-        processor = VideoProcessor(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name
+        logger.info(f"提交缩略图任务: {bucket_name}/{request.object_key}")
+        job_id = await asyncio.to_thread(
+            job_manager.submit,
+            "thumbnails",
+            tasks.run_create_thumbnails,
+            bucket_name,
+            request.object_key,
+            with_progress=True,
+            options=options,
         )
-        
-        # 处理视频并创建代理文件
-        logger.info(f"开始创建代理文件: {bucket_name}/{request.object_key}")
-        result = processor.process_and_upload_proxy(bucket_name, request.object_key, add_text=request.add_text)
-        
         return {
-            "status": "success",
-            "message": "代理文件创建成功",
-            "data": result
+            "status": "accepted",
+            "message": "缩略图任务已提交",
+            "job_id": job_id
         }
     except Exception as e:
-        logger.error(f"创建代理文件失败: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"创建代理文件失败: {str(e)}")
+        logger.error(f"提交缩略图任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"提交缩略图任务失败: {str(e)}")
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    查询任务状态和结果
+    """
+    job = await asyncio.to_thread(job_manager.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, interval: float = 1.0):
+    """
+    以Server-Sent Events推送任务状态和编码进度，任务结束后关闭连接
+    """
+    if await asyncio.to_thread(job_manager.get, job_id) is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+
+    async def event_stream():
+        while True:
+            job = await asyncio.to_thread(job_manager.get, job_id)
+            if job is None:
+                break
+            yield f"data: {json.dumps(job, ensure_ascii=False)}\n\n"
+            if job["status"] in ("succeeded", "failed", "cancelled"):
+                break
+            await asyncio.sleep(max(0.2, interval))
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.post("/batch")
+async def batch(request: BatchRequest):
+    """
+    批量处理多个对象键，按完成顺序以NDJSON逐行返回结果，最后一行为汇总
+
+    对象键来自keys和/或prefix（分页list_objects_v2，只保留源视频，过滤规则与前缀监听相同），
+    去重后提交到共享工作池，同时在途的任务数不超过concurrency（默认环境变量BATCH_CONCURRENCY）。
+    """
+    if request.operation not in ("proxy", "metadata"):
+        raise HTTPException(status_code=400, detail=f"不支持的批量操作: {request.operation}")
+    if not request.keys and request.prefix is None:
+        raise HTTPException(status_code=400, detail="必须提供keys或prefix")
+    bucket_name = get_bucket_name()
+    if request.operation == "proxy":
+        await validate_proxy_request(request.add_text)
+
+    keys = list(request.keys or [])
+    filtered = 0
+    if request.prefix is not None:
+        processor = await asyncio.to_thread(tasks.get_processor)
+        listed = await asyncio.to_thread(
+            lambda: [item["Key"] for item in processor.list_keys(bucket_name, request.prefix)]
+        )
+        # 与前缀监听相同的过滤：跳过proxy/等输出前缀和非视频文件（.vtt、.fidx、.m3u8等）
+        extensions = source_extensions()
+        wanted = [key for key in listed if is_source_key(key, extensions)]
+        filtered = len(listed) - len(wanted)
+        keys.extend(wanted)
+    unique_keys = list(dict.fromkeys(keys))
+    duplicates = len(keys) - len(unique_keys)
+
+    concurrency = request.concurrency or int(os.environ.get("BATCH_CONCURRENCY", "4"))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    logger.info(f"开始批量处理: {request.operation} {len(unique_keys)}个对象，并发{concurrency}")
+
+    async def run_one(object_key):
+        async with semaphore:
+            start = time.time()
+            item = {"key": object_key, "job_id": None}
+            try:
+                # 提交失败（例如持久队列加锁超时）只记为该对象失败，不中断整个批量响应
+                if request.operation == "proxy":
+                    item["job_id"] = await asyncio.to_thread(
+                        job_manager.submit,
+                        "create-proxy",
+                        tasks.run_create_proxy,
+                        bucket_name,
+                        object_key,
+                        with_progress=True,
+                        schedule=tasks.proxy_schedule(
+                            bucket_name, object_key, request.add_text
+                        ),
+                        add_text=request.add_text,
+                        endpoint="batch",
+                    )
+                else:
+                    item["job_id"] = await asyncio.to_thread(
+                        job_manager.submit,
+                        "process-video",
+                        tasks.run_process_video,
+                        bucket_name,
+                        object_key,
+                        endpoint="batch",
+                    )
+                future = await asyncio.to_thread(job_manager.get_future, item["job_id"])
+                item["result"] = await asyncio.wrap_future(future)
+                item["status"] = "succeeded"
+            except Exception as e:
+                item["status"] = "failed"
+                item["error"] = str(e)
+            item["elapsed"] = round(time.time() - start, 2)
+            return item
+
+    async def result_stream():
+        batch_start = time.time()
+        succeeded = 0
+        failed = 0
+        for next_item in asyncio.as_completed([run_one(key) for key in unique_keys]):
+            item = await next_item
+            if item["status"] == "succeeded":
+                succeeded += 1
+            else:
+                failed += 1
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+        elapsed = time.time() - batch_start
+        summary = {
+            "total": len(unique_keys),
+            "succeeded": succeeded,
+            "failed": failed,
+            "duplicates": duplicates,
+            "filtered": filtered,
+            "elapsed": round(elapsed, 2),
+            "items_per_second": round(len(unique_keys) / elapsed, 2) if elapsed > 0 else None,
+        }
+        logger.info(f"批量处理完成: {summary}")
+        yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
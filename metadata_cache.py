@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 元数据格式版本，get_video_metadata的返回字段变化时加1，磁盘层的旧版本条目视为未命中
+# （2：增加pix_fmt和rotation，缺少它们时代理文件无法直接复制视频流）
+METADATA_VERSION = 2
+
+
+class MetadataCache:
+    def __init__(self, max_entries=1024, ttl=3600, db_path=None):
+        """
+        以 (bucket, key, ETag) 为键的元数据缓存
+
+        内存层为带容量和TTL限制的LRU；可选的sqlite磁盘层在重启后依然有效。
+        ETag变化即视为新内容，因此磁盘层不设过期时间；元数据格式变化时按METADATA_VERSION失效。
+
+        Args:
+            max_entries (int): 内存层最多保存的条目数
+            ttl (int): 内存层条目的有效期（秒）
+            db_path (str, optional): sqlite数据库路径，不指定则不启用磁盘层
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.db = None
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS metadata_cache (
+                    bucket TEXT NOT NULL,
+                    object_key TEXT NOT NULL,
+                    etag TEXT NOT NULL,
+                    metadata TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 1,
+                    PRIMARY KEY (bucket, object_key, etag)
+                )
+                """
+            )
+            # 旧版本创建的表没有version列，已有条目按版本1处理
+            columns = {
+                row[1] for row in self.db.execute("PRAGMA table_info(metadata_cache)")
+            }
+            if "version" not in columns:
+                self.db.execute(
+                    "ALTER TABLE metadata_cache ADD COLUMN version INTEGER NOT NULL DEFAULT 1"
+                )
+            self.db.commit()
+            logger.info(f"元数据磁盘缓存已启用: {db_path}")
+
+    @classmethod
+    def from_env(cls):
+        """
+        根据环境变量创建缓存：METADATA_CACHE_SIZE、METADATA_CACHE_TTL、METADATA_CACHE_DB
+        """
+        return cls(
+            max_entries=int(os.environ.get("METADATA_CACHE_SIZE", "1024")),
+            ttl=float(os.environ.get("METADATA_CACHE_TTL", "3600")),
+            db_path=os.environ.get("METADATA_CACHE_DB") or None,
+        )
+
+    def get(self, bucket_name, object_key, etag):
+        """
+        查询缓存
+
+        Returns:
+            tuple: (元数据, 命中层 "memory"/"disk")，未命中时返回 (None, None)
+        """
+        cache_key = (bucket_name, object_key, etag)
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None:
+                expires_at, metadata = entry
+                if expires_at > time.time():
+                    self.entries.move_to_end(cache_key)
+                    return json.loads(metadata), "memory"
+                del self.entries[cache_key]
+
+            if self.db is None:
+                return None, None
+            row = self.db.execute(
+                "SELECT metadata FROM metadata_cache "
+                "WHERE bucket = ? AND object_key = ? AND etag = ? AND version = ?",
+                cache_key + (METADATA_VERSION,),
+            ).fetchone()
+            if row is None:
+                return None, None
+            # 回填内存层
+            self._put_memory(cache_key, row[0])
+            return json.loads(row[0]), "disk"
+
+    def put(self, bucket_name, object_key, etag, metadata):
+        """
+        写入缓存（内存层和磁盘层）
+        """
+        cache_key = (bucket_name, object_key, etag)
+        serialized = json.dumps(metadata)
+        with self.lock:
+            self._put_memory(cache_key, serialized)
+            if self.db is not None:
+                # 同一对象的旧ETag条目已失效，一并删除
+                self.db.execute(
+                    "DELETE FROM metadata_cache WHERE bucket = ? AND object_key = ?",
+                    (bucket_name, object_key),
+                )
+                self.db.execute(
+                    "INSERT INTO metadata_cache "
+                    "(bucket, object_key, etag, metadata, created_at, version) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    cache_key + (serialized, time.time(), METADATA_VERSION),
+                )
+                self.db.commit()
+
+    def _put_memory(self, cache_key, serialized):
+        # 内存中保存序列化结果，避免调用方修改返回值污染缓存
+        self.entries[cache_key] = (time.time() + self.ttl, serialized)
+        self.entries.move_to_end(cache_key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
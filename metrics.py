@@ -0,0 +1,213 @@
+import os
+import logging
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+from scratch import dir_size
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 进程池模式（JOB_EXECUTOR=process）下需要设置PROMETHEUS_MULTIPROC_DIR，
+# 各工作进程把指标写入该目录，/metrics汇总所有进程的数据
+
+# 各阶段耗时从秒级到数十分钟
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 3600)
+
+# 编码速度（相对实时的倍数），低于1表示比实时慢
+SPEED_BUCKETS = (0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 8, 12, 20)
+
+STAGE_SECONDS = Histogram(
+    "video_stage_duration_seconds",
+    "各处理阶段耗时（download、probe、encode、upload、total）",
+    ["stage", "endpoint", "add_text"],
+    buckets=STAGE_BUCKETS,
+)
+
+BYTES_TRANSFERRED = Counter(
+    "video_bytes_transferred_total",
+    "与S3之间传输的字节数",
+    ["direction", "endpoint", "add_text"],
+)
+
+ENCODE_SPEED = Histogram(
+    "video_encode_speed_ratio",
+    "ffmpeg编码速度（相对实时的倍数）",
+    ["endpoint", "add_text"],
+    buckets=SPEED_BUCKETS,
+)
+
+JOBS_COMPLETED = Counter(
+    "video_jobs_completed_total",
+    "已完成的任务数",
+    ["endpoint", "add_text", "outcome"],
+)
+
+ERRORS = Counter(
+    "video_errors_total",
+    "按失败阶段统计的错误数",
+    ["stage", "endpoint", "add_text"],
+)
+
+# 抓取时实时读取的运行状态（任务队列和临时空间），由main.py在启动时设置
+_job_manager = None
+_scratch = None
+
+# 服务启动各阶段距进程启动的秒数（import、ready、first_response）
+_startup = {}
+
+
+def _labels(endpoint, add_text):
+    return {"endpoint": endpoint, "add_text": str(bool(add_text)).lower()}
+
+
+def observe_result(endpoint, add_text, result, speed=None):
+    """
+    根据任务结果记录各阶段耗时、传输字节数和编码速度
+
+    Args:
+        endpoint (str): 提交任务的接口
+        add_text (bool): 是否添加了帧数计数器
+        result (dict): process_video或process_and_upload_proxy的返回值
+        speed (float, optional): ffmpeg最后报告的编码速度
+    """
+    labels = _labels(endpoint, add_text)
+    if result.get("skipped"):
+        outcome = "skipped"
+    elif result.get("deduplicated"):
+        outcome = "deduplicated"
+    else:
+        outcome = "succeeded"
+    JOBS_COMPLETED.labels(outcome=outcome, **labels).inc()
+
+    if "probe" in result:
+        STAGE_SECONDS.labels(stage="probe", **labels).observe(result["probe"]["time"])
+        return
+
+    times = result.get("processing_times", {})
+    for key, stage in (
+        ("download", "download"),
+        ("process", "encode"),
+        ("upload", "upload"),
+        ("total", "total"),
+    ):
+        if times.get(key) is not None:
+            STAGE_SECONDS.labels(stage=stage, **labels).observe(times[key])
+    if times.get("download_bytes"):
+        BYTES_TRANSFERRED.labels(direction="download", **labels).inc(
+            times["download_bytes"]
+        )
+    if times.get("upload_bytes"):
+        BYTES_TRANSFERRED.labels(direction="upload", **labels).inc(
+            times["upload_bytes"]
+        )
+    if speed:
+        ENCODE_SPEED.labels(**labels).observe(speed)
+
+
+def observe_error(endpoint, add_text, stage):
+    """
+    记录失败任务及其所处的阶段
+    """
+    labels = _labels(endpoint, add_text)
+    ERRORS.labels(stage=stage or "unknown", **labels).inc()
+    JOBS_COMPLETED.labels(outcome="failed", **labels).inc()
+
+
+class RuntimeCollector:
+    """
+    抓取时读取任务队列和临时空间的当前状态
+    """
+
+    def collect(self):
+        jobs = GaugeMetricFamily(
+            "video_jobs", "当前排队和运行中的任务数", labels=["endpoint", "state"]
+        )
+        if _job_manager is not None:
+            counts = _job_manager.stats(by_kind=True)
+            kinds = {kind for kind, _ in counts} | {"create-proxy", "process-video"}
+            for kind in sorted(kinds):
+                for state in ("queued", "running"):
+                    jobs.add_metric([kind, state], counts.get((kind, state), 0))
+        yield jobs
+
+        scheduler = getattr(_job_manager, "scheduler", None)
+        if scheduler is not None:
+            stats = scheduler.stats()
+            threads = GaugeMetricFamily(
+                "video_scheduler_threads", "调度器分配的ffmpeg线程数", labels=["state"]
+            )
+            threads.add_metric(["in_use"], stats["threads_in_use"])
+            threads.add_metric(["capacity"], stats["cores"])
+            yield threads
+            yield GaugeMetricFamily(
+                "video_scheduler_pending",
+                "等待调度的代理任务数",
+                value=stats["pending"],
+            )
+
+        if _startup:
+            startup = GaugeMetricFamily(
+                "video_startup_seconds", "进程启动到各启动阶段完成的耗时", labels=["phase"]
+            )
+            for phase, seconds in _startup.items():
+                startup.add_metric([phase], seconds)
+            yield startup
+
+        if _scratch is not None:
+            # 按目录实际占用统计，进程池模式下包含所有工作进程的临时文件
+            yield GaugeMetricFamily(
+                "video_scratch_bytes",
+                "临时目录实际占用的字节数",
+                value=dir_size(_scratch.root),
+            )
+            yield GaugeMetricFamily(
+                "video_scratch_budget_bytes",
+                "同一临时目录下所有进程共用的空间预算",
+                value=_scratch.budget,
+            )
+
+
+def register_runtime(job_manager, scratch=None):
+    """
+    设置抓取时读取的任务管理器和临时空间
+    """
+    global _job_manager, _scratch
+    _job_manager = job_manager
+    _scratch = scratch
+
+
+def record_startup(phase, seconds):
+    """
+    记录启动阶段耗时，同一阶段只记录第一次
+    """
+    _startup.setdefault(phase, round(seconds, 3))
+
+
+_runtime_collector = RuntimeCollector()
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    REGISTRY.register(_runtime_collector)
+
+
+def render():
+    """
+    生成Prometheus文本格式的指标
+
+    Returns:
+        tuple: (内容, Content-Type)
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_runtime_collector)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
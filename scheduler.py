@@ -0,0 +1,276 @@
+import os
+import time
+import itertools
+import threading
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 代价的单位：1秒1080p30视频的像素量
+REFERENCE_PIXEL_RATE = 1920 * 1080 * 30
+
+# 视频流直接复制（不解码）时相对完整转码的代价
+COPY_COST_FACTOR = 0.05
+
+
+def available_cpus():
+    """
+    返回当前进程可用的CPU核数（容器内会受cgroup/affinity限制）
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def encode_threads():
+    """
+    每个代理编码ffmpeg进程使用的线程数（-threads）
+
+    默认读取环境变量FFMPEG_THREADS，未设置时把可用核数平分给JOB_WORKERS个任务。
+    """
+    value = os.environ.get("FFMPEG_THREADS")
+    if value:
+        return max(1, int(value))
+    return max(1, available_cpus() // int(os.environ.get("JOB_WORKERS", "2")))
+
+
+def job_threads():
+    """
+    调度时每个代理任务占用的线程数：分段编码模式会同时使用所有核
+    """
+    if os.environ.get("PROXY_ENCODE_MODE", "single") == "chunked":
+        return available_cpus()
+    return encode_threads()
+
+
+def estimate_cost(metadata, plan=None, outputs=1):
+    """
+    按 时长 × 分辨率 × 帧率 估算代理任务的代价
+
+    Args:
+        metadata (dict): get_video_metadata的返回值
+        plan (dict, optional): plan_proxy选择的生成方式，视频流直接复制时代价很低
+        outputs (int): 视频输出的数量
+
+    Returns:
+        float: 代价，单位为1080p30视频的秒数
+    """
+    duration = metadata.get("duration") or 0
+    video = metadata.get("video")
+    if video is None:
+        return duration * COPY_COST_FACTOR
+    fps = video.get("fps") or 30
+    cost = duration * video["width"] * video["height"] * fps / REFERENCE_PIXEL_RATE
+    if plan is not None and plan["video"] == "copy":
+        cost *= COPY_COST_FACTOR
+    return cost * max(1, outputs)
+
+
+def aged_cost(cost, waited, aging_seconds):
+    """
+    等待时间每过aging_seconds，有效代价减半（本进程调度器和持久队列共用）
+    """
+    return cost / 2 ** min(waited / aging_seconds, 64)
+
+
+def tenant_of(object_key, depth=None):
+    """
+    按对象键的前缀划分公平调度的租户，默认取第一级目录（环境变量SCHEDULER_TENANT_DEPTH）
+    """
+    depth = depth or int(os.environ.get("SCHEDULER_TENANT_DEPTH", "1"))
+    parts = object_key.split("/")[:-1]
+    return "/".join(parts[:depth])
+
+
+class CostScheduler:
+    def __init__(
+        self,
+        max_jobs,
+        cores=None,
+        aging_seconds=None,
+        default_cost=None,
+        estimate_workers=2,
+    ):
+        """
+        代理任务的调度器：按估算代价短任务优先，按前缀公平分配，按核数准入
+
+        - 短任务优先：同一前缀内代价最小的任务先执行；等待时间每过aging_seconds
+          有效代价减半，长任务不会被持续到来的短任务饿死
+        - 公平分配：各前缀累计已调度的代价，下一个任务从累计值最小的前缀中选取；
+          新出现或空闲后重新提交的前缀从当前最小值开始累计，不能补回空闲期间的份额
+        - 准入：运行中任务的ffmpeg线程数之和不超过可用核数（至少运行一个任务），
+          且同时运行的任务数不超过max_jobs
+
+        Args:
+            max_jobs (int): 同时运行的任务数上限（工作池大小）
+            cores (int, optional): 可分配的线程数，默认为可用CPU核数
+            aging_seconds (float, optional): 有效代价减半的等待时间，默认读取环境变量
+                SCHEDULER_AGING_SECONDS，未设置时为60
+            default_cost (float, optional): 无法估算时使用的代价，默认读取环境变量
+                SCHEDULER_DEFAULT_COST，未设置时为600（10分钟1080p30）
+            estimate_workers (int): 估算代价（探测元数据）的线程数
+        """
+        self.max_jobs = max_jobs
+        self.cores = cores or available_cpus()
+        self.aging_seconds = aging_seconds or float(
+            os.environ.get("SCHEDULER_AGING_SECONDS", "60")
+        )
+        self.default_cost = default_cost or float(
+            os.environ.get("SCHEDULER_DEFAULT_COST", "600")
+        )
+        self.estimator = ThreadPoolExecutor(
+            max_workers=estimate_workers, thread_name_prefix="job-estimate"
+        )
+        self.pending = []
+        self.running = 0
+        self.threads_in_use = 0
+        self.usage = {}
+        self.active = {}
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        logger.info(
+            f"代价调度器已启动: {self.cores}核，每个任务{job_threads()}线程，"
+            f"最多{self.max_jobs}个任务"
+        )
+
+    @classmethod
+    def from_env(cls, max_jobs):
+        """
+        环境变量JOB_SCHEDULER为 "cost"（默认）时创建调度器，为 "fifo" 时返回None
+        """
+        mode = os.environ.get("JOB_SCHEDULER", "cost")
+        if mode == "fifo":
+            return None
+        if mode != "cost":
+            raise ValueError(f"不支持的调度方式: {mode}")
+        return cls(max_jobs)
+
+    def submit(self, start, tenant, estimate=None, threads=None):
+        """
+        加入调度队列，估算代价后在准入时调用start()开始执行
+
+        Args:
+            start (callable): 开始执行任务，返回任务的future
+            tenant (str): 公平分配的租户（对象键前缀）
+            estimate (callable, optional): 返回任务代价，在估算线程中调用，失败时使用默认代价
+            threads (int, optional): 任务占用的线程数，默认为job_threads()
+
+        Returns:
+            Future: 任务结束时完成的future
+        """
+        entry = {
+            "start": start,
+            "tenant": tenant,
+            "cost": None,
+            "threads": min(threads or job_threads(), self.cores),
+            "submitted_at": time.time(),
+            "sequence": next(self.sequence),
+            "future": Future(),
+        }
+        with self.lock:
+            if not self.active.get(tenant):
+                # 空闲后重新提交的前缀从当前最小累计值开始，不能补回空闲期间的份额
+                floor = min(
+                    (self.usage[t] for t, n in self.active.items() if n),
+                    default=0,
+                )
+                self.usage[tenant] = max(self.usage.get(tenant, 0), floor)
+            self.active[tenant] = self.active.get(tenant, 0) + 1
+            self.pending.append(entry)
+        if estimate is None:
+            entry["cost"] = self.default_cost
+            self._dispatch()
+        else:
+            self.estimator.submit(self._estimate, entry, estimate)
+        return entry["future"]
+
+    def _estimate(self, entry, estimate):
+        try:
+            entry["cost"] = estimate()
+        except Exception as e:
+            logger.warning(f"估算任务代价失败，使用默认代价: {e}")
+        if entry["cost"] is None:
+            entry["cost"] = self.default_cost
+        self._dispatch()
+
+    def _priority(self, entry, now):
+        waited = now - entry["submitted_at"]
+        return (aged_cost(entry["cost"], waited, self.aging_seconds), entry["sequence"])
+
+    def _select(self, now):
+        ready = [entry for entry in self.pending if entry["cost"] is not None]
+        if not ready:
+            return None
+        tenant = min({e["tenant"] for e in ready}, key=lambda t: (self.usage[t], t))
+        return min(
+            (e for e in ready if e["tenant"] == tenant),
+            key=lambda e: self._priority(e, now),
+        )
+
+    def _dispatch(self):
+        started = []
+        with self.lock:
+            now = time.time()
+            while self.running < self.max_jobs:
+                entry = self._select(now)
+                if entry is None:
+                    break
+                if self.running and self.threads_in_use + entry["threads"] > self.cores:
+                    break
+                self.pending.remove(entry)
+                self.running += 1
+                self.threads_in_use += entry["threads"]
+                self.usage[entry["tenant"]] += entry["cost"]
+                started.append(entry)
+
+        for entry in started:
+            logger.info(
+                f"调度任务: 前缀'{entry['tenant']}' 代价{entry['cost']:.1f} "
+                f"等待{now - entry['submitted_at']:.1f}秒 {entry['threads']}线程"
+            )
+            entry["future"].set_running_or_notify_cancel()
+            try:
+                inner = entry["start"]()
+            except Exception as e:
+                self._finish(entry)
+                entry["future"].set_exception(e)
+                continue
+            inner.add_done_callback(lambda f, entry=entry: self._on_done(entry, f))
+
+    def _finish(self, entry):
+        with self.lock:
+            self.running -= 1
+            self.threads_in_use -= entry["threads"]
+            self.active[entry["tenant"]] -= 1
+        self._dispatch()
+
+    def _on_done(self, entry, inner):
+        self._finish(entry)
+        if inner.cancelled():
+            # 工作池关闭时取消了尚未开始的任务
+            entry["future"].set_exception(Exception("任务已取消"))
+            return
+        error = inner.exception()
+        if error is not None:
+            entry["future"].set_exception(error)
+        else:
+            entry["future"].set_result(inner.result())
+
+    def stats(self):
+        """
+        返回排队、运行中的任务数和占用的线程数
+        """
+        with self.lock:
+            return {
+                "pending": len(self.pending),
+                "running": self.running,
+                "threads_in_use": self.threads_in_use,
+                "cores": self.cores,
+            }
+
+    def shutdown(self, wait=True):
+        self.estimator.shutdown(wait=wait)
@@ -0,0 +1,385 @@
+import os
+import fcntl
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 本进程已清理过自己的pid目录（容器重启后pid往往相同，遗留目录与新进程同名）
+_own_dir_cleared = False
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def dir_size(path):
+    """
+    统计目录下所有文件的字节数（文件在统计过程中被删除时忽略）
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ScratchSpace:
+    def __init__(
+        self,
+        root=None,
+        budget=None,
+        ram_root=None,
+        ram_budget=0,
+        ram_max_file=0,
+        cache_entries=8,
+        wait_timeout=600,
+    ):
+        """
+        临时文件空间管理：磁盘预算与准入控制、可选的内存（tmpfs）层、
+        按引用计数共享的源文件LRU缓存，以及启动时清理遗留文件
+
+        每个进程使用 root/<pid> 子目录，启动时删除已退出进程留下的目录，
+        因此多个工作进程可以共用同一个root。预算由同一root下的所有进程共用
+        （API、工作进程和监听进程）：各进程把已预留的字节数写入 root/<pid>.usage，
+        预留时在文件锁内汇总所有存活进程的用量。
+
+        Args:
+            root (str, optional): 临时文件根目录，默认为系统临时目录下的video-scratch
+            budget (int, optional): 同一root下所有进程共用的磁盘字节数，默认为
+                （当前可用空间 + 其他进程已预留的空间）的80%
+            ram_root (str, optional): tmpfs目录（例如/dev/shm），不指定则不启用内存层
+            ram_budget (int): 内存层可使用的字节数（同样由所有进程共用）
+            ram_max_file (int): 不超过该大小的文件优先放入内存层
+            cache_entries (int): 最多缓存的源文件数量
+            wait_timeout (float): 空间不足时等待其他任务释放空间的最长时间（秒）
+        """
+        self.root = root or os.path.join(tempfile.gettempdir(), "video-scratch")
+        os.makedirs(self.root, exist_ok=True)
+        self.dir = os.path.join(self.root, str(os.getpid()))
+
+        self.ram_root = ram_root if ram_root and os.path.isdir(ram_root) else None
+        self.ram_dir = (
+            os.path.join(self.ram_root, "video-scratch", str(os.getpid()))
+            if self.ram_root
+            else None
+        )
+        self.ram_budget = ram_budget if self.ram_dir else 0
+        self.ram_max_file = ram_max_file
+
+        self.sweep()
+        os.makedirs(self.dir, exist_ok=True)
+        if self.ram_dir:
+            os.makedirs(self.ram_dir, exist_ok=True)
+
+        self.used = {"disk": 0, "ram": 0}
+        self._write_usage()
+        if budget is None:
+            # 其他进程已预留但尚未写入的空间仍计入可用空间，各进程得到相近的预算
+            free = shutil.disk_usage(self.root).free + self._others_usage()["disk"]
+            budget = int(free * 0.8)
+        self.budget = budget
+        self.cache_entries = cache_entries
+        self.wait_timeout = wait_timeout
+
+        self.files = {}
+        self.sources = OrderedDict()
+        self.cond = threading.Condition()
+        logger.info(
+            f"临时空间: {self.dir} 预算{self.budget}字节"
+            + (f"，内存层{self.ram_dir} {self.ram_budget}字节" if self.ram_dir else "")
+        )
+
+    @classmethod
+    def from_env(cls):
+        """
+        根据环境变量创建：SCRATCH_DIR、SCRATCH_BUDGET_BYTES、SCRATCH_RAM_DIR、
+        SCRATCH_RAM_BUDGET_BYTES、SCRATCH_RAM_MAX_FILE_BYTES、SCRATCH_CACHE_ENTRIES
+        """
+        budget = os.environ.get("SCRATCH_BUDGET_BYTES")
+        return cls(
+            root=os.environ.get("SCRATCH_DIR") or None,
+            budget=int(budget) if budget else None,
+            ram_root=os.environ.get("SCRATCH_RAM_DIR") or None,
+            ram_budget=int(os.environ.get("SCRATCH_RAM_BUDGET_BYTES", "0")),
+            ram_max_file=int(os.environ.get("SCRATCH_RAM_MAX_FILE_BYTES", "0")),
+            cache_entries=int(os.environ.get("SCRATCH_CACHE_ENTRIES", "8")),
+        )
+
+    def sweep(self):
+        """
+        删除已退出进程遗留的临时目录（崩溃前未清理的下载和输出文件）
+        """
+        global _own_dir_cleared
+        parents = [self.root]
+        if self.ram_root:
+            parents.append(os.path.join(self.ram_root, "video-scratch"))
+        for parent in parents:
+            if not os.path.isdir(parent):
+                continue
+            for name in os.listdir(parent):
+                path = os.path.join(parent, name)
+                pid = name[: -len(".usage")] if name.endswith(".usage") else name
+                if not pid.isdigit():
+                    continue
+                if int(pid) == os.getpid():
+                    # 与本进程同pid的目录来自重启前的进程（容器内常为pid 1），
+                    # 只在本进程首次创建临时空间时清理
+                    if _own_dir_cleared:
+                        continue
+                elif _pid_alive(int(pid)):
+                    continue
+                if os.path.isdir(path):
+                    size = dir_size(path)
+                    shutil.rmtree(path, ignore_errors=True)
+                    logger.info(f"已清理遗留临时目录: {path} ({size}字节)")
+                else:
+                    self._remove_file(path)
+        _own_dir_cleared = True
+
+    @contextmanager
+    def _ledger(self):
+        # 跨进程的文件锁，保证"汇总用量并预留"的原子性
+        with open(os.path.join(self.root, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_usage(self):
+        # 原子替换本进程的用量文件，其他进程读到旧值或新值
+        path = os.path.join(self.root, f"{os.getpid()}.usage")
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{self.used['disk']} {self.used['ram']}")
+        os.replace(path + ".tmp", path)
+
+    def _others_usage(self):
+        """
+        汇总同一root下其他存活进程已预留的字节数
+        """
+        used = {"disk": 0, "ram": 0}
+        for name in os.listdir(self.root):
+            pid = name[: -len(".usage")]
+            if not name.endswith(".usage") or not pid.isdigit():
+                continue
+            if int(pid) == os.getpid() or not _pid_alive(int(pid)):
+                continue
+            try:
+                with open(os.path.join(self.root, name)) as f:
+                    disk, ram = f.read().split()
+            except (OSError, ValueError):
+                continue
+            used["disk"] += int(disk)
+            used["ram"] += int(ram)
+        return used
+
+    def _reserve(self, size, allow_ram=True):
+        """
+        在预算内预留空间，不足时先淘汰未被引用的缓存源文件，仍不足则等待
+
+        Returns:
+            str: 使用的层 "disk" 或 "ram"
+        """
+        use_ram = (
+            allow_ram
+            and self.ram_dir is not None
+            and size <= self.ram_max_file
+            and size <= self.ram_budget
+        )
+        if not use_ram and size > self.budget:
+            raise Exception(f"文件大小{size}字节超过临时空间预算{self.budget}字节")
+
+        deadline = time.time() + self.wait_timeout
+        with self.cond:
+            while True:
+                with self._ledger():
+                    others = self._others_usage()
+                    tier = None
+                    if use_ram and others["ram"] + self.used["ram"] + size <= self.ram_budget:
+                        tier = "ram"
+                    elif others["disk"] + self.used["disk"] + size <= self.budget:
+                        tier = "disk"
+                    if tier is not None:
+                        self.used[tier] += size
+                        self._write_usage()
+                        return tier
+                if self._evict_one():
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise Exception(
+                        f"临时空间不足: 需要{size}字节，已用"
+                        f"{others['disk'] + self.used['disk']}/{self.budget}字节"
+                    )
+                logger.info(f"临时空间不足，等待释放: 需要{size}字节")
+                # 其他进程释放空间时不会通知本进程，定期重新检查
+                self.cond.wait(min(remaining, 1.0))
+
+    def _unreserve(self, size, tier):
+        with self.cond:
+            self.used[tier] -= size
+            self._write_usage()
+            self.cond.notify_all()
+
+    def _evict_one(self):
+        # 调用方持有锁；淘汰最久未使用且没有引用的缓存源文件
+        for cache_key, entry in self.sources.items():
+            if entry["refs"] == 0 and entry["ready"].is_set():
+                del self.sources[cache_key]
+                self._remove_file(entry["path"])
+                self.used[entry["tier"]] -= entry["size"]
+                self._write_usage()
+                logger.info(f"淘汰缓存源文件: {entry['path']}")
+                return True
+        return False
+
+    def _remove_file(self, path):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            logger.error(f"删除临时文件失败: {path} {e}")
+
+    def allocate(self, size, suffix=""):
+        """
+        预留空间并返回一个新的临时文件路径，使用完毕后调用release
+
+        Args:
+            size (int): 预计写入的字节数
+            suffix (str): 文件扩展名
+
+        Returns:
+            str: 临时文件路径
+        """
+        tier = self._reserve(size)
+        directory = self.ram_dir if tier == "ram" else self.dir
+        path = os.path.join(directory, f"{uuid.uuid4()}{suffix}")
+        with self.cond:
+            self.files[path] = (size, tier)
+        return path
+
+    def release(self, path):
+        """
+        删除allocate分配的文件并归还预留空间
+        """
+        with self.cond:
+            size, tier = self.files.pop(path, (0, "disk"))
+        self._remove_file(path)
+        self._unreserve(size, tier)
+
+    @contextmanager
+    def reservation(self, size):
+        """
+        为大小未知的输出（例如编码结果）预留磁盘空间
+        """
+        tier = self._reserve(size, allow_ram=False)
+        try:
+            yield
+        finally:
+            self._unreserve(size, tier)
+
+    def acquire_source(self, bucket_name, object_key, etag, size, fetch):
+        """
+        获取源文件的本地副本：同一 (bucket, key, ETag) 在各接口间共享，
+        正在下载时其他调用方等待同一次下载完成
+
+        Args:
+            size (int): 对象大小
+            fetch (callable): fetch(path)，把对象下载到指定路径
+
+        Returns:
+            str: 本地文件路径，使用完毕后调用release_source
+        """
+        cache_key = (bucket_name, object_key, etag)
+        with self.cond:
+            entry = self.sources.get(cache_key)
+            if entry is not None:
+                entry["refs"] += 1
+                self.sources.move_to_end(cache_key)
+                owner = False
+            else:
+                # 先登记占位条目，其他调用方看到后等待本次下载
+                entry = {
+                    "path": None,
+                    "size": size,
+                    "tier": None,
+                    "refs": 1,
+                    "ready": threading.Event(),
+                    "error": None,
+                }
+                self.sources[cache_key] = entry
+                owner = True
+
+        if not owner:
+            entry["ready"].wait()
+            if entry["error"] is not None:
+                # 下载失败的条目已被移除，无需释放引用
+                raise entry["error"]
+            logger.info(f"复用已下载的源文件: {bucket_name}/{object_key}")
+            return entry["path"]
+
+        tier = None
+        try:
+            tier = self._reserve(size)
+            directory = self.ram_dir if tier == "ram" else self.dir
+            suffix = os.path.splitext(object_key)[1]
+            entry["path"] = os.path.join(directory, f"{uuid.uuid4()}{suffix}")
+            entry["tier"] = tier
+            with self.cond:
+                while len(self.sources) > self.cache_entries and self._evict_one():
+                    pass
+            fetch(entry["path"])
+        except Exception as e:
+            entry["error"] = e
+            with self.cond:
+                self.sources.pop(cache_key, None)
+            if entry["path"]:
+                self._remove_file(entry["path"])
+            if tier is not None:
+                self._unreserve(size, tier)
+            raise
+        finally:
+            entry["ready"].set()
+        return entry["path"]
+
+    def release_source(self, path):
+        """
+        释放acquire_source取得的源文件引用；文件保留在缓存中直到被淘汰
+        """
+        with self.cond:
+            for entry in self.sources.values():
+                if entry["path"] == path:
+                    entry["refs"] = max(0, entry["refs"] - 1)
+                    break
+            self.cond.notify_all()
+
+    def usage(self):
+        """
+        返回当前的空间使用情况
+        """
+        with self.cond:
+            return {
+                "disk_used": self.used["disk"],
+                "disk_budget": self.budget,
+                "ram_used": self.used["ram"],
+                "ram_budget": self.ram_budget,
+                "cached_sources": len(self.sources),
+            }
@@ -0,0 +1,190 @@
+import os
+import time
+import threading
+import logging
+from metadata_cache import MetadataCache
+from content_index import ContentIndex
+from scratch import ScratchSpace
+from scheduler import estimate_cost, tenant_of
+import metrics
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 任务函数必须定义在模块级别，以便进程池模式下可以被pickle
+
+# 进程内共享的元数据缓存
+metadata_cache = MetadataCache.from_env()
+
+# 内容摘要索引（CONTENT_INDEX_DB未设置时为None）
+content_index = ContentIndex.from_env()
+
+# 进程内的临时空间（磁盘预算、源文件缓存），创建时清理已退出进程的遗留文件
+scratch = ScratchSpace.from_env()
+
+# 进程内共享的视频处理器（S3客户端、连接池和字体只初始化一次）
+_processor = None
+_processor_lock = threading.Lock()
+
+
+def get_processor():
+    """
+    获取进程内共享的视频处理器，首次调用时创建
+    """
+    global _processor
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                start = time.time()
+                # boto3等依赖较重，延迟到首次使用时导入，不阻塞服务启动
+                from video_processor import VideoProcessor
+
+                _processor = VideoProcessor(
+                    aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
+                    aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
+                    region_name=os.environ.get("AWS_REGION", "us-east-1"),
+                    metadata_cache=metadata_cache,
+                    content_index=content_index,
+                    scratch=scratch,
+                )
+                logger.info(f"视频处理器初始化耗时: {time.time() - start:.3f}秒")
+    return _processor
+
+
+def init_worker():
+    """
+    工作进程初始化函数：提前创建共享处理器，避免首个任务承担初始化开销
+    """
+    get_processor()
+
+
+def estimate_proxy_cost(bucket_name, object_key, add_text=True, renditions=None):
+    """
+    调度器估算代理任务代价：探测源视频元数据（写入元数据缓存，任务执行时直接命中）
+
+    Returns:
+        float: 代价，参见scheduler.estimate_cost
+    """
+    processor = get_processor()
+    etag = processor.s3_client.head_object(Bucket=bucket_name, Key=object_key)["ETag"]
+    url = processor.generate_presigned_url(bucket_name, object_key)
+    metadata = processor.source_metadata(bucket_name, object_key, etag, "url", url)
+    if renditions:
+        outputs = sum(1 for r in renditions if r.get("type", "video") == "video")
+        return estimate_cost(metadata, outputs=outputs)
+    plan = None
+    if os.environ.get("PROXY_PASSTHROUGH", "auto") == "auto":
+        plan = processor.plan_proxy(metadata, add_text)
+    return estimate_cost(metadata, plan=plan)
+
+
+def proxy_schedule(bucket_name, object_key, add_text=True, renditions=None):
+    """
+    代理任务的调度参数，传给JobManager.submit的schedule参数
+    """
+    return {
+        "tenant": tenant_of(object_key),
+        "estimate": lambda: estimate_proxy_cost(
+            bucket_name, object_key, add_text, renditions
+        ),
+    }
+
+
+def run_process_video(bucket_name, object_key, endpoint="process-video"):
+    """
+    后台任务：获取S3视频的元数据
+
+    Args:
+        endpoint (str): 提交任务的接口，作为指标标签
+    """
+    setup_start = time.time()
+    processor = get_processor()
+    setup_time = time.time() - setup_start
+
+    logger.info(f"开始处理视频: {bucket_name}/{object_key}")
+    try:
+        metadata = processor.process_video(bucket_name, object_key)
+    except Exception:
+        metrics.observe_error(endpoint, False, processor.current_stage())
+        raise
+    metadata["probe"]["setup"] = round(setup_time, 4)
+    metrics.observe_result(endpoint, False, metadata)
+    return metadata
+
+
+def run_create_proxy(
+    bucket_name,
+    object_key,
+    add_text=True,
+    renditions=None,
+    progress_callback=None,
+    force=False,
+    endpoint="create-proxy",
+    output_mode=None,
+):
+    """
+    后台任务：创建代理文件（或多个输出）并上传到S3
+
+    Args:
+        endpoint (str): 提交任务的接口，作为指标标签
+    """
+    setup_start = time.time()
+    processor = get_processor()
+    setup_time = time.time() - setup_start
+
+    # 记录ffmpeg最后报告的编码速度，同时继续转发进度
+    last_progress = {}
+
+    def on_progress(progress):
+        last_progress.update(progress)
+        if progress_callback is not None:
+            progress_callback(progress)
+
+    logger.info(f"开始创建代理文件: {bucket_name}/{object_key}")
+    try:
+        result = processor.process_and_upload_proxy(
+            bucket_name,
+            object_key,
+            add_text=add_text,
+            renditions=renditions,
+            progress_callback=on_progress,
+            force=force,
+            output_mode=output_mode,
+        )
+    except Exception:
+        metrics.observe_error(endpoint, add_text, processor.current_stage())
+        raise
+    result["processing_times"]["setup"] = round(setup_time, 4)
+    metrics.observe_result(endpoint, add_text, result, last_progress.get("speed"))
+    return result
+
+
+def run_create_thumbnails(
+    bucket_name,
+    object_key,
+    options=None,
+    progress_callback=None,
+    endpoint="thumbnails",
+):
+    """
+    后台任务：按时间点定位取帧，生成缩略图或拼图并上传到S3
+
+    Args:
+        options (dict, optional): create_thumbnails的参数（times、count、interval等）
+        endpoint (str): 提交任务的接口，作为指标标签
+    """
+    processor = get_processor()
+    logger.info(f"开始生成缩略图: {bucket_name}/{object_key}")
+    try:
+        result = processor.create_thumbnails(
+            bucket_name,
+            object_key,
+            progress_callback=progress_callback,
+            **(options or {}),
+        )
+    except Exception:
+        metrics.observe_error(endpoint, False, processor.current_stage())
+        raise
+    metrics.observe_result(endpoint, False, result)
+    return result
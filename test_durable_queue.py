@@ -0,0 +1,132 @@
+import unittest
+import os
+import time
+import shutil
+import tempfile
+from durable_queue import DurableQueue
+
+class TestDurableQueue(unittest.TestCase):
+    def setUp(self):
+        """在每个测试用例前运行，创建临时数据库"""
+        self.test_dir = tempfile.mkdtemp()
+        self.queue = DurableQueue(
+            os.path.join(self.test_dir, "jobs.db"), max_attempts=2, scheduling="cost"
+        )
+
+    def tearDown(self):
+        """在每个测试用例后运行，删除临时数据库"""
+        self.queue.db.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_claim_in_order(self):
+        """测试按入队顺序领取，已领取的任务不会被再次领取"""
+        first = self.queue.enqueue("create-proxy", "run_create_proxy", ["bucket", "a.mp4"])
+        second = self.queue.enqueue(
+            "process-video", "run_process_video", ["bucket", "b.mp4"], {"endpoint": "batch"}
+        )
+
+        job = self.queue.claim("worker-1", 60)
+        self.assertEqual(job["id"], first)
+        self.assertEqual(job["args"], ["bucket", "a.mp4"])
+        self.assertEqual(job["attempts"], 1)
+
+        job = self.queue.claim("worker-2", 60)
+        self.assertEqual(job["id"], second)
+        self.assertEqual(job["kwargs"], {"endpoint": "batch"})
+
+        self.assertIsNone(self.queue.claim("worker-3", 60))
+        self.assertEqual(self.queue.get(first)["status"], "running")
+        self.assertEqual(self.queue.get(first)["worker"], "worker-1")
+
+    def test_complete_and_fail(self):
+        """测试记录结果和失败"""
+        ok = self.queue.enqueue("create-proxy", "run_create_proxy")
+        bad = self.queue.enqueue("create-proxy", "run_create_proxy")
+        self.queue.claim("worker-1", 60)
+        self.queue.claim("worker-1", 60)
+
+        self.assertTrue(self.queue.complete(ok, "worker-1", {"proxy_key": "proxy/a.mp4"}))
+        self.assertTrue(self.queue.fail(bad, "worker-1", "编码失败"))
+
+        self.assertEqual(self.queue.get(ok)["result"], {"proxy_key": "proxy/a.mp4"})
+        self.assertEqual(self.queue.get(bad)["status"], "failed")
+        self.assertEqual(self.queue.get(bad)["error"], "编码失败")
+        self.assertEqual(self.queue.stats(), {"succeeded": 1, "failed": 1})
+
+    def test_lease_expiry(self):
+        """测试租约过期后任务由其他工作进程重新领取，原工作进程的结果被忽略"""
+        job_id = self.queue.enqueue("create-proxy", "run_create_proxy")
+        self.queue.claim("worker-1", 0.05)
+        self.assertIsNone(self.queue.claim("worker-2", 60))
+
+        time.sleep(0.1)
+        job = self.queue.claim("worker-2", 60)
+        self.assertEqual(job["id"], job_id)
+        self.assertEqual(job["attempts"], 2)
+
+        self.assertFalse(self.queue.heartbeat(job_id, "worker-1", 60))
+        self.assertFalse(self.queue.complete(job_id, "worker-1", {"stale": True}))
+        self.assertTrue(self.queue.heartbeat(job_id, "worker-2", 60, {"frame": 10}))
+        self.assertTrue(self.queue.complete(job_id, "worker-2", {"stale": False}))
+
+        job = self.queue.get(job_id)
+        self.assertEqual(job["result"], {"stale": False})
+        self.assertEqual(job["progress"], {"frame": 10})
+
+    def test_heartbeat_keeps_lease(self):
+        """测试续约后租约不会过期"""
+        job_id = self.queue.enqueue("create-proxy", "run_create_proxy")
+        self.queue.claim("worker-1", 0.2)
+        time.sleep(0.1)
+        self.assertTrue(self.queue.heartbeat(job_id, "worker-1", 0.2))
+        time.sleep(0.15)
+        self.assertIsNone(self.queue.claim("worker-2", 60))
+
+    def test_max_attempts(self):
+        """测试租约过期次数达到max_attempts后任务失败，不再重试"""
+        job_id = self.queue.enqueue("create-proxy", "run_create_proxy")
+        self.queue.claim("worker-1", 0.05)
+        time.sleep(0.1)
+        self.assertEqual(self.queue.claim("worker-2", 0.05)["attempts"], 2)
+        time.sleep(0.1)
+
+        self.assertIsNone(self.queue.claim("worker-3", 60))
+        job = self.queue.get(job_id)
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["error"], "工作进程多次中断，已放弃重试")
+
+    def test_finished(self):
+        """测试一次查询多个任务时只返回已结束和不存在的任务"""
+        done = self.queue.enqueue("create-proxy", "run_create_proxy")
+        running = self.queue.enqueue("create-proxy", "run_create_proxy")
+        self.queue.claim("worker-1", 60)
+        self.queue.claim("worker-1", 60)
+        self.queue.complete(done, "worker-1", {"ok": True})
+
+        finished = self.queue.finished([done, running, "missing"])
+        self.assertEqual(finished[done], ("succeeded", {"ok": True}, None))
+        self.assertEqual(finished["missing"], (None, None, None))
+        self.assertNotIn(running, finished)
+
+    def test_claim_by_cost(self):
+        """测试按前缀公平分配、前缀内短任务优先，未指定前缀的任务先领取"""
+        long_a = self.queue.enqueue("create-proxy", "run_create_proxy", tenant="a", cost=100)
+        short_a = self.queue.enqueue("create-proxy", "run_create_proxy", tenant="a", cost=10)
+        b = self.queue.enqueue("create-proxy", "run_create_proxy", tenant="b", cost=50)
+        probe = self.queue.enqueue("process-video", "run_process_video")
+
+        order = [self.queue.claim("worker-1", 60)["id"] for _ in range(4)]
+        # a和b的运行中代价都为0时按名称选a；之后a运行中代价10，b为0
+        self.assertEqual(order, [probe, short_a, b, long_a])
+
+    def test_claim_fifo(self):
+        """测试fifo模式下忽略代价，按入队顺序领取"""
+        queue = DurableQueue(os.path.join(self.test_dir, "fifo.db"), scheduling="fifo")
+        first = queue.enqueue("create-proxy", "run_create_proxy", tenant="a", cost=100)
+        second = queue.enqueue("create-proxy", "run_create_proxy", tenant="a", cost=10)
+        self.assertEqual(queue.claim("worker-1", 60)["id"], first)
+        self.assertEqual(queue.claim("worker-1", 60)["id"], second)
+        queue.db.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from ffmpeg_progress import ProgressParser, parse_duration
+
+def block(**fields):
+    """生成一个 -progress 输出块"""
+    return [f"{key}={value}\n" for key, value in fields.items()]
+
+class TestProgressParser(unittest.TestCase):
+    def feed(self, parser, lines):
+        snapshots = [parser.feed(line) for line in lines]
+        self.assertTrue(all(s is None for s in snapshots[:-1]), "块结束前不应返回进度")
+        return snapshots[-1]
+
+    def test_parse_duration(self):
+        """测试从stderr行解析输入时长"""
+        self.assertEqual(
+            parse_duration("  Duration: 01:02:03.50, start: 0.000000, bitrate: 5000 kb/s"),
+            3723.5,
+        )
+        self.assertIsNone(parse_duration("Stream #0:0: Video: h264"))
+
+    def test_percent_and_eta(self):
+        """测试按输入时长计算完成百分比和预计剩余时间"""
+        parser = ProgressParser(duration=100)
+        progress = self.feed(
+            parser,
+            block(
+                frame="750",
+                fps="60.5",
+                out_time_us="25000000",
+                speed="2.5x",
+                progress="continue",
+            ),
+        )
+        self.assertEqual(progress["frame"], 750)
+        self.assertEqual(progress["fps"], 60.5)
+        self.assertEqual(progress["speed"], 2.5)
+        self.assertEqual(progress["out_time"], 25.0)
+        self.assertEqual(progress["percent"], 25.0)
+        self.assertEqual(progress["eta"], 30.0)
+        self.assertFalse(progress["slow"])
+        self.assertFalse(progress["done"])
+
+    def test_not_available_fields(self):
+        """测试编码刚开始时N/A字段解析为None，且不计算百分比"""
+        parser = ProgressParser(duration=100)
+        progress = self.feed(
+            parser,
+            block(
+                frame="0", fps="N/A", out_time_us="N/A", speed="N/A", progress="continue"
+            ),
+        )
+        self.assertEqual(progress["frame"], 0)
+        self.assertIsNone(progress["fps"])
+        self.assertIsNone(progress["speed"])
+        self.assertIsNone(progress["out_time"])
+        self.assertIsNone(progress["percent"])
+        self.assertIsNone(progress["eta"])
+        self.assertFalse(progress["slow"])
+
+    def test_negative_out_time(self):
+        """测试带起始偏移的输入输出负的out_time_us时按0处理"""
+        parser = ProgressParser(duration=10)
+        progress = self.feed(
+            parser, block(out_time_us="-23220", speed="0.5x", progress="continue")
+        )
+        self.assertEqual(progress["out_time"], 0)
+        self.assertEqual(progress["percent"], 0)
+        self.assertEqual(progress["eta"], 20.0)
+        self.assertTrue(progress["slow"])
+
+    def test_end(self):
+        """测试progress=end时标记完成，百分比不超过100"""
+        parser = ProgressParser(duration=10)
+        self.feed(
+            parser,
+            block(frame="150", out_time_us="5000000", speed="1x", progress="continue"),
+        )
+        progress = self.feed(
+            parser, block(frame="301", out_time_us="10040000", speed="1x", progress="end")
+        )
+        self.assertTrue(progress["done"])
+        self.assertEqual(progress["frame"], 301)
+        self.assertEqual(progress["percent"], 100.0)
+        self.assertEqual(progress["eta"], 0.0)
+
+    def test_unknown_duration(self):
+        """测试时长未知时只返回帧数和速度，忽略非key=value行"""
+        parser = ProgressParser()
+        self.assertIsNone(parser.feed("\n"))
+        progress = self.feed(
+            parser, block(frame="30", out_time_us="1000000", speed="3x", progress="continue")
+        )
+        self.assertEqual(progress["out_time"], 1.0)
+        self.assertIsNone(progress["percent"])
+        self.assertIsNone(progress["eta"])
+
+if __name__ == '__main__':
+    unittest.main()
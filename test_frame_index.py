@@ -0,0 +1,83 @@
+import unittest
+import struct
+import subprocess
+from unittest import mock
+from frame_index import (
+    HEADER,
+    decode_frame_index,
+    encode_frame_index,
+    probe_frame_index,
+)
+
+# ffprobe -show_entries stream=time_base:packet=pts,pos,flags -of csv 的输出，
+# packet按解码顺序（I P B B I P B）；最后一个关键帧的pos为N/A，另有一个pts为N/A的packet
+PROBE_OUTPUT = """packet,0,48,K_
+packet,1536,9000,__
+packet,512,12000,__
+packet,1024,13000,__
+packet,2048,20000,K_
+packet,3584,26000,__
+packet,N/A,27000,__
+packet,2560,28000,__
+packet,3072,N/A,K_
+stream,1/15360
+"""
+
+class TestFrameIndex(unittest.TestCase):
+    def probe(self, stdout, returncode=0):
+        result = subprocess.CompletedProcess([], returncode, stdout=stdout, stderr="错误")
+        with mock.patch("frame_index.subprocess.run", return_value=result):
+            return probe_frame_index("proxy.mp4")
+
+    def test_probe_reorders_packets(self):
+        """测试按pts把解码顺序排列为显示顺序，跳过pts为N/A的packet和pos为N/A的关键帧"""
+        index = self.probe(PROBE_OUTPUT)
+        self.assertEqual(index["time_base"], [1, 15360])
+        self.assertEqual(
+            index["pts"], [0, 512, 1024, 1536, 2048, 2560, 3072, 3584]
+        )
+        self.assertEqual(index["keyframes"], [[0, 48], [4, 20000]])
+
+    def test_probe_errors(self):
+        """测试ffprobe失败或没有视频流时抛出异常"""
+        with self.assertRaises(Exception):
+            self.probe("", returncode=1)
+        with self.assertRaises(Exception):
+            self.probe("packet,0,48,K_\n")
+
+    def test_binary_round_trip(self):
+        """测试二进制编码后解码得到相同的索引"""
+        index = self.probe(PROBE_OUTPUT)
+        data = encode_frame_index(index)
+        self.assertEqual(decode_frame_index(data), index)
+
+    def test_binary_layout(self):
+        """测试二进制格式的头部和各表的偏移（客户端按此格式解析）"""
+        index = {"time_base": [1, 90000], "pts": [0, -3000, 3000], "keyframes": [[0, 1234]]}
+        data = encode_frame_index(index)
+        self.assertEqual(HEADER.size, 24)
+        self.assertEqual(len(data), 24 + 3 * 8 + 12)
+        self.assertEqual(
+            HEADER.unpack_from(data), (b"FIDX", 1, 0, 1, 90000, 3, 1)
+        )
+        self.assertEqual(struct.unpack_from("<3q", data, 24), (0, -3000, 3000))
+        self.assertEqual(struct.unpack_from("<IQ", data, 48), (0, 1234))
+
+    def test_json_format(self):
+        """测试JSON格式与解析后的结构相同"""
+        index = self.probe(PROBE_OUTPUT)
+        self.assertEqual(
+            encode_frame_index(index, "json"),
+            b'{"time_base":[1,15360],"pts":[0,512,1024,1536,2048,2560,3072,3584],'
+            b'"keyframes":[[0,48],[4,20000]]}',
+        )
+        with self.assertRaises(ValueError):
+            encode_frame_index(index, "xml")
+
+    def test_decode_rejects_other_files(self):
+        """测试不是帧索引文件时抛出ValueError"""
+        with self.assertRaises(ValueError):
+            decode_frame_index(b"NOPE" + bytes(20))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import os
+import json
+import time
+import shutil
+import sqlite3
+import tempfile
+from metadata_cache import METADATA_VERSION, MetadataCache
+
+METADATA = {"duration": 10.0, "video": {"width": 1920, "height": 1080, "pix_fmt": "yuv420p"}}
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        """在每个测试用例前运行，创建临时数据库路径"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "metadata.db")
+
+    def tearDown(self):
+        """在每个测试用例后运行，删除临时数据库"""
+        shutil.rmtree(self.test_dir)
+
+    def test_memory_lru(self):
+        """测试内存层超过容量时淘汰最久未使用的条目"""
+        cache = MetadataCache(max_entries=2)
+        cache.put("bucket", "a.mp4", "e1", {"key": "a"})
+        cache.put("bucket", "b.mp4", "e1", {"key": "b"})
+        # 访问a后b成为最久未使用的条目
+        self.assertEqual(cache.get("bucket", "a.mp4", "e1"), ({"key": "a"}, "memory"))
+        cache.put("bucket", "c.mp4", "e1", {"key": "c"})
+
+        self.assertEqual(cache.get("bucket", "b.mp4", "e1"), (None, None))
+        self.assertEqual(cache.get("bucket", "a.mp4", "e1")[1], "memory")
+        self.assertEqual(cache.get("bucket", "c.mp4", "e1")[1], "memory")
+
+    def test_memory_ttl(self):
+        """测试内存层条目过期后未命中"""
+        cache = MetadataCache(ttl=0.05)
+        cache.put("bucket", "a.mp4", "e1", METADATA)
+        self.assertEqual(cache.get("bucket", "a.mp4", "e1")[1], "memory")
+        time.sleep(0.1)
+        self.assertEqual(cache.get("bucket", "a.mp4", "e1"), (None, None))
+
+    def test_returns_copy(self):
+        """测试修改返回值不影响缓存内容"""
+        cache = MetadataCache()
+        cache.put("bucket", "a.mp4", "e1", METADATA)
+        metadata, _ = cache.get("bucket", "a.mp4", "e1")
+        metadata["video"]["width"] = 0
+        self.assertEqual(cache.get("bucket", "a.mp4", "e1")[0], METADATA)
+
+    def test_disk_refills_memory(self):
+        """测试重启后从磁盘层命中并回填内存层"""
+        MetadataCache(db_path=self.db_path).put("bucket", "a.mp4", "e1", METADATA)
+        cache = MetadataCache(db_path=self.db_path)
+        self.assertEqual(cache.get("bucket", "a.mp4", "e1"), (METADATA, "disk"))
+        self.assertEqual(cache.get("bucket", "a.mp4", "e1"), (METADATA, "memory"))
+
+    def test_put_replaces_old_etag(self):
+        """测试写入新ETag时删除同一对象旧ETag的磁盘条目"""
+        cache = MetadataCache(db_path=self.db_path)
+        cache.put("bucket", "a.mp4", "e1", METADATA)
+        cache.put("bucket", "a.mp4", "e2", METADATA)
+        cache.put("bucket", "b.mp4", "e1", METADATA)
+
+        rows = sqlite3.connect(self.db_path).execute(
+            "SELECT object_key, etag FROM metadata_cache ORDER BY object_key"
+        ).fetchall()
+        self.assertEqual(rows, [("a.mp4", "e2"), ("b.mp4", "e1")])
+        self.assertEqual(
+            MetadataCache(db_path=self.db_path).get("bucket", "a.mp4", "e1"), (None, None)
+        )
+
+    def test_version_migration(self):
+        """测试旧版本数据库增加version列，旧条目视为未命中，重新写入后命中"""
+        db = sqlite3.connect(self.db_path)
+        db.execute(
+            "CREATE TABLE metadata_cache (bucket TEXT NOT NULL, object_key TEXT NOT NULL, "
+            "etag TEXT NOT NULL, metadata TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (bucket, object_key, etag))"
+        )
+        db.execute(
+            "INSERT INTO metadata_cache VALUES ('bucket', 'a.mp4', 'e1', ?, ?)",
+            (json.dumps({"duration": 10.0, "video": {"width": 1920}}), time.time()),
+        )
+        db.commit()
+        db.close()
+
+        cache = MetadataCache(db_path=self.db_path)
+        self.assertEqual(cache.get("bucket", "a.mp4", "e1"), (None, None))
+        cache.put("bucket", "a.mp4", "e1", METADATA)
+
+        cache = MetadataCache(db_path=self.db_path)
+        self.assertEqual(cache.get("bucket", "a.mp4", "e1"), (METADATA, "disk"))
+        version = sqlite3.connect(self.db_path).execute(
+            "SELECT version FROM metadata_cache"
+        ).fetchone()[0]
+        self.assertEqual(version, METADATA_VERSION)
+
+if __name__ == '__main__':
+    unittest.main()
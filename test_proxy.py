@@ -2,6 +2,7 @@ import requests
 import json
 import sys
 import os
+import time
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -11,6 +12,19 @@ load_dotenv()
 API_URL = os.environ.get("API_URL", "https://your-railway-app-url.railway.app")
 
 
+def wait_for_job(job_id, interval=2):
+    """轮询任务状态直到任务结束"""
+    endpoint = f"{API_URL}/jobs/{job_id}"
+    while True:
+        response = requests.get(endpoint)
+        response.raise_for_status()
+        job = response.json()
+        print(f"任务状态: {job['status']}")
+        if job["status"] in ("succeeded", "failed", "cancelled"):
+            return job
+        time.sleep(interval)
+
+
 def test_create_proxy(object_key, add_text=True):
     """测试代理视频创建API"""
     endpoint = f"{API_URL}/create-proxy"
@@ -27,7 +41,13 @@ def test_create_proxy(object_key, add_text=True):
 
         # 检查响应
         if response.status_code == 200:
-            result = response.json()
+            job_id = response.json()["job_id"]
+            print(f"任务已提交: {job_id}")
+            job = wait_for_job(job_id)
+            if job["status"] != "succeeded":
+                print(f"代理视频创建失败: {job['error']}")
+                return None
+            result = {"data": job["result"]}
             print("\n代理视频创建成功!")
             print("\n处理时间统计:")
             times = result["data"]["processing_times"]
@@ -0,0 +1,125 @@
+import unittest
+import time
+from concurrent.futures import Future
+from scheduler import CostScheduler
+
+class StubExecutor:
+    """记录任务的开始顺序，由测试决定任务何时结束"""
+
+    def __init__(self):
+        self.started = []
+        self.futures = {}
+
+    def start(self, name):
+        def start():
+            self.started.append(name)
+            self.futures[name] = Future()
+            return self.futures[name]
+        return start
+
+    def finish(self, name):
+        self.futures[name].set_result(name)
+
+class TestCostScheduler(unittest.TestCase):
+    def setUp(self):
+        """在每个测试用例前运行，创建调度器和模拟工作池"""
+        self.executor = StubExecutor()
+        self.scheduler = None
+
+    def tearDown(self):
+        """在每个测试用例后运行，关闭估算线程"""
+        if self.scheduler is not None:
+            self.scheduler.shutdown()
+
+    def create(self, max_jobs=1, cores=8, aging_seconds=3600):
+        self.scheduler = CostScheduler(
+            max_jobs, cores=cores, aging_seconds=aging_seconds, default_cost=600
+        )
+        return self.scheduler
+
+    def submit(self, name, tenant, cost=None, threads=1):
+        estimate = (lambda: cost) if cost is not None else None
+        return self.scheduler.submit(
+            self.executor.start(name), tenant, estimate=estimate, threads=threads
+        )
+
+    def wait_estimated(self):
+        # 代价在估算线程中计算，全部估算完成后才能确定调度顺序
+        deadline = time.time() + 5
+        while any(entry["cost"] is None for entry in self.scheduler.pending):
+            self.assertLess(time.time(), deadline, "估算超时")
+            time.sleep(0.01)
+
+    def run_all(self, first):
+        # 依次结束正在运行的任务，返回之后的开始顺序
+        self.executor.finish(first)
+        while len(self.executor.started) > len(
+            [f for f in self.executor.futures.values() if f.done()]
+        ):
+            self.executor.finish(self.executor.started[-1])
+        return self.executor.started[1:]
+
+    def test_shortest_job_first(self):
+        """测试同一前缀内代价小的任务先执行"""
+        self.create()
+        self.submit("blocker", "a")
+        for name, cost in (("long", 300), ("short", 10), ("medium", 100)):
+            self.submit(name, "a", cost)
+        self.wait_estimated()
+
+        self.assertEqual(self.executor.started, ["blocker"])
+        self.assertEqual(self.run_all("blocker"), ["short", "medium", "long"])
+
+    def test_fair_share(self):
+        """测试不同前缀按累计代价轮流执行，不会被先提交的大批任务占满"""
+        self.create()
+        self.submit("blocker", "x")
+        for name in ("a1", "a2", "a3"):
+            self.submit(name, "a", 10)
+        for name in ("b1", "b2"):
+            self.submit(name, "b", 10)
+        self.wait_estimated()
+
+        self.assertEqual(self.run_all("blocker"), ["a1", "b1", "a2", "b2", "a3"])
+
+    def test_aging(self):
+        """测试等待足够久的长任务排在新提交的短任务之前"""
+        self.create(aging_seconds=0.05)
+        self.submit("blocker", "a")
+        self.submit("long", "a", 100)
+        self.wait_estimated()
+        # 等待0.5秒后有效代价约为100/2**10
+        time.sleep(0.5)
+        self.submit("short", "a", 1)
+        self.wait_estimated()
+
+        self.assertEqual(self.run_all("blocker"), ["long", "short"])
+
+    def test_thread_cap(self):
+        """测试运行中任务的线程数之和不超过核数，至少运行一个任务"""
+        self.create(max_jobs=4, cores=4)
+        for name in ("j1", "j2", "j3"):
+            self.submit(name, "a", threads=2)
+        self.assertEqual(self.executor.started, ["j1", "j2"])
+        self.assertEqual(self.scheduler.stats()["threads_in_use"], 4)
+
+        self.executor.finish("j1")
+        self.assertEqual(self.executor.started, ["j1", "j2", "j3"])
+
+        # 超过核数的任务按核数计算，在没有其他任务运行时执行
+        self.submit("wide", "a", threads=16)
+        self.executor.finish("j2")
+        self.executor.finish("j3")
+        self.assertEqual(self.executor.started[-1], "wide")
+        self.assertEqual(self.scheduler.stats()["threads_in_use"], 4)
+
+    def test_result(self):
+        """测试调度器返回的future随任务结束"""
+        self.create()
+        future = self.submit("job", "a")
+        self.assertFalse(future.done())
+        self.executor.finish("job")
+        self.assertEqual(future.result(timeout=1), "job")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import unittest
+import os
+import time
+import shutil
+import tempfile
+import threading
+import scratch
+from scratch import ScratchSpace
+
+def write_file(size):
+    """返回把size字节写入指定路径的fetch函数"""
+    def fetch(path):
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+    return fetch
+
+class TestScratchSpace(unittest.TestCase):
+    def setUp(self):
+        """在每个测试用例前运行，创建临时根目录"""
+        self.test_dir = tempfile.mkdtemp()
+        self.scratch = self.create()
+
+    def tearDown(self):
+        """在每个测试用例后运行，删除临时根目录"""
+        shutil.rmtree(self.test_dir)
+
+    def create(self, budget=1000, cache_entries=8, wait_timeout=0.3):
+        return ScratchSpace(
+            root=self.test_dir,
+            budget=budget,
+            cache_entries=cache_entries,
+            wait_timeout=wait_timeout,
+        )
+
+    def read_usage(self, pid):
+        with open(os.path.join(self.test_dir, f"{pid}.usage")) as f:
+            return f.read()
+
+    def test_over_budget(self):
+        """测试超出预算时等待超时后抛出异常，释放后可以再次分配"""
+        path = self.scratch.allocate(600)
+        self.assertEqual(self.read_usage(os.getpid()), "600 0")
+        with self.assertRaises(Exception):
+            self.scratch.allocate(600)
+
+        self.scratch.release(path)
+        self.assertEqual(self.read_usage(os.getpid()), "0 0")
+        self.scratch.release(self.scratch.allocate(600))
+
+    def test_waiter_wakes_on_release(self):
+        """测试空间不足的调用方在其他任务释放空间后继续执行"""
+        self.scratch.wait_timeout = 5
+        path = self.scratch.allocate(600)
+        timer = threading.Timer(0.1, self.scratch.release, [path])
+        timer.start()
+        start = time.time()
+        self.scratch.release(self.scratch.allocate(600))
+        timer.join()
+        self.assertGreaterEqual(time.time() - start, 0.1)
+        self.assertEqual(self.scratch.usage()["disk_used"], 0)
+
+    def test_shared_budget(self):
+        """测试同一root下其他存活进程的用量计入预算，已退出进程的用量不计入"""
+        with open(os.path.join(self.test_dir, f"{os.getppid()}.usage"), "w") as f:
+            f.write("700 0")
+        with self.assertRaises(Exception):
+            self.scratch.allocate(400)
+        self.scratch.release(self.scratch.allocate(300))
+
+        os.remove(os.path.join(self.test_dir, f"{os.getppid()}.usage"))
+        dead = os.path.join(self.test_dir, "4194303.usage")
+        with open(dead, "w") as f:
+            f.write("700 0")
+        self.scratch.release(self.scratch.allocate(900))
+
+        # 新实例启动时清理已退出进程的用量文件
+        self.create()
+        self.assertFalse(os.path.exists(dead))
+
+    def test_evict_unreferenced_source(self):
+        """测试空间不足时淘汰没有引用的缓存源文件"""
+        path = self.scratch.acquire_source("bucket", "a.mp4", "e1", 600, write_file(600))
+        self.scratch.release_source(path)
+        self.assertTrue(os.path.exists(path))
+
+        self.scratch.allocate(600)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.scratch.usage()["cached_sources"], 0)
+
+    def test_no_eviction_while_referenced(self):
+        """测试仍被引用的源文件不会被淘汰"""
+        path = self.scratch.acquire_source("bucket", "a.mp4", "e1", 600, write_file(600))
+        with self.assertRaises(Exception):
+            self.scratch.allocate(600)
+        self.assertTrue(os.path.exists(path))
+
+    def test_cache_entries(self):
+        """测试缓存数量超过cache_entries时淘汰最久未使用的源文件"""
+        scratch_space = self.create(cache_entries=1)
+        first = scratch_space.acquire_source("bucket", "a.mp4", "e1", 10, write_file(10))
+        scratch_space.release_source(first)
+        scratch_space.acquire_source("bucket", "b.mp4", "e1", 10, write_file(10))
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual(scratch_space.usage()["cached_sources"], 1)
+
+    def test_shared_fetch(self):
+        """测试同时获取同一源文件时只下载一次"""
+        fetches = []
+
+        def fetch(path):
+            fetches.append(path)
+            time.sleep(0.2)
+            write_file(100)(path)
+
+        paths = []
+        threads = [
+            threading.Thread(
+                target=lambda: paths.append(
+                    self.scratch.acquire_source("bucket", "a.mp4", "e1", 100, fetch)
+                )
+            )
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(paths, fetches * 2)
+        self.assertEqual(self.scratch.usage()["disk_used"], 100)
+
+    def test_failed_fetch(self):
+        """测试下载失败时移除条目、归还空间，等待的调用方收到同一异常"""
+        started = threading.Event()
+
+        def fetch(path):
+            started.set()
+            time.sleep(0.1)
+            raise Exception("下载失败")
+
+        errors = []
+
+        def waiter():
+            started.wait()
+            try:
+                self.scratch.acquire_source("bucket", "a.mp4", "e1", 100, fetch)
+            except Exception as e:
+                errors.append(str(e))
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        with self.assertRaises(Exception):
+            self.scratch.acquire_source("bucket", "a.mp4", "e1", 100, fetch)
+        thread.join()
+
+        self.assertEqual(errors, ["下载失败"])
+        self.assertEqual(self.scratch.usage()["cached_sources"], 0)
+        self.assertEqual(self.scratch.usage()["disk_used"], 0)
+        path = self.scratch.acquire_source("bucket", "a.mp4", "e1", 100, write_file(100))
+        self.assertTrue(os.path.exists(path))
+
+    def test_sweep_own_dir(self):
+        """测试进程首次创建临时空间时清理与本进程同pid的遗留目录，之后不再清理"""
+        stale = os.path.join(self.test_dir, str(os.getpid()), "stale.mp4")
+        write_file(10)(stale)
+        scratch._own_dir_cleared = False
+        self.create()
+        self.assertFalse(os.path.exists(stale))
+
+        current = os.path.join(self.test_dir, str(os.getpid()), "current.mp4")
+        write_file(10)(current)
+        self.create()
+        self.assertTrue(os.path.exists(current))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ import requests
 import json
 import sys
 import os
+import time
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -31,6 +32,17 @@ def test_check_ffmpeg():
         print(f"请求发送失败: {str(e)}")
         return None
 
+def wait_for_job(job_id, interval=1):
+    """轮询任务状态直到任务结束"""
+    endpoint = f"{API_URL}/jobs/{job_id}"
+    while True:
+        response = requests.get(endpoint)
+        response.raise_for_status()
+        job = response.json()
+        if job["status"] in ("succeeded", "failed", "cancelled"):
+            return job
+        time.sleep(interval)
+
 def test_process_video(object_key):
     """测试视频处理API"""
     endpoint = f"{API_URL}/process-video"
@@ -49,9 +61,10 @@ def test_process_video(object_key):
         
         # 检查响应
         if response.status_code == 200:
-            print("视频处理成功!")
-            print(f"响应数据: {json.dumps(response.json(), ensure_ascii=False, indent=2)}")
-            return response.json()
+            job = wait_for_job(response.json()["job_id"])
+            print(f"视频处理{'成功' if job['status'] == 'succeeded' else '失败'}!")
+            print(f"响应数据: {json.dumps(job, ensure_ascii=False, indent=2)}")
+            return job
         else:
             print(f"视频处理失败，状态码: {response.status_code}")
             print(f"错误信息: {response.text}")
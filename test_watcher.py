@@ -0,0 +1,170 @@
+import unittest
+import os
+import itertools
+import shutil
+import tempfile
+from concurrent.futures import Future
+from unittest import mock
+import tasks
+from watcher import PrefixWatcher, WatchIndex, is_source_key
+
+class StubProcessor:
+    """按字典序列出self.objects中的对象，记录每次列出的StartAfter"""
+
+    def __init__(self):
+        self.objects = {}
+        self.start_after = []
+
+    def list_keys(self, bucket_name, prefix, start_after=None):
+        self.start_after.append(start_after)
+        for key in sorted(self.objects):
+            if key.startswith(prefix) and (start_after is None or key > start_after):
+                yield {"Key": key, "ETag": self.objects[key]}
+
+    def primary_proxy_key(self, object_key, output_mode=None):
+        return f"proxy/{os.path.splitext(object_key)[0]}_proxy.mp4"
+
+class StubJobManager:
+    """记录提交的任务，由测试决定任务何时结束"""
+
+    ids = itertools.count()
+
+    def __init__(self):
+        self.jobs = {}
+
+    def submit(self, kind, func, bucket_name, object_key, **kwargs):
+        job_id = f"job-{next(self.ids)}"
+        self.jobs[job_id] = (object_key, Future())
+        return job_id
+
+    def get(self, job_id):
+        return {"id": job_id} if job_id in self.jobs else None
+
+    def get_future(self, job_id):
+        return self.jobs[job_id][1] if job_id in self.jobs else None
+
+    def submitted_keys(self):
+        return [object_key for object_key, _ in self.jobs.values()]
+
+class TestPrefixWatcher(unittest.TestCase):
+    def setUp(self):
+        """在每个测试用例前运行，创建临时索引和模拟的S3列表、任务管理器"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "watch.db")
+        self.processor = StubProcessor()
+        self.job_manager = StubJobManager()
+        patches = [
+            mock.patch.object(tasks, "get_processor", lambda: self.processor),
+            mock.patch.object(tasks, "proxy_schedule", lambda *args: None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.watcher = self.create(self.job_manager)
+
+    def tearDown(self):
+        """在每个测试用例后运行，删除临时索引"""
+        shutil.rmtree(self.test_dir)
+
+    def create(self, job_manager, full_scan_interval=3600):
+        return PrefixWatcher(
+            job_manager,
+            "bucket",
+            "uploads/",
+            index=WatchIndex(self.db_path),
+            full_scan_interval=full_scan_interval,
+            add_text=True,
+        )
+
+    def test_is_source_key(self):
+        """测试跳过输出前缀和非视频扩展名"""
+        self.assertTrue(is_source_key("uploads/a.MOV", (".mov",)))
+        self.assertFalse(is_source_key("proxy/uploads/a_proxy.mp4", (".mp4",)))
+        self.assertFalse(is_source_key("thumbnails/a/sprite.vtt", (".vtt",)))
+        self.assertFalse(is_source_key("checkpoints/a/segment_0_300.mp4", (".mp4",)))
+        self.assertFalse(is_source_key("uploads/a.m3u8", (".mp4",)))
+
+    def test_filters_objects(self):
+        """测试扫描时只为源视频提交任务"""
+        self.processor.objects = {
+            "uploads/a.mp4": "e1",
+            "uploads/notes.txt": "e2",
+            "uploads/b.fidx": "e3",
+        }
+        self.assertEqual(
+            self.watcher.scan(), {"listed": 3, "submitted": 1, "full": True}
+        )
+        self.assertEqual(self.job_manager.submitted_keys(), ["uploads/a.mp4"])
+
+    def test_incremental_scan(self):
+        """测试增量扫描从上次列出的最大键之后继续"""
+        self.processor.objects = {"uploads/a.mp4": "e1", "uploads/b.mp4": "e2"}
+        self.watcher.scan()
+        self.processor.objects["uploads/c.mp4"] = "e3"
+
+        self.assertEqual(
+            self.watcher.scan(), {"listed": 1, "submitted": 1, "full": False}
+        )
+        self.assertEqual(self.processor.start_after, [None, "uploads/b.mp4"])
+        # 没有新对象时保持原位置
+        self.watcher.scan()
+        self.assertEqual(self.processor.start_after[-1], "uploads/c.mp4")
+
+    def test_etag_change(self):
+        """测试完整扫描时为内容变化的对象重新提交，未变化的不提交"""
+        self.processor.objects = {"uploads/a.mp4": "e1", "uploads/b.mp4": "e2"}
+        self.watcher.scan()
+        self.processor.objects["uploads/a.mp4"] = "e9"
+
+        # 原地覆盖的对象在增量扫描中不可见
+        self.assertEqual(self.watcher.scan()["submitted"], 0)
+        self.watcher.full_scan_interval = 0
+        self.assertEqual(
+            self.watcher.scan(), {"listed": 2, "submitted": 1, "full": True}
+        )
+        self.assertEqual(
+            self.job_manager.submitted_keys(),
+            ["uploads/a.mp4", "uploads/b.mp4", "uploads/a.mp4"],
+        )
+        self.assertEqual(self.watcher.index.get("bucket", "uploads/a.mp4")["etag"], "e9")
+
+    def test_job_result(self):
+        """测试任务结束后记录结果，旧任务的结果不覆盖重新提交后的状态"""
+        self.processor.objects = {"uploads/a.mp4": "e1"}
+        self.watcher.scan()
+        self.processor.objects["uploads/a.mp4"] = "e2"
+        self.watcher.full_scan_interval = 0
+        self.watcher.scan()
+
+        (_, old), (_, new) = self.job_manager.jobs.values()
+        old.set_exception(Exception("编码失败"))
+        record = self.watcher.index.get("bucket", "uploads/a.mp4")
+        self.assertEqual(record["status"], "submitted")
+        self.assertEqual(record["job_id"], list(self.job_manager.jobs)[1])
+
+        new.set_result({})
+        record = self.watcher.index.get("bucket", "uploads/a.mp4")
+        self.assertEqual(record["status"], "succeeded")
+        self.assertEqual(self.watcher.status()["objects"], {"succeeded": 1})
+
+    def test_resubmit_lost(self):
+        """测试重启后丢失的任务在下一轮完整扫描中重新提交，仍存在的任务继续跟踪"""
+        self.processor.objects = {"uploads/a.mp4": "e1", "uploads/b.mp4": "e2"}
+        self.watcher.scan()
+
+        # 新的任务管理器中只保留了b.mp4的任务
+        job_manager = StubJobManager()
+        kept = list(self.job_manager.jobs)[1]
+        job_manager.jobs[kept] = self.job_manager.jobs[kept]
+        watcher = self.create(job_manager)
+        watcher.resubmit_lost()
+
+        self.assertEqual(watcher.index.get("bucket", "uploads/a.mp4")["status"], "lost")
+        self.assertEqual(watcher.scan(), {"listed": 2, "submitted": 1, "full": True})
+        self.assertEqual(job_manager.submitted_keys(), ["uploads/b.mp4", "uploads/a.mp4"])
+
+        job_manager.jobs[kept][1].set_result({})
+        self.assertEqual(watcher.index.get("bucket", "uploads/b.mp4")["status"], "succeeded")
+
+if __name__ == '__main__':
+    unittest.main()
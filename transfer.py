@@ -0,0 +1,298 @@
+import os
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# S3分片上传要求除最后一片外每片至少5MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+# S3分片上传最多10000片
+MAX_PARTS = 10000
+
+# 对象不存在时的错误码；没有s3:ListBucket权限时，S3对不存在的键返回403而不是404，
+# 查找可复用对象（已有代理文件、检查点）时两者都按"没有可复用的对象"处理
+MISSING_KEY_CODES = ("404", "NoSuchKey", "NotFound")
+ACCESS_DENIED_CODES = ("403", "AccessDenied")
+
+
+def transfer_settings(size):
+    """
+    根据对象大小选择分片大小和并发数
+
+    小文件用较小的分片减少首包等待，大文件增大分片以控制请求数（且不超过10000片）。
+    并发数不超过S3连接池大小，保证传输线程复用共享连接池而不是排队等待连接。
+    环境变量TRANSFER_CHUNK_SIZE、TRANSFER_CONCURRENCY、TRANSFER_MAX_BANDWIDTH可覆盖默认值。
+
+    Args:
+        size (int): 对象大小（字节）
+
+    Returns:
+        dict: chunk_size、concurrency、max_bandwidth（字节/秒，None表示不限速）
+    """
+    mb = 1024 * 1024
+    if size <= 64 * mb:
+        chunk_size, concurrency = 8 * mb, 4
+    elif size <= 1024 * mb:
+        chunk_size, concurrency = 16 * mb, 8
+    else:
+        chunk_size, concurrency = 64 * mb, 16
+    chunk_size = max(chunk_size, -(-size // MAX_PARTS))
+
+    chunk_size = int(os.environ.get("TRANSFER_CHUNK_SIZE") or chunk_size)
+    concurrency = int(os.environ.get("TRANSFER_CONCURRENCY") or concurrency)
+    pool_size = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", "32"))
+    max_bandwidth = os.environ.get("TRANSFER_MAX_BANDWIDTH")
+    return {
+        "chunk_size": max(MIN_PART_SIZE, chunk_size),
+        "concurrency": max(1, min(concurrency, pool_size)),
+        "max_bandwidth": int(max_bandwidth) if max_bandwidth else None,
+    }
+
+
+def transfer_config(size):
+    """
+    根据对象大小生成boto3的TransferConfig
+    """
+    settings = transfer_settings(size)
+    return TransferConfig(
+        multipart_threshold=settings["chunk_size"],
+        multipart_chunksize=settings["chunk_size"],
+        max_concurrency=settings["concurrency"],
+        max_bandwidth=settings["max_bandwidth"],
+    )
+
+
+def _throughput(size, seconds):
+    return {
+        "bytes": size,
+        "seconds": round(seconds, 2),
+        "mbps": round(size / (1024 * 1024) / seconds, 2) if seconds > 0 else None,
+    }
+
+
+def parallel_download(
+    s3_client, bucket_name, object_key, file_path, size=None, etag=None
+):
+    """
+    并发Range下载S3对象：预分配目标文件，各分片直接写入对应偏移
+
+    Args:
+        s3_client: boto3 S3客户端（共享连接池）
+        bucket_name (str): S3存储桶名称
+        object_key (str): S3对象键（路径）
+        file_path (str): 本地目标文件路径
+        size (int, optional): 已知的对象大小，传入时不再调用head_object
+        etag (str, optional): 期望的ETag，传入时各分片请求带IfMatch，
+            对象在下载过程中被覆盖会直接失败而不是拼出混合内容
+
+    Returns:
+        dict: 传输字节数、耗时和吞吐量（MB/s）
+    """
+    start = time.time()
+    if size is None:
+        size = s3_client.head_object(Bucket=bucket_name, Key=object_key)[
+            "ContentLength"
+        ]
+    conditions = {"IfMatch": etag} if etag else {}
+    settings = transfer_settings(size)
+    chunk_size = settings["chunk_size"]
+    max_bandwidth = settings["max_bandwidth"]
+
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        # 预分配空间，磁盘不足时在开始下载前就失败
+        if size > 0:
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except (AttributeError, OSError):
+                os.ftruncate(fd, size)
+
+        def fetch(offset):
+            end = min(offset + chunk_size, size) - 1
+            response = s3_client.get_object(
+                Bucket=bucket_name,
+                Key=object_key,
+                Range=f"bytes={offset}-{end}",
+                **conditions,
+            )
+            position = offset
+            for chunk in response["Body"].iter_chunks(chunk_size=1024 * 1024):
+                os.pwrite(fd, chunk, position)
+                position += len(chunk)
+                if max_bandwidth:
+                    # 简单限速：按每个线程分到的带宽控制写入节奏
+                    time.sleep(
+                        len(chunk) / (max_bandwidth / settings["concurrency"])
+                    )
+            if position != end + 1:
+                raise Exception(f"分片下载不完整: {offset}-{end}")
+
+        with ThreadPoolExecutor(
+            max_workers=settings["concurrency"], thread_name_prefix="range-download"
+        ) as pool:
+            list(pool.map(fetch, range(0, size, chunk_size)))
+    finally:
+        os.close(fd)
+
+    stats = _throughput(size, time.time() - start)
+    logger.info(
+        f"下载完成: {bucket_name}/{object_key} {size}字节 {stats['mbps']}MB/s"
+    )
+    return stats
+
+
+def upload_file(s3_client, file_path, bucket_name, object_key, extra_args=None):
+    """
+    使用按文件大小调优的TransferConfig上传文件
+
+    Returns:
+        dict: 传输字节数、耗时和吞吐量（MB/s）
+    """
+    start = time.time()
+    size = os.path.getsize(file_path)
+    s3_client.upload_file(
+        file_path,
+        bucket_name,
+        object_key,
+        ExtraArgs=extra_args,
+        Config=transfer_config(size),
+    )
+    stats = _throughput(size, time.time() - start)
+    logger.info(f"上传完成: {bucket_name}/{object_key} {size}字节 {stats['mbps']}MB/s")
+    return stats
+
+
+class StreamingMultipartUpload:
+    def __init__(
+        self,
+        s3_client,
+        bucket_name,
+        object_key,
+        part_size=None,
+        max_concurrency=None,
+        metadata=None,
+    ):
+        """
+        边写入边上传的S3分片上传
+
+        数据按part_size切片，后台线程并发上传；同时在途的分片数受max_concurrency限制，
+        内存占用约为 part_size * (max_concurrency + 1)。
+
+        Args:
+            s3_client: boto3 S3客户端
+            bucket_name (str): S3存储桶名称
+            object_key (str): S3对象键（路径）
+            part_size (int, optional): 分片大小，默认读取环境变量STREAM_UPLOAD_PART_SIZE（字节）
+            max_concurrency (int, optional): 并发上传的分片数，默认读取环境变量
+                STREAM_UPLOAD_CONCURRENCY
+            metadata (dict, optional): 对象的S3用户元数据
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.part_size = max(
+            MIN_PART_SIZE,
+            part_size or int(os.environ.get("STREAM_UPLOAD_PART_SIZE", str(8 * 1024 * 1024))),
+        )
+        max_concurrency = max_concurrency or int(
+            os.environ.get("STREAM_UPLOAD_CONCURRENCY", "4")
+        )
+
+        self.buffer = bytearray()
+        self.futures = []
+        self.bytes_written = 0
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="part-upload"
+        )
+        self.slots = threading.Semaphore(max_concurrency)
+
+        response = self.s3_client.create_multipart_upload(
+            Bucket=bucket_name,
+            Key=object_key,
+            ContentType="video/mp4",
+            Metadata=metadata or {},
+        )
+        self.upload_id = response["UploadId"]
+        logger.info(f"开始分片上传: {bucket_name}/{object_key}")
+
+    def write(self, data):
+        """
+        写入数据，缓冲区满一个分片时提交上传
+        """
+        self.buffer.extend(data)
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            part = bytes(self.buffer[: self.part_size])
+            del self.buffer[: self.part_size]
+            self._submit(part)
+
+    def _submit(self, data):
+        # 已有分片失败时立即停止，不再继续编码和上传
+        for future in self.futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        # 在途分片达到上限时阻塞写入方，避免内存无限增长
+        self.slots.acquire()
+        part_number = len(self.futures) + 1
+        future = self.executor.submit(self._upload_part, part_number, data)
+        self.futures.append(future)
+
+    def _upload_part(self, part_number, data):
+        try:
+            response = self.s3_client.upload_part(
+                Bucket=self.bucket_name,
+                Key=self.object_key,
+                UploadId=self.upload_id,
+                PartNumber=part_number,
+                Body=data,
+            )
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
+        finally:
+            self.slots.release()
+
+    def complete(self):
+        """
+        上传剩余数据并完成分片上传
+
+        Returns:
+            int: 上传的总字节数
+        """
+        try:
+            if self.buffer or not self.futures:
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            parts = [future.result() for future in self.futures]
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=self.object_key,
+                UploadId=self.upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+            logger.info(
+                f"分片上传完成: {self.bucket_name}/{self.object_key} "
+                f"{len(parts)}片 {self.bytes_written}字节"
+            )
+            return self.bytes_written
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown(wait=False)
+
+    def abort(self):
+        """
+        取消分片上传，释放S3上已上传的分片
+        """
+        self.executor.shutdown(wait=True)
+        try:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=self.object_key, UploadId=self.upload_id
+            )
+            logger.info(f"已取消分片上传: {self.bucket_name}/{self.object_key}")
+        except Exception as e:
+            logger.error(f"取消分片上传失败: {e}")
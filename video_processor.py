@@ -1,67 +1,123 @@
 import os
 import boto3
+from botocore.config import Config
 import tempfile
 import uuid
 from botocore.exceptions import ClientError
-import ffmpeg
 import logging
 import time
-import requests
+import json
+import math
+import hashlib
+import mimetypes
+import shutil
+import struct
 import subprocess
+import threading
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+import transfer
+from transfer import ACCESS_DENIED_CODES, MISSING_KEY_CODES, StreamingMultipartUpload
+from ffmpeg_progress import ProgressParser, parse_duration
+from ffmpeg_capabilities import resolve_font
+from scheduler import available_cpus, encode_threads
+from checkpoint import SegmentCheckpoint
+from frame_index import FRAME_INDEX_FORMATS, probe_frame_index, encode_frame_index
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 代理文件的输出规格
+PROXY_HEIGHT = 540
+PROXY_FPS = 30
+
+# 缩略图格式对应的编码参数和Content-Type
+THUMBNAIL_FORMATS = {
+    "jpg": (["-q:v", "3"], "image/jpeg"),
+    "webp": (["-c:v", "libwebp", "-quality", "80"], "image/webp"),
+    "png": ([], "image/png"),
+}
+
+# HLS输出文件的Content-Type
+HLS_CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+}
+
 
 class VideoProcessor:
     def __init__(
-        self, aws_access_key_id=None, aws_secret_access_key=None, region_name=None
+        self,
+        aws_access_key_id=None,
+        aws_secret_access_key=None,
+        region_name=None,
+        metadata_cache=None,
+        max_pool_connections=None,
+        endpoint_url=None,
+        content_index=None,
+        scratch=None,
     ):
         """
         初始化S3客户端
         如果不提供凭证，将使用环境变量或IAM角色
+
+        boto3客户端是线程安全的，同一个VideoProcessor可以在整个进程的工作线程间共享，
+        连接池中的连接保持长连接复用，避免每个请求重新握手。
+
+        Args:
+            metadata_cache (MetadataCache, optional): 元数据缓存，不指定则每次都重新探测
+            max_pool_connections (int, optional): S3连接池大小，默认读取环境变量
+                S3_MAX_POOL_CONNECTIONS，未设置时为32
+            endpoint_url (str, optional): S3兼容服务地址（MinIO、本地模拟服务等），
+                默认读取环境变量S3_ENDPOINT_URL
+            content_index (ContentIndex, optional): 内容摘要索引，不指定则不做跨对象去重
+            scratch (ScratchSpace, optional): 临时空间管理，指定时临时文件受预算限制，
+                下载的源文件在各接口间共享缓存
         """
+        max_pool_connections = max_pool_connections or int(
+            os.environ.get("S3_MAX_POOL_CONNECTIONS", "32")
+        )
         self.s3_client = boto3.client(
             "s3",
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
             region_name=region_name,
+            endpoint_url=endpoint_url or os.environ.get("S3_ENDPOINT_URL") or None,
+            config=Config(
+                max_pool_connections=max_pool_connections,
+                tcp_keepalive=True,
+                retries={"max_attempts": 5, "mode": "adaptive"},
+            ),
         )
-        self.temp_dir = tempfile.gettempdir()
-        self.font_path = self._ensure_font()
+        self.scratch = scratch
+        self.temp_dir = scratch.dir if scratch is not None else tempfile.gettempdir()
+        # 字体在进程内只解析一次（打包字体、fontconfig或系统路径），不访问网络
+        self.font_path = resolve_font()
+        self.metadata_cache = metadata_cache
+        self.content_index = content_index
+        # 每个工作线程当前所处的处理阶段，任务失败时用于按阶段统计错误
+        self._stage = threading.local()
+
+    def _set_stage(self, stage):
+        self._stage.name = stage
 
-    def _ensure_font(self):
+    def current_stage(self):
         """
-        确保字体文件存在，如果不存在则下载
+        返回当前线程最近进入的处理阶段（head、download、probe、encode、upload）
         """
-        # 字体文件路径
-        font_path = os.path.join(self.temp_dir, "NotoSans-Regular.ttf")
+        return getattr(self._stage, "name", None)
 
-        # 如果字体文件不存在，则下载
-        if not os.path.exists(font_path):
-            try:
-                logger.info("正在下载字体文件...")
-                # Noto Sans Regular 字体的 Google Fonts 下载链接
-                font_url = "https://fonts.google.com/download?family=Noto%20Sans"
-                response = requests.get(font_url)
-                with open(font_path, "wb") as f:
-                    f.write(response.content)
-                logger.info(f"字体文件已下载到: {font_path}")
-            except Exception as e:
-                logger.error(f"下载字体文件失败: {e}")
-                # 如果下载失败，使用系统默认字体
-                font_path = None
-
-        return font_path
-
-    def download_video(self, bucket_name, object_key):
+    def download_video(self, bucket_name, object_key, stats=None):
         """
-        从S3下载视频文件到临时目录
+        从S3下载视频文件到临时目录（并发Range下载）
 
         Args:
             bucket_name (str): S3存储桶名称
             object_key (str): S3对象键（路径）
+            stats (dict, optional): 传入时写入传输统计（字节数、耗时、MB/s）
 
         Returns:
             str: 临时文件的路径
@@ -72,25 +128,218 @@ class VideoProcessor:
 
         try:
             logger.info(f"开始从S3下载: {bucket_name}/{object_key}")
-            self.s3_client.download_file(bucket_name, object_key, temp_file_path)
+            result = transfer.parallel_download(
+                self.s3_client, bucket_name, object_key, temp_file_path
+            )
+            if stats is not None:
+                stats.update(result)
             logger.info(f"下载完成，临时文件: {temp_file_path}")
             return temp_file_path
         except ClientError as e:
             logger.error(f"下载S3文件失败: {e}")
+            self.cleanup_temp_file(temp_file_path)
             raise Exception(f"无法从S3下载文件: {e}")
+        except Exception:
+            self.cleanup_temp_file(temp_file_path)
+            raise
+
+    def acquire_source(self, bucket_name, object_key, stats=None):
+        """
+        获取源视频的本地文件；启用临时空间管理时按ETag复用已下载的副本
+
+        Args:
+            stats (dict, optional): 实际下载时写入传输统计，复用缓存时写入cached=True
+
+        Returns:
+            str: 本地文件路径，使用完毕后调用release_source
+        """
+        self._set_stage("download")
+        if self.scratch is None:
+            return self.download_video(bucket_name, object_key, stats)
+
+        head = self.s3_client.head_object(Bucket=bucket_name, Key=object_key)
+        downloaded = {}
+
+        def fetch(path):
+            logger.info(f"开始从S3下载: {bucket_name}/{object_key}")
+            try:
+                downloaded.update(
+                    transfer.parallel_download(
+                        self.s3_client,
+                        bucket_name,
+                        object_key,
+                        path,
+                        size=head["ContentLength"],
+                        etag=head["ETag"],
+                    )
+                )
+            except ClientError as e:
+                logger.error(f"下载S3文件失败: {e}")
+                raise Exception(f"无法从S3下载文件: {e}")
+
+        path = self.scratch.acquire_source(
+            bucket_name, object_key, head["ETag"], head["ContentLength"], fetch
+        )
+        if stats is not None:
+            stats.update(downloaded or {"bytes": 0, "seconds": 0, "cached": True})
+        return path
+
+    def release_source(self, file_path):
+        """
+        释放acquire_source取得的源文件
+        """
+        if self.scratch is None:
+            self.cleanup_temp_file(file_path)
+        else:
+            self.scratch.release_source(file_path)
+
+    def list_keys(self, bucket_name, prefix="", start_after=None):
+        """
+        分页列出前缀下的所有对象
+
+        Args:
+            bucket_name (str): S3存储桶名称
+            prefix (str): 对象键前缀
+            start_after (str, optional): 只列出字典序在该键之后的对象
+
+        Yields:
+            dict: list_objects_v2返回的对象信息（Key、ETag、Size、LastModified）
+        """
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        params = {"Bucket": bucket_name, "Prefix": prefix}
+        if start_after:
+            params["StartAfter"] = start_after
+        for page in paginator.paginate(**params):
+            for item in page.get("Contents", []):
+                # 跳过控制台创建的"目录"占位对象
+                if not item["Key"].endswith("/"):
+                    yield item
+
+    def generate_presigned_url(self, bucket_name, object_key, expires_in=3600):
+        """
+        生成S3对象的预签名URL，供ffmpeg通过HTTP直接读取
+
+        Args:
+            bucket_name (str): S3存储桶名称
+            object_key (str): S3对象键（路径）
+            expires_in (int): 有效期（秒）
+
+        Returns:
+            str: 预签名URL
+        """
+        return self.s3_client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": bucket_name, "Key": object_key},
+            ExpiresIn=expires_in,
+        )
+
+    def read_range(self, bucket_name, object_key, start, end):
+        """
+        使用Range请求读取S3对象的一段字节
+
+        Args:
+            start (int): 起始偏移（包含）
+            end (int): 结束偏移（包含）
+
+        Returns:
+            bytes: 读取到的数据
+        """
+        response = self.s3_client.get_object(
+            Bucket=bucket_name, Key=object_key, Range=f"bytes={start}-{end}"
+        )
+        return response["Body"].read()
+
+    def is_faststart(self, bucket_name, object_key, max_boxes=32):
+        """
+        检查MP4/MOV文件的moov是否位于mdat之前（即可以顺序流式解码）
+
+        只读取每个顶层box的16字节头部，不下载媒体数据。
+        非ISO BMFF容器（mkv、ts等）视为可以流式读取。
+
+        Returns:
+            bool: moov在mdat之前时返回True
+        """
+        file_extension = os.path.splitext(object_key)[1].lower()
+        if file_extension not in (".mp4", ".mov", ".m4v", ".3gp"):
+            return True
+
+        offset = 0
+        for _ in range(max_boxes):
+            try:
+                header = self.read_range(bucket_name, object_key, offset, offset + 15)
+            except ClientError as e:
+                # Range超出文件末尾
+                logger.warning(f"读取box头部失败: {e}")
+                return False
+            if len(header) < 8:
+                return False
+            box_size, box_type = struct.unpack(">I4s", header[:8])
+            if box_type == b"moov":
+                return True
+            if box_type == b"mdat":
+                return False
+            if box_size == 1:
+                if len(header) < 16:
+                    return False
+                box_size = struct.unpack(">Q", header[8:16])[0]
+            elif box_size == 0:
+                # box延伸到文件末尾
+                return False
+            if box_size < 8:
+                return False
+            offset += box_size
+        return False
+
+    def resolve_input(self, bucket_name, object_key, input_mode=None, stats=None):
+        """
+        根据输入模式决定ffmpeg读取源视频的方式
+
+        Args:
+            input_mode (str, optional): "url"（预签名URL，ffmpeg按需Range读取）、
+                "pipe"（get_object流写入ffmpeg的stdin）或 "file"（先完整下载）。
+                默认读取环境变量PROXY_INPUT_MODE，未设置时为 "url"
+
+            stats (dict, optional): file模式下写入下载统计
+
+        Returns:
+            tuple: (实际使用的模式, ffmpeg输入参数, stdin数据流或None)
+        """
+        input_mode = input_mode or os.environ.get("PROXY_INPUT_MODE", "url")
+
+        if input_mode == "pipe":
+            # stdin不可回溯，moov在末尾的文件无法从管道解码，回退到临时文件
+            if self.is_faststart(bucket_name, object_key):
+                response = self.s3_client.get_object(Bucket=bucket_name, Key=object_key)
+                return "pipe", "pipe:0", response["Body"]
+            logger.info(f"moov位于文件末尾，回退到临时文件模式: {object_key}")
+            input_mode = "file"
+
+        if input_mode == "url":
+            # ffmpeg的HTTP输入支持Range回溯，moov在末尾时也只多一次Range请求
+            return "url", self.generate_presigned_url(bucket_name, object_key), None
+
+        if input_mode != "file":
+            raise Exception(f"不支持的输入模式: {input_mode}")
+        return "file", self.acquire_source(bucket_name, object_key, stats), None
 
     def get_video_metadata(self, file_path):
         """
         使用ffmpeg获取视频元数据
 
         Args:
-            file_path (str): 视频文件路径
+            file_path (str): 视频文件路径或预签名URL
 
         Returns:
             dict: 视频元数据
         """
         try:
-            logger.info(f"开始获取视频元数据: {file_path}")
+            if file_path.startswith(("http://", "https://")):
+                logger.info("开始获取视频元数据: <presigned-url>")
+            else:
+                logger.info(f"开始获取视频元数据: {file_path}")
+            # ffmpeg-python只在探测时使用，延迟导入以缩短启动时间
+            import ffmpeg
+
             probe = ffmpeg.probe(file_path)
 
             # 提取关键元数据
@@ -109,6 +358,11 @@ class VideoProcessor:
             ]
             if video_streams:
                 video_stream = video_streams[0]
+                # 手机拍摄的视频常以旋转元数据表示竖屏
+                rotation = int(video_stream.get("tags", {}).get("rotate", 0))
+                for side_data in video_stream.get("side_data_list", []):
+                    if "rotation" in side_data:
+                        rotation = int(side_data["rotation"])
                 metadata["video"] = {
                     "codec": video_stream["codec_name"],
                     "width": video_stream["width"],
@@ -116,6 +370,8 @@ class VideoProcessor:
                     "fps": eval(video_stream["avg_frame_rate"])
                     if "avg_frame_rate" in video_stream
                     else None,
+                    "pix_fmt": video_stream.get("pix_fmt"),
+                    "rotation": rotation,
                 }
 
             # 提取音频流信息
@@ -152,9 +408,12 @@ class VideoProcessor:
         except Exception as e:
             logger.error(f"删除临时文件失败: {e}")
 
-    def process_video(self, bucket_name, object_key):
+    def probe_remote(self, bucket_name, object_key):
         """
-        处理视频的主函数：下载、获取元数据、清理
+        通过预签名URL获取元数据，不下载整个文件
+
+        ffprobe通过HTTP Range只读取容器头部和索引（moov在末尾的MP4会额外
+        Range读取文件尾部），耗时取决于头部大小而不是文件大小。
 
         Args:
             bucket_name (str): S3存储桶名称
@@ -163,36 +422,345 @@ class VideoProcessor:
         Returns:
             dict: 视频元数据
         """
-        temp_file_path = None
-        try:
-            # 下载视频
-            temp_file_path = self.download_video(bucket_name, object_key)
+        url = self.generate_presigned_url(bucket_name, object_key)
+        return self.get_video_metadata(url)
+
+    def process_video(self, bucket_name, object_key, probe_mode=None):
+        """
+        处理视频的主函数：获取元数据，必要时下载并清理
 
-            # 获取元数据
-            metadata = self.get_video_metadata(temp_file_path)
+        Args:
+            bucket_name (str): S3存储桶名称
+            object_key (str): S3对象键（路径）
+            probe_mode (str, optional): "url"（Range读取头部）或 "file"（完整下载），
+                默认读取环境变量PROBE_MODE，未设置时为 "url"
 
-            # 添加源信息
-            metadata["source"] = {"bucket": bucket_name, "key": object_key}
+        Returns:
+            dict: 视频元数据
+        """
+        probe_mode = probe_mode or os.environ.get("PROBE_MODE", "url")
+        probe_start = time.time()
+        metadata = None
+        etag = None
+        cache_tier = None
 
-            return metadata
+        self._set_stage("head")
+        if self.metadata_cache is not None:
+            # head_object很便宜，用ETag确认缓存的元数据仍对应当前内容
+            etag = self.s3_client.head_object(Bucket=bucket_name, Key=object_key)[
+                "ETag"
+            ]
+            metadata, cache_tier = self.metadata_cache.get(
+                bucket_name, object_key, etag
+            )
+            if metadata is not None:
+                probe_mode = "cache"
+
+        self._set_stage("probe")
+        if metadata is None and probe_mode == "url":
+            try:
+                metadata = self.probe_remote(bucket_name, object_key)
+            except Exception as e:
+                # 部分容器无法通过HTTP探测，回退到完整下载
+                logger.warning(f"远程探测失败，回退到下载模式: {e}")
+                probe_mode = "file"
+
+        if metadata is None:
+            temp_file_path = None
+            try:
+                # 下载视频（启用临时空间管理时与代理接口共享）
+                temp_file_path = self.acquire_source(bucket_name, object_key)
+
+                # 获取元数据
+                self._set_stage("probe")
+                metadata = self.get_video_metadata(temp_file_path)
+            finally:
+                # 无论成功与否，都清理临时文件
+                if temp_file_path:
+                    self.release_source(temp_file_path)
+
+        if etag is not None and cache_tier is None:
+            self.metadata_cache.put(bucket_name, object_key, etag, metadata)
+
+        # 添加源信息
+        metadata["source"] = {"bucket": bucket_name, "key": object_key}
+        metadata["probe"] = {
+            "mode": probe_mode,
+            "time": round(time.time() - probe_start, 2),
+        }
+        metadata["cache"] = {"hit": cache_tier is not None, "tier": cache_tier}
+
+        return metadata
+
+    def _run_ffmpeg(
+        self, cmd, input_stream=None, output_handler=None, progress_callback=None
+    ):
+        """
+        执行ffmpeg命令，可选地把数据流写入其stdin、从stdout读取输出、上报实时进度
+
+        stderr按行读取，只保留最后FFMPEG_STDERR_TAIL_LINES行用于错误报告，
+        长视频的日志不会在内存中无限增长。
+
+        Args:
+            cmd (list): ffmpeg命令
+            input_stream (optional): 带有iter_chunks()的数据流（例如S3 get_object的Body）
+            output_handler (callable, optional): 命令输出到pipe:1时，
+                每读到一块stdout数据就调用一次
+            progress_callback (callable, optional): 每收到一个 -progress 块就以进度字典调用
+
+        Returns:
+            tuple: (返回码, stderr末尾若干行)
+        """
+        progress_read_fd = None
+        pass_fds = ()
+        if progress_callback is not None:
+            # 进度通过单独的管道输出，不与stdout上的视频数据或stderr日志混在一起
+            progress_read_fd, progress_write_fd = os.pipe()
+            pass_fds = (progress_write_fd,)
+            cmd = [cmd[0], "-progress", f"pipe:{progress_write_fd}", "-nostats"] + cmd[1:]
+
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE if input_stream is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE
+                if output_handler is not None
+                else subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                pass_fds=pass_fds,
+            )
+        except Exception:
+            # 启动失败（例如找不到ffmpeg）时没有线程读取进度管道，在这里关闭读端
+            if progress_read_fd is not None:
+                os.close(progress_read_fd)
+            raise
         finally:
-            # 无论成功与否，都清理临时文件
-            if temp_file_path:
-                self.cleanup_temp_file(temp_file_path)
+            # 子进程已继承写端，父进程关闭自己的副本，子进程退出时读端才能读到EOF
+            for fd in pass_fds:
+                os.close(fd)
+
+        threads = []
+        if input_stream is not None:
 
-    def create_proxy_with_counter(self, input_file, output_file=None, add_text=True):
+            def feed():
+                # 边下载边写入ffmpeg，ffmpeg提前退出时停止写入
+                try:
+                    for chunk in input_stream.iter_chunks(chunk_size=1024 * 1024):
+                        process.stdin.write(chunk)
+                except (BrokenPipeError, ValueError):
+                    pass
+                except Exception as e:
+                    logger.error(f"写入ffmpeg输入流失败: {e}")
+                finally:
+                    try:
+                        process.stdin.close()
+                    except BrokenPipeError:
+                        pass
+                    input_stream.close()
+
+            threads.append(threading.Thread(target=feed, daemon=True))
+
+        stderr_tail = deque(
+            maxlen=int(os.environ.get("FFMPEG_STDERR_TAIL_LINES", "50"))
+        )
+        parser = ProgressParser()
+
+        def read_stderr():
+            for raw_line in process.stderr:
+                line = raw_line.decode(errors="replace").rstrip()
+                stderr_tail.append(line)
+                if parser.duration is None:
+                    parser.duration = parse_duration(line)
+
+        threads.append(threading.Thread(target=read_stderr, daemon=True))
+
+        if progress_read_fd is not None:
+
+            def read_progress():
+                with os.fdopen(progress_read_fd, errors="replace") as progress_pipe:
+                    for line in progress_pipe:
+                        progress = parser.feed(line)
+                        if progress is None:
+                            continue
+                        try:
+                            progress_callback(progress)
+                        except Exception as e:
+                            logger.error(f"进度回调失败: {e}")
+
+            threads.append(threading.Thread(target=read_progress, daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        if output_handler is not None:
+            # stdout在当前线程读取，stderr和进度在后台线程读取，避免管道写满阻塞ffmpeg
+            try:
+                for chunk in iter(lambda: process.stdout.read(1024 * 1024), b""):
+                    output_handler(chunk)
+            except Exception:
+                process.kill()
+                process.wait()
+                raise
+            finally:
+                for thread in threads:
+                    thread.join()
+        process.wait()
+        for thread in threads:
+            thread.join()
+        return process.returncode, "\n".join(stderr_tail)
+
+    def _proxy_video_filter(
+        self, add_text, start_number=0, height=PROXY_HEIGHT, fps=PROXY_FPS
+    ):
         """
-        将视频压制为720p 30fps并添加帧数计数器
+        构建代理文件的视频滤镜
 
         Args:
-            input_file (str): 输入视频文件路径
+            add_text (bool): 是否添加帧数计数器
+            start_number (int): 计数器起始帧号，分段编码时为该段的全局起始帧
+            height (int): 输出高度
+            fps (float): 输出帧率
+
+        Returns:
+            str: ffmpeg -vf参数
+        """
+        if not add_text:
+            return f"scale=-1:{height},fps=fps={fps}"
+        fontsize = max(12, round(60 * height / PROXY_HEIGHT))
+        # 未找到字体文件时省略fontfile，由ffmpeg通过fontconfig选择默认字体
+        fontfile = f":fontfile={self.font_path}" if self.font_path else ""
+        return (
+            f"scale=-1:{height},fps=fps={fps},"
+            f"drawtext=text='%{{frame_num}}':start_number={start_number}"
+            f":x=10:y=h-th-10{fontfile}:fontsize={fontsize}"
+            ":fontcolor=yellow:box=1:boxcolor=black@0.5"
+        )
+
+    def _proxy_video_codec_args(
+        self, codec="libx264", preset="ultrafast", crf=23, threads=None
+    ):
+        return [
+            "-c:v",
+            codec,  # 视频编码默认使用h264
+            "-preset",
+            preset,  # 默认使用最快的预设
+            "-crf",
+            str(crf),  # 视频质量参数
+            "-threads",
+            str(threads or encode_threads()),  # 与调度器准入时占用的线程数一致
+        ]
+
+    def plan_proxy(self, metadata, add_text):
+        """
+        根据源视频的元数据选择代价最低的代理文件生成方式
+
+        视频流已是H.264/yuv420p、高度不超过540、30fps且不加计数器时直接复制，
+        完全不解码；音频已是单/双声道AAC时直接复制。
+
+        Args:
+            metadata (dict): get_video_metadata的返回值
+            add_text (bool): 是否添加帧数计数器（需要解码，视频流不能复制）
+
+        Returns:
+            dict: video（"copy"/"encode"）、audio（"copy"/"encode"/"none"），
+                以及path："remux"（全部复制）、"video-copy"、"audio-copy" 或 "transcode"
+        """
+        video = metadata.get("video")
+        audio = metadata.get("audio")
+        video_copy = (
+            not add_text
+            and video is not None
+            and video["codec"] == "h264"
+            and video.get("pix_fmt") == "yuv420p"
+            and video["height"] <= PROXY_HEIGHT
+            and video.get("fps") is not None
+            and abs(video["fps"] - PROXY_FPS) < 0.01
+            and not video.get("rotation")
+        )
+        if audio is None:
+            audio_action = "none"
+        elif audio["codec"] == "aac" and audio["channels"] <= 2:
+            audio_action = "copy"
+        else:
+            audio_action = "encode"
+
+        if video_copy:
+            path = "remux" if audio_action != "encode" else "video-copy"
+        else:
+            path = "audio-copy" if audio_action == "copy" else "transcode"
+        return {
+            "video": "copy" if video_copy else "encode",
+            "audio": audio_action,
+            "path": path,
+        }
+
+    def _proxy_stream_args(self, add_text, plan=None):
+        """
+        按生成方式构建音视频编码参数，plan为None时完整转码
+        """
+        if plan is not None and plan["video"] == "copy":
+            video_args = ["-c:v", "copy"]
+        else:
+            video_args = [
+                "-vf",
+                self._proxy_video_filter(add_text),
+                *self._proxy_video_codec_args(),
+            ]
+        if plan is not None and plan["audio"] == "copy":
+            audio_args = ["-c:a", "copy"]
+        else:
+            audio_args = [
+                "-c:a",
+                "aac",  # 音频编码使用aac
+                "-b:a",
+                "64k",  # 降低音频比特率
+            ]
+        return video_args + audio_args
+
+    def source_metadata(self, bucket_name, object_key, etag, input_mode, input_source):
+        """
+        获取源视频元数据用于选择生成方式：优先使用元数据缓存，否则探测输入
+
+        管道输入不能重复读取，改为通过预签名URL探测（只读取头部）。
+        """
+        if self.metadata_cache is not None:
+            metadata, _ = self.metadata_cache.get(bucket_name, object_key, etag)
+            if metadata is not None:
+                return metadata
+        if input_mode == "pipe":
+            input_source = self.generate_presigned_url(bucket_name, object_key)
+        metadata = self.get_video_metadata(input_source)
+        if self.metadata_cache is not None:
+            self.metadata_cache.put(bucket_name, object_key, etag, metadata)
+        return metadata
+
+    def create_proxy_with_counter(
+        self,
+        input_file,
+        output_file=None,
+        add_text=True,
+        input_stream=None,
+        progress_callback=None,
+        plan=None,
+    ):
+        """
+        将视频压制为540p 30fps并添加帧数计数器
+
+        Args:
+            input_file (str): 输入视频文件路径、URL，或配合input_stream使用的 "pipe:0"
             output_file (str, optional): 输出视频文件路径，如果不指定则自动生成
+            input_stream (optional): 写入ffmpeg stdin的数据流
+            progress_callback (callable, optional): 实时进度回调，参见_run_ffmpeg
+            plan (dict, optional): plan_proxy选择的生成方式，不指定则完整转码
 
         Returns:
             str: 输出视频文件路径
         """
         try:
-            if output_file is None:
+            if output_file is None and not os.path.exists(input_file):
+                # 流式输入没有本地目录，输出到临时目录
+                output_file = os.path.join(self.temp_dir, f"{uuid.uuid4()}_proxy.mp4")
+            elif output_file is None:
                 # 生成输出文件路径
                 file_dir = os.path.dirname(input_file)
                 file_name = os.path.splitext(os.path.basename(input_file))[0]
@@ -203,57 +771,42 @@ class VideoProcessor:
             if output_dir and not os.path.exists(output_dir):
                 os.makedirs(output_dir)
 
-            font_path = self.font_path
-
             logger.info(f"开始处理视频: {input_file}")
 
             # 使用subprocess直接调用ffmpeg命令
             # 构建ffmpeg命令
-            cmd = [
-                "ffmpeg",
+            cmd = ["ffmpeg"]
+            if input_file.startswith(("http://", "https://")):
+                # 网络抖动时自动重连
+                cmd += ["-reconnect", "1", "-reconnect_delay_max", "5"]
+            cmd += [
                 "-i",
                 input_file,
                 "-max_muxing_queue_size",
                 "1024",
                 "-bufsize",
                 "3M",
-                "-vf",
-                f"scale=-1:540,fps=fps=30,drawtext=text='%{{frame_num}}':x=10:y=h-th-10:fontfile={font_path}:fontsize=60:fontcolor=yellow:box=1:boxcolor=black@0.5"
-                if add_text
-                else "scale=-1:540,fps=fps=30",
-                "-c:v",
-                "libx264",  # 视频编码使用h264
-                "-preset",
-                "ultrafast",  # 改为最快的预设
-                "-crf",
-                "23",  # 视频质量参数
-                "-c:a",
-                "aac",  # 音频编码使用aac
-                "-b:a",
-                "64k",  # 降低音频比特率
+                *self._proxy_stream_args(add_text, plan),
                 "-y",  # 覆盖输出文件
                 output_file,
             ]
 
-            # 记录完整命令
-            logger.info(f"执行命令: {' '.join(cmd)}")
+            # 记录完整命令（预签名URL包含签名，不写入日志）
+            command_line = " ".join(cmd)
+            if input_file.startswith(("http://", "https://")):
+                command_line = command_line.replace(input_file, "<presigned-url>")
+            logger.info(f"执行命令: {command_line}")
 
             # 执行命令并捕获输出
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
+            returncode, stderr = self._run_ffmpeg(
+                cmd, input_stream=input_stream, progress_callback=progress_callback
             )
 
-            # 获取命令输出
-            stdout, stderr = process.communicate()
-
             # 检查命令是否成功执行
-            if process.returncode != 0:
-                logger.error(f"FFmpeg命令执行失败，错误码: {process.returncode}")
+            if returncode != 0:
+                logger.error(f"FFmpeg命令执行失败，错误码: {returncode}")
                 logger.error(f"错误输出: {stderr}")
-                raise Exception(f"FFmpeg处理失败，错误码: {process.returncode}")
+                raise Exception(f"FFmpeg处理失败，错误码: {returncode}")
 
             logger.info(f"视频处理完成: {output_file}")
             return output_file
@@ -271,58 +824,1690 @@ class VideoProcessor:
                     )
             raise Exception(f"视频处理失败: {str(e)}")
 
-    def process_and_upload_proxy(self, bucket_name, object_key, add_text=True):
+    def upload_frame_index(self, file_path, bucket_name, proxy_key, fmt, metadata=None):
+        """
+        读取本地代理文件的每帧pts和关键帧字节偏移，作为帧索引上传到代理文件旁
+        （proxy/<key>_proxy.fidx），客户端可以据此用一次Range读取定位任意帧
+
+        帧索引不是必需的，生成或上传失败只记录日志。
+
+        Args:
+            file_path (str): 本地代理文件路径
+            proxy_key (str): 代理文件的S3对象键
+            fmt (str): "binary" 或 "json"，参见frame_index模块
+            metadata (dict, optional): 与代理文件相同的用户元数据
+
+        Returns:
+            dict: key、frames、keyframes、bytes、seconds，失败时返回None
+        """
+        start = time.time()
+        if fmt not in FRAME_INDEX_FORMATS:
+            logger.warning(f"不支持的帧索引格式: {fmt}")
+            return None
+        extension, content_type = FRAME_INDEX_FORMATS[fmt]
+        index_key = os.path.splitext(proxy_key)[0] + extension
+        try:
+            index = probe_frame_index(file_path)
+            data = encode_frame_index(index, fmt)
+            self.s3_client.put_object(
+                Bucket=bucket_name,
+                Key=index_key,
+                Body=data,
+                ContentType=content_type,
+                Metadata=metadata or {},
+            )
+        except Exception as e:
+            logger.warning(f"生成帧索引失败: {index_key} {e}")
+            return None
+        logger.info(
+            f"帧索引已上传: {index_key} {len(index['pts'])}帧 "
+            f"{len(index['keyframes'])}个关键帧"
+        )
+        return {
+            "key": index_key,
+            "frames": len(index["pts"]),
+            "keyframes": len(index["keyframes"]),
+            "bytes": len(data),
+            "seconds": round(time.time() - start, 2),
+        }
+
+    def get_keyframe_times(self, input_file):
+        """
+        读取视频流的关键帧时间戳（只解封装，不解码）
+
+        Args:
+            input_file (str): 本地视频文件路径
+
+        Returns:
+            list: 关键帧时间（秒），升序
+        """
+        cmd = [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts_time,flags",
+            "-of",
+            "csv=p=0",
+            input_file,
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise Exception(f"读取关键帧失败: {result.stderr}")
+
+        keyframes = []
+        for line in result.stdout.splitlines():
+            parts = line.split(",")
+            if len(parts) >= 2 and "K" in parts[1] and parts[0] not in ("", "N/A"):
+                keyframes.append(float(parts[0]))
+        return sorted(keyframes)
+
+    def plan_segments(self, duration, segments, keyframes=None):
+        """
+        计算分段边界：按时长均分，吸附到最近的关键帧，再对齐到输出帧网格
+
+        对齐到 1/PROXY_FPS 的整数倍后，每段的起始全局帧号为 round(start * PROXY_FPS)，
+        计数器在拼接后保持连续。
+
+        Returns:
+            list: [(起始时间, 帧数或None)]，最后一段的帧数为None表示编码到结尾
+        """
+        boundaries = [0.0]
+        for i in range(1, segments):
+            target = duration * i / segments
+            if keyframes:
+                target = min(keyframes, key=lambda k: abs(k - target))
+            boundary = round(target * PROXY_FPS) / PROXY_FPS
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+
+        plan = []
+        for i, start in enumerate(boundaries):
+            if i + 1 < len(boundaries):
+                frames = round((boundaries[i + 1] - start) * PROXY_FPS)
+            else:
+                frames = None
+            plan.append((start, frames))
+        return plan
+
+    def create_proxy_chunked(
+        self,
+        input_file,
+        output_file=None,
+        add_text=True,
+        segments=None,
+        progress_callback=None,
+        segment_seconds=None,
+        parallel=None,
+        checkpoint=None,
+        input_url=None,
+    ):
+        """
+        分段并行创建代理文件：按关键帧切分为N段，并行转码后用concat demuxer拼接
+
+        视频各段独立编码（计数器使用每段的全局起始帧号），音频单独编码一次，
+        避免AAC分段拼接产生的间隙。
+
+        Args:
+            input_file (str): 输入视频文件路径或URL（ffmpeg通过Range请求定位）
+            output_file (str, optional): 输出视频文件路径，如果不指定则自动生成
+            segments (int, optional): 分段数，默认读取环境变量PROXY_SEGMENTS，
+                未设置时等于可用CPU核数
+            progress_callback (callable, optional): 实时进度回调，汇总所有分段的进度
+            segment_seconds (float, optional): 按每段时长切分，指定时忽略segments
+            parallel (int, optional): 同时编码的分段数，默认所有分段同时编码；
+                指定时每段使用encode_threads()个线程
+            checkpoint (SegmentCheckpoint, optional): 已完成的分段从检查点恢复，
+                新编码的分段保存到检查点
+            input_url (callable, optional): URL输入时每个ffmpeg启动前调用，返回新的
+                预签名URL，避免编码时间超过URL有效期
+
+        Returns:
+            str: 输出视频文件路径
+        """
+        cpus = available_cpus()
+        segments = segments or int(os.environ.get("PROXY_SEGMENTS", "0")) or cpus
+        min_segment = float(os.environ.get("PROXY_MIN_SEGMENT_SECONDS", "10"))
+
+        metadata = self.get_video_metadata(input_file)
+        duration = metadata["duration"]
+        if segment_seconds:
+            segments = math.ceil(duration / segment_seconds)
+        segments = max(1, min(segments, int(duration // min_segment)))
+        if segments < 2:
+            logger.info("视频较短，使用单进程编码")
+            return self.create_proxy_with_counter(
+                input_file,
+                output_file,
+                add_text=add_text,
+                progress_callback=progress_callback,
+            )
+
+        if output_file is None:
+            output_file = os.path.join(self.temp_dir, f"{uuid.uuid4()}_proxy.mp4")
+
+        # 本地文件才吸附关键帧；URL输入时读取全部packet相当于完整下载
+        keyframes = None
+        if os.path.exists(input_file):
+            keyframes = self.get_keyframe_times(input_file)
+        plan = self.plan_segments(duration, segments, keyframes)
+        workers = min(parallel or len(plan), len(plan))
+        threads = encode_threads() if parallel else max(1, cpus // len(plan))
+
+        # 各分段的已编码时长，汇总成整体进度
+        segment_progress = {}
+        progress_lock = threading.Lock()
+        chunked_start = time.time()
+
+        def report_segment(index, progress):
+            if progress_callback is None:
+                return
+            with progress_lock:
+                segment_progress[index] = progress
+                encoded = sum(p["out_time"] or 0 for p in segment_progress.values())
+                frames = sum(p["frame"] or 0 for p in segment_progress.values())
+            elapsed = time.time() - chunked_start
+            speed = encoded / elapsed if elapsed > 0 else None
+            progress_callback(
+                {
+                    "frame": frames,
+                    "fps": round(frames / elapsed, 2) if elapsed > 0 else None,
+                    "speed": round(speed, 2) if speed else None,
+                    "out_time": round(encoded, 2),
+                    "elapsed": round(elapsed, 2),
+                    "percent": round(min(100.0, encoded / duration * 100), 1),
+                    "eta": round((duration - encoded) / speed, 1) if speed else None,
+                    "slow": speed is not None and speed < 1,
+                    "done": False,
+                    "segments": len(plan),
+                }
+            )
+
+        work_dir = tempfile.mkdtemp(prefix="segments_", dir=self.temp_dir)
+        try:
+            logger.info(
+                f"开始分段编码: {len(plan)}段，同时{workers}段，每段{threads}线程"
+            )
+
+            def encode_segment(index):
+                start, frames = plan[index]
+                segment_file = os.path.join(work_dir, f"segment_{index:04d}.mp4")
+                # 检查点名称包含起始帧和帧数，分段边界变化时不会误用
+                name = f"segment_{round(start * PROXY_FPS)}_{frames or 'end'}.mp4"
+                if checkpoint is not None and checkpoint.restore(name, segment_file):
+                    encoded = frames / PROXY_FPS if frames else duration - start
+                    report_segment(
+                        index, {"out_time": encoded, "frame": frames or 0}
+                    )
+                    return segment_file
+                cmd = ["ffmpeg", "-ss", f"{start:.6f}"]
+                if frames is not None:
+                    # 多读一秒，保证fps滤镜能输出足够的帧
+                    cmd += ["-t", f"{frames / PROXY_FPS + 1:.6f}"]
+                cmd += [
+                    "-i",
+                    input_url() if input_url else input_file,
+                    "-an",
+                    "-vf",
+                    self._proxy_video_filter(
+                        add_text, start_number=round(start * PROXY_FPS)
+                    ),
+                    *self._proxy_video_codec_args(threads=threads),
+                ]
+                if frames is not None:
+                    cmd += ["-frames:v", str(frames)]
+                cmd += ["-y", segment_file]
+                returncode, stderr = self._run_ffmpeg(
+                    cmd,
+                    progress_callback=(lambda p: report_segment(index, p))
+                    if progress_callback
+                    else None,
+                )
+                if returncode != 0:
+                    logger.error(f"分段{index}编码失败: {stderr}")
+                    raise Exception(f"分段{index}编码失败，错误码: {returncode}")
+                if checkpoint is not None:
+                    checkpoint.save(name, segment_file)
+                return segment_file
+
+            def encode_audio():
+                audio_file = os.path.join(work_dir, "audio.m4a")
+                if checkpoint is not None and checkpoint.restore("audio.m4a", audio_file):
+                    return audio_file
+                cmd = [
+                    "ffmpeg",
+                    "-i",
+                    input_url() if input_url else input_file,
+                    "-vn",
+                    "-c:a",
+                    "aac",
+                    "-b:a",
+                    "64k",
+                    "-y",
+                    audio_file,
+                ]
+                returncode, stderr = self._run_ffmpeg(cmd)
+                if returncode != 0:
+                    logger.error(f"音频编码失败: {stderr}")
+                    raise Exception(f"音频编码失败，错误码: {returncode}")
+                if checkpoint is not None:
+                    checkpoint.save("audio.m4a", audio_file)
+                return audio_file
+
+            # ffmpeg本身是独立进程，用线程池调度即可让各段在不同核上并行
+            with ThreadPoolExecutor(max_workers=workers + 1) as pool:
+                audio_future = pool.submit(encode_audio) if "audio" in metadata else None
+                segment_files = list(pool.map(encode_segment, range(len(plan))))
+                audio_file = audio_future.result() if audio_future else None
+
+            list_file = os.path.join(work_dir, "segments.txt")
+            with open(list_file, "w") as f:
+                for segment_file in segment_files:
+                    f.write(f"file '{segment_file}'\n")
+
+            cmd = ["ffmpeg", "-f", "concat", "-safe", "0", "-i", list_file]
+            if audio_file:
+                cmd += ["-i", audio_file, "-map", "0:v", "-map", "1:a"]
+            cmd += ["-c", "copy", "-movflags", "+faststart", "-y", output_file]
+            returncode, stderr = self._run_ffmpeg(cmd)
+            if returncode != 0:
+                logger.error(f"分段拼接失败: {stderr}")
+                raise Exception(f"分段拼接失败，错误码: {returncode}")
+
+            logger.info(f"分段编码完成: {output_file}")
+            return output_file
+        except Exception:
+            if os.path.exists(output_file):
+                self.cleanup_temp_file(output_file)
+            raise
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _normalize_rendition(self, rendition, add_text):
+        """
+        补全输出规格的默认值
+
+        规格字段：
+            name: 名称，决定上传的文件名
+            type: "video"、"thumbnail"（单帧海报图）或 "sprite"（缩略图拼图）
+            video: height、fps、counter（默认跟随add_text）、codec、preset、crf、
+                audio、audio_bitrate
+            thumbnail: time（秒）、height、format
+            sprite: interval（秒）、height、columns、rows、format
+        """
+        spec = dict(rendition)
+        spec.setdefault("type", "video")
+        if spec["type"] == "video":
+            spec.setdefault("name", f"{spec.get('height', PROXY_HEIGHT)}p")
+            spec.setdefault("height", PROXY_HEIGHT)
+            spec.setdefault("fps", PROXY_FPS)
+            spec.setdefault("codec", "libx264")
+            spec.setdefault("preset", "ultrafast")
+            spec.setdefault("crf", 23)
+            spec.setdefault("audio", True)
+            spec.setdefault("audio_bitrate", "64k")
+            if spec.get("counter") is None:
+                spec["counter"] = add_text
+            spec["extension"] = "mp4"
+        elif spec["type"] == "thumbnail":
+            spec.setdefault("name", "poster")
+            spec.setdefault("time", 0)
+            spec.setdefault("height", PROXY_HEIGHT)
+            spec.setdefault("format", "jpg")
+            spec["extension"] = spec["format"]
+        elif spec["type"] == "sprite":
+            spec.setdefault("name", "sprite")
+            spec.setdefault("interval", 10)
+            spec.setdefault("height", 90)
+            spec.setdefault("columns", 10)
+            spec.setdefault("rows", 10)
+            spec.setdefault("format", "jpg")
+            spec["extension"] = spec["format"]
+        else:
+            raise Exception(f"不支持的输出类型: {spec['type']}")
+        return spec
+
+    def create_renditions(
+        self,
+        input_file,
+        renditions,
+        output_dir=None,
+        add_text=True,
+        input_stream=None,
+        progress_callback=None,
+    ):
+        """
+        一次解码生成多个输出：用split滤镜把解码后的画面分发给各个输出
+
+        Args:
+            input_file (str): 输入视频文件路径、URL，或配合input_stream使用的 "pipe:0"
+            renditions (list): 输出规格列表，参见_normalize_rendition
+            output_dir (str, optional): 输出目录，不指定则在临时目录下新建
+            input_stream (optional): 写入ffmpeg stdin的数据流
+            progress_callback (callable, optional): 实时进度回调，参见_run_ffmpeg
+
+        Returns:
+            list: 每个输出的规格及生成的文件列表（spec["files"]）
+        """
+        specs = [self._normalize_rendition(r, add_text) for r in renditions]
+        names = [spec["name"] for spec in specs]
+        if len(set(names)) != len(names):
+            raise Exception(f"输出名称重复: {names}")
+
+        output_dir = output_dir or tempfile.mkdtemp(prefix="renditions_", dir=self.temp_dir)
+        os.makedirs(output_dir, exist_ok=True)
+
+        # 构建滤镜图：[0:v]split=N[s0][s1]...; [s0]...[o0]; ...
+        labels = [f"s{i}" for i in range(len(specs))]
+        graph = [f"[0:v]split={len(specs)}" + "".join(f"[{l}]" for l in labels)]
+        for i, spec in enumerate(specs):
+            if spec["type"] == "video":
+                chain = self._proxy_video_filter(
+                    spec["counter"], height=spec["height"], fps=spec["fps"]
+                )
+            elif spec["type"] == "thumbnail":
+                chain = f"trim=start={spec['time']},scale=-2:{spec['height']}"
+            else:
+                chain = (
+                    f"fps=fps=1/{spec['interval']},scale=-2:{spec['height']},"
+                    f"tile={spec['columns']}x{spec['rows']}"
+                )
+            graph.append(f"[{labels[i]}]{chain}[o{i}]")
+
+        cmd = ["ffmpeg"]
+        if input_file.startswith(("http://", "https://")):
+            cmd += ["-reconnect", "1", "-reconnect_delay_max", "5"]
+        cmd += ["-i", input_file, "-filter_complex", ";".join(graph)]
+
+        # 各视频输出的编码器平分本任务的线程数
+        videos = sum(1 for spec in specs if spec["type"] == "video")
+        threads = max(1, encode_threads() // max(1, videos))
+        for i, spec in enumerate(specs):
+            cmd += ["-map", f"[o{i}]"]
+            if spec["type"] == "video":
+                output_file = os.path.join(output_dir, f"{spec['name']}.mp4")
+                cmd += self._proxy_video_codec_args(
+                    spec["codec"], spec["preset"], spec["crf"], threads=threads
+                )
+                if spec["audio"]:
+                    cmd += ["-map", "0:a?", "-c:a", "aac", "-b:a", spec["audio_bitrate"]]
+                cmd += ["-max_muxing_queue_size", "1024", output_file]
+                spec["files"] = [output_file]
+            elif spec["type"] == "thumbnail":
+                output_file = os.path.join(output_dir, f"{spec['name']}.{spec['extension']}")
+                cmd += ["-frames:v", "1", output_file]
+                spec["files"] = [output_file]
+            else:
+                # 一张拼图放不下时按序号输出多张
+                pattern = os.path.join(output_dir, f"{spec['name']}_%03d.{spec['extension']}")
+                cmd += [pattern]
+                spec["files"] = pattern
+        cmd.insert(1, "-y")
+
+        command_line = " ".join(cmd)
+        if input_file.startswith(("http://", "https://")):
+            command_line = command_line.replace(input_file, "<presigned-url>")
+        logger.info(f"执行命令: {command_line}")
+
+        returncode, stderr = self._run_ffmpeg(
+            cmd, input_stream=input_stream, progress_callback=progress_callback
+        )
+        if returncode != 0:
+            logger.error(f"FFmpeg命令执行失败，错误码: {returncode}")
+            logger.error(f"错误输出: {stderr}")
+            shutil.rmtree(output_dir, ignore_errors=True)
+            raise Exception(f"多输出处理失败，错误码: {returncode}")
+
+        for spec in specs:
+            if isinstance(spec["files"], str):
+                prefix = f"{spec['name']}_"
+                spec["files"] = sorted(
+                    os.path.join(output_dir, name)
+                    for name in os.listdir(output_dir)
+                    if name.startswith(prefix)
+                )
+        return specs
+
+    def create_and_stream_proxy(
+        self,
+        input_file,
+        bucket_name,
+        proxy_key,
+        add_text=True,
+        input_stream=None,
+        progress_callback=None,
+        metadata=None,
+        plan=None,
+    ):
+        """
+        编码代理文件并在编码过程中以S3分片上传写入，不在本地落盘
+
+        ffmpeg输出分片MP4（fragmented MP4）到stdout，每满一个分片就上传，
+        编码结束时只剩最后一片和complete_multipart_upload。
+
+        Args:
+            input_file (str): 输入视频文件路径、URL，或配合input_stream使用的 "pipe:0"
+            bucket_name (str): S3存储桶名称
+            proxy_key (str): 代理文件的S3对象键
+            input_stream (optional): 写入ffmpeg stdin的数据流
+            progress_callback (callable, optional): 实时进度回调，参见_run_ffmpeg
+            metadata (dict, optional): 代理文件的S3用户元数据
+            plan (dict, optional): plan_proxy选择的生成方式，不指定则完整转码
+
+        Returns:
+            dict: 编码耗时、收尾上传耗时和上传字节数
+        """
+        cmd = ["ffmpeg"]
+        if input_file.startswith(("http://", "https://")):
+            cmd += ["-reconnect", "1", "-reconnect_delay_max", "5"]
+        cmd += [
+            "-i",
+            input_file,
+            "-max_muxing_queue_size",
+            "1024",
+            *self._proxy_stream_args(add_text, plan),
+            # 输出到管道的MP4必须是分片格式，moov放在开头且不需要回写
+            "-movflags",
+            "frag_keyframe+empty_moov+default_base_moof",
+            "-f",
+            "mp4",
+            "pipe:1",
+        ]
+        logger.info(f"开始流式编码并上传: {bucket_name}/{proxy_key}")
+
+        upload = StreamingMultipartUpload(
+            self.s3_client, bucket_name, proxy_key, metadata=metadata
+        )
+        try:
+            encode_start = time.time()
+            returncode, stderr = self._run_ffmpeg(
+                cmd,
+                input_stream=input_stream,
+                output_handler=upload.write,
+                progress_callback=progress_callback,
+            )
+            encode_time = time.time() - encode_start
+            if returncode != 0:
+                logger.error(f"FFmpeg命令执行失败，错误码: {returncode}")
+                logger.error(f"错误输出: {stderr}")
+                raise Exception(f"FFmpeg处理失败，错误码: {returncode}")
+        except Exception:
+            upload.abort()
+            raise
+
+        finish_start = time.time()
+        size = upload.complete()
+        return {
+            "encode": encode_time,
+            "upload": time.time() - finish_start,
+            "bytes": size,
+        }
+
+    def hls_segment_seconds(self):
+        """
+        HLS分段时长（秒），读取环境变量PROXY_HLS_SEGMENT_SECONDS，默认4
+        """
+        return float(os.environ.get("PROXY_HLS_SEGMENT_SECONDS", "4"))
+
+    def create_and_upload_hls(
+        self,
+        input_file,
+        bucket_name,
+        playlist_key,
+        add_text=True,
+        input_stream=None,
+        progress_callback=None,
+        metadata=None,
+        plan=None,
+    ):
+        """
+        编码为HLS（fMP4/CMAF分段），每个分段完成后立即由线程池并发上传，
+        全部分段上传完成后最后上传播放列表
+
+        关键帧间隔固定为分段时长，分段严格按GOP对齐；ffmpeg以temp_file方式写分段，
+        出现最终文件名即表示该分段已完整写入。已上传的分段立即删除，本地只保留
+        尚未上传的分段。
+
+        Args:
+            input_file (str): 输入视频文件路径、URL，或配合input_stream使用的 "pipe:0"
+            playlist_key (str): 播放列表的S3对象键，分段上传到同一前缀下
+            input_stream (optional): 写入ffmpeg stdin的数据流
+            progress_callback (callable, optional): 实时进度回调，参见_run_ffmpeg
+            metadata (dict, optional): 播放列表的S3用户元数据
+            plan (dict, optional): plan_proxy选择的生成方式（视频流必须重新编码）
+
+        Returns:
+            dict: 上传的对象键（播放列表在前）、分段数、编码耗时、收尾上传耗时和字节数
+        """
+        segment_seconds = self.hls_segment_seconds()
+        gop = max(1, round(PROXY_FPS * segment_seconds))
+        prefix = playlist_key.rsplit("/", 1)[0]
+        work_dir = tempfile.mkdtemp(prefix="hls_", dir=self.temp_dir)
+        playlist_file = os.path.join(work_dir, "index.m3u8")
+
+        cmd = ["ffmpeg"]
+        if input_file.startswith(("http://", "https://")):
+            cmd += ["-reconnect", "1", "-reconnect_delay_max", "5"]
+        cmd += [
+            "-i",
+            input_file,
+            "-max_muxing_queue_size",
+            "1024",
+            *self._proxy_stream_args(add_text, plan),
+            # 固定GOP并关闭场景切换插入关键帧，每个分段恰好从关键帧开始
+            "-g",
+            str(gop),
+            "-keyint_min",
+            str(gop),
+            "-sc_threshold",
+            "0",
+            "-force_key_frames",
+            f"expr:gte(t,n_forced*{segment_seconds})",
+            "-f",
+            "hls",
+            "-hls_time",
+            str(segment_seconds),
+            "-hls_playlist_type",
+            "vod",
+            "-hls_segment_type",
+            "fmp4",
+            "-hls_fmp4_init_filename",
+            "init.mp4",
+            "-hls_flags",
+            "independent_segments+temp_file",
+            "-hls_segment_filename",
+            os.path.join(work_dir, "seg_%05d.m4s"),
+            "-y",
+            playlist_file,
+        ]
+        logger.info(f"开始HLS编码并上传: {bucket_name}/{playlist_key}")
+
+        pool = ThreadPoolExecutor(
+            max_workers=int(os.environ.get("HLS_UPLOAD_CONCURRENCY", "4")),
+            thread_name_prefix="hls-upload",
+        )
+        submitted = {}
+
+        def upload(name):
+            path = os.path.join(work_dir, name)
+            stats = transfer.upload_file(
+                self.s3_client,
+                path,
+                bucket_name,
+                f"{prefix}/{name}",
+                extra_args={"ContentType": HLS_CONTENT_TYPES[os.path.splitext(name)[1]]},
+            )
+            self.cleanup_temp_file(path)
+            return stats
+
+        def submit_finished(final=False):
+            # 只有改名后的最终文件（不含.tmp）才是完整的分段；
+            # init.mp4在第一个分段完成前已写完
+            names = sorted(os.listdir(work_dir))
+            segment_ready = final or any(name.endswith(".m4s") for name in names)
+            for name in names:
+                if name in submitted:
+                    continue
+                if name.endswith(".m4s") or (name == "init.mp4" and segment_ready):
+                    submitted[name] = pool.submit(upload, name)
+
+        encoding_done = threading.Event()
+
+        def watch():
+            while not encoding_done.wait(0.2):
+                submit_finished()
+
+        watcher = threading.Thread(target=watch, name="hls-watch", daemon=True)
+        try:
+            encode_start = time.time()
+            watcher.start()
+            try:
+                returncode, stderr = self._run_ffmpeg(
+                    cmd, input_stream=input_stream, progress_callback=progress_callback
+                )
+            finally:
+                encoding_done.set()
+                watcher.join()
+            encode_time = time.time() - encode_start
+            if returncode != 0:
+                logger.error(f"FFmpeg命令执行失败，错误码: {returncode}")
+                logger.error(f"错误输出: {stderr}")
+                raise Exception(f"HLS编码失败，错误码: {returncode}")
+
+            finish_start = time.time()
+            submit_finished(final=True)
+            size = sum(future.result()["bytes"] for future in submitted.values())
+
+            # 所有分段就绪后才上传播放列表，播放器不会看到缺失的分段
+            playlist_stats = transfer.upload_file(
+                self.s3_client,
+                playlist_file,
+                bucket_name,
+                playlist_key,
+                extra_args={
+                    "ContentType": HLS_CONTENT_TYPES[".m3u8"],
+                    "Metadata": metadata or {},
+                },
+            )
+            segment_keys = [f"{prefix}/{name}" for name in sorted(submitted)]
+            return {
+                "keys": [playlist_key] + segment_keys,
+                "segments": sum(1 for name in submitted if name.endswith(".m4s")),
+                "segment_seconds": segment_seconds,
+                "encode": encode_time,
+                "upload": time.time() - finish_start,
+                "bytes": size + playlist_stats["bytes"],
+            }
+        except Exception:
+            # 等待进行中的上传结束，删除已上传的分段和init.mp4，不留下没有播放列表的分段
+            uploaded = []
+            for name, future in submitted.items():
+                try:
+                    future.result()
+                    uploaded.append(f"{prefix}/{name}")
+                except Exception:
+                    pass
+            if uploaded:
+                logger.info(f"HLS生成失败，删除已上传的{len(uploaded)}个分段: {prefix}/")
+                self._delete_keys(bucket_name, uploaded)
+            raise
+        finally:
+            pool.shutdown(wait=True)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def proxy_params(self, add_text, renditions=None, output_mode=None):
+        """
+        计算编码参数签名，参数相同且源文件ETag未变时可以复用已有代理文件
+
+        Returns:
+            str: 参数签名（sha1前16位）
+        """
+        params = {
+            "add_text": bool(add_text),
+            "height": PROXY_HEIGHT,
+            "fps": PROXY_FPS,
+            "crf": 23,
+            "renditions": [self._normalize_rendition(r, add_text) for r in renditions]
+            if renditions
+            else None,
+        }
+        if output_mode == "hls":
+            # 只在HLS输出时加入，已有MP4代理文件的签名保持不变
+            params["hls_segment_seconds"] = self.hls_segment_seconds()
+        serialized = json.dumps(params, sort_keys=True)
+        return hashlib.sha1(serialized.encode()).hexdigest()[:16]
+
+    def primary_proxy_key(self, object_key, renditions=None, output_mode=None):
+        """
+        主代理文件的S3对象键：默认输出为 proxy/<key>_proxy.mp4，
+        HLS输出为 proxy/<key>_hls/index.m3u8，
+        多输出时为第一个视频输出（没有视频输出时为第一个输出）
+        """
+        base_key = f"proxy/{os.path.splitext(object_key)[0]}"
+        if not renditions and output_mode == "hls":
+            return f"{base_key}_hls/index.m3u8"
+        if not renditions:
+            return f"{base_key}_proxy.mp4"
+        specs = [self._normalize_rendition(r, True) for r in renditions]
+        spec = next((s for s in specs if s["type"] == "video"), specs[0])
+        if spec["type"] == "sprite":
+            return f"{base_key}_{spec['name']}_001.{spec['extension']}"
+        return f"{base_key}_{spec['name']}.{spec['extension']}"
+
+    def find_existing_proxy(self, bucket_name, proxy_key, source_etag, params):
         """
-        下载视频，创建代理文件（540p 30fps带帧数计数器），并上传到S3
+        检查已有的代理文件是否由同一源文件（ETag）和相同参数生成
+
+        Returns:
+            bool: 可以直接复用时返回True
+        """
+        try:
+            head = self.s3_client.head_object(Bucket=bucket_name, Key=proxy_key)
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code in MISSING_KEY_CODES:
+                return False
+            if code in ACCESS_DENIED_CODES:
+                # 没有s3:ListBucket权限时不存在的键也返回403
+                logger.warning(f"检查已有代理文件被拒绝，按不存在处理: {bucket_name}/{proxy_key}")
+                return False
+            raise
+        metadata = head.get("Metadata", {})
+        return (
+            metadata.get("source-etag") == source_etag
+            and metadata.get("proxy-params") == params
+        )
+
+    def process_and_upload_proxy(
+        self,
+        bucket_name,
+        object_key,
+        add_text=True,
+        input_mode=None,
+        encode_mode=None,
+        renditions=None,
+        output_mode=None,
+        progress_callback=None,
+        force=False,
+    ):
+        """
+        读取视频，创建代理文件（540p 30fps带帧数计数器），并上传到S3
 
         Args:
             bucket_name (str): S3存储桶名称
             object_key (str): S3对象键（路径）
+            input_mode (str, optional): 源视频读取方式，参见resolve_input
+            encode_mode (str, optional): "single"（单个ffmpeg进程）或 "chunked"
+                （分段并行编码），默认读取环境变量PROXY_ENCODE_MODE，未设置时为 "single"
+            renditions (list, optional): 输出规格列表，一次解码生成全部输出，
+                上传为 proxy/<key>_<name>.<ext>，参见_normalize_rendition
+            output_mode (str, optional): "file"（编码到本地再上传）、"stream"
+                （编码同时分片上传）或 "hls"（fMP4分段和播放列表，分段完成即上传），
+                默认读取环境变量PROXY_OUTPUT_MODE，未设置时为 "file"
+            progress_callback (callable, optional): 编码实时进度回调
+            force (bool): 为True时即使已有最新的代理文件也重新编码
 
         Returns:
             dict: 包含原始视频和代理视频信息的字典
         """
         start_time = time.time()
+        self._set_stage("head")
+
+        output_mode = output_mode or os.environ.get("PROXY_OUTPUT_MODE", "file")
+        if renditions and output_mode != "file":
+            # 多输出需要本地文件
+            logger.info("多输出模式不支持流式或HLS输出，使用本地文件")
+            output_mode = "file"
+
+        # 代理文件的元数据记录源文件ETag和编码参数，重试和重复请求直接返回
+        head = self.s3_client.head_object(
+            Bucket=bucket_name, Key=object_key, ChecksumMode="ENABLED"
+        )
+        source_etag = head["ETag"]
+        params = self.proxy_params(add_text, renditions, output_mode)
+        upload_metadata = {"source-etag": source_etag, "proxy-params": params}
+        primary_key = self.primary_proxy_key(object_key, renditions, output_mode)
+        if not force and self.find_existing_proxy(
+            bucket_name, primary_key, source_etag, params
+        ):
+            logger.info(f"代理文件已是最新，跳过编码: {bucket_name}/{primary_key}")
+            return {
+                "original": {"bucket": bucket_name, "key": object_key},
+                "proxy": {"bucket": bucket_name, "key": primary_key},
+                "skipped": True,
+                "processing_times": {"total": round(time.time() - start_time, 2)},
+            }
+
+        # 相同内容已经在其他对象键下生成过代理文件时，服务端复制代替转码
+        digest = self.content_digest(head) if self.content_index else None
+        if digest:
+            upload_metadata["content-digest"] = digest
+            if not force:
+                result = self.reuse_proxy_by_digest(
+                    bucket_name, object_key, digest, params, upload_metadata, start_time
+                )
+                if result:
+                    return result
+
+        result = self._encode_and_upload_proxy(
+            bucket_name,
+            object_key,
+            add_text,
+            input_mode,
+            encode_mode,
+            renditions,
+            output_mode,
+            progress_callback,
+            upload_metadata,
+            force,
+            start_time,
+        )
+
+        digest = upload_metadata.get("content-digest")
+        if self.content_index and digest and not result.get("deduplicated"):
+            if result.get("renditions"):
+                proxy_keys = [k for r in result["renditions"] for k in r["keys"]]
+            elif result.get("hls"):
+                proxy_keys = result["hls"]["keys"]
+            else:
+                proxy_keys = [result["proxy"]["key"]]
+                if result.get("frame_index"):
+                    proxy_keys.append(result["frame_index"]["key"])
+            self.content_index.put(
+                digest,
+                params,
+                bucket_name,
+                f"proxy/{os.path.splitext(object_key)[0]}",
+                proxy_keys,
+            )
+        return result
+
+    def content_digest(self, head):
+        """
+        从head_object结果中取得无需读取内容的摘要
+
+        优先使用S3保存的完整SHA256校验和；否则使用ETag（单次上传时即内容MD5，
+        分片上传时为各分片MD5的摘要，相同文件以相同分片大小上传时一致）。
+        KMS/SSE-C加密对象的ETag不是内容摘要，返回None。
+
+        Returns:
+            str: 带算法前缀的摘要，无法取得时返回None
+        """
+        checksum = head.get("ChecksumSHA256")
+        if checksum and "-" not in checksum:
+            return f"sha256:{checksum}"
+        if head.get("ServerSideEncryption") == "aws:kms" or head.get(
+            "SSECustomerAlgorithm"
+        ):
+            return None
+        etag = head["ETag"].strip('"')
+        return f"md5:{etag}" if "-" not in etag else f"s3etag:{etag}"
+
+    def file_digest(self, file_path):
+        """
+        计算本地文件的SHA256摘要
+        """
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(8 * 1024 * 1024), b""):
+                sha256.update(chunk)
+        return f"sha256-file:{sha256.hexdigest()}"
+
+    def reuse_proxy_by_digest(
+        self, bucket_name, object_key, digest, params, upload_metadata, start_time
+    ):
+        """
+        按内容摘要查找已有代理文件，找到时服务端复制到当前对象的代理路径
+
+        Returns:
+            dict: 处理结果，索引中没有可用的代理文件时返回None
+        """
+        entry = self.content_index.get(digest, params)
+        if entry is None:
+            return None
+
+        base_key = f"proxy/{os.path.splitext(object_key)[0]}"
+        targets = [
+            (source_key, base_key + source_key[len(entry["base_key"]) :])
+            for source_key in entry["proxy_keys"]
+        ]
+        # HLS的proxy_keys为 [播放列表] + 分片：先复制分片，播放列表最后复制，
+        # 播放列表可见时引用的分片都已存在（主播放列表在最前面，因此倒序复制播放列表）
+        order = [t for t in targets if not t[1].endswith(".m3u8")]
+        order += [t for t in reversed(targets) if t[1].endswith(".m3u8")]
+        copied = []
+        try:
+            for source_key, target_key in order:
+                content_type = mimetypes.guess_type(target_key)[0]
+                extra_args = {"Metadata": upload_metadata, "MetadataDirective": "REPLACE"}
+                if content_type:
+                    extra_args["ContentType"] = content_type
+                # 托管复制在超过5GB时自动使用分片复制
+                self.s3_client.copy(
+                    {"Bucket": entry["bucket"], "Key": source_key},
+                    bucket_name,
+                    target_key,
+                    ExtraArgs=extra_args,
+                )
+                copied.append(target_key)
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code in MISSING_KEY_CODES:
+                logger.info(f"索引中的代理文件已不存在，重新转码: {entry['proxy_keys']}")
+            elif code in ACCESS_DENIED_CODES:
+                # 没有s3:ListBucket权限时不存在的键也返回403
+                logger.warning(f"复制索引中的代理文件被拒绝，重新转码: {entry['proxy_keys']}")
+            else:
+                raise
+            self._delete_keys(bucket_name, copied)
+            self.content_index.remove(digest, params)
+            return None
+
+        copied = [target_key for _, target_key in targets]
+        logger.info(f"内容重复，已复制代理文件: {entry['proxy_keys'][0]} -> {copied[0]}")
+        return {
+            "original": {"bucket": bucket_name, "key": object_key},
+            "proxy": {"bucket": bucket_name, "key": copied[0]},
+            "deduplicated": {
+                "digest": digest,
+                "from": {"bucket": entry["bucket"], "key": entry["proxy_keys"][0]},
+                "keys": copied,
+            },
+            "processing_times": {"total": round(time.time() - start_time, 2)},
+        }
+
+    def _delete_keys(self, bucket_name, keys):
+        # 删除复制了一半的代理文件（delete_objects每次最多1000个键）
+        for i in range(0, len(keys), 1000):
+            objects = [{"Key": key} for key in keys[i : i + 1000]]
+            try:
+                self.s3_client.delete_objects(
+                    Bucket=bucket_name, Delete={"Objects": objects}
+                )
+            except Exception as e:
+                logger.warning(f"删除部分复制的代理文件失败: {e}")
+
+    def _encode_and_upload_proxy(
+        self,
+        bucket_name,
+        object_key,
+        add_text,
+        input_mode,
+        encode_mode,
+        renditions,
+        output_mode,
+        progress_callback,
+        upload_metadata,
+        force,
+        start_time,
+    ):
+        """
+        读取源视频、编码并上传代理文件（process_and_upload_proxy的实际处理部分）
+        """
         temp_input_file = None
         temp_output_file = None
+        reservations = ExitStack()
         try:
-            # 下载原始视频
+            # 准备输入：流式模式下这里只生成URL或打开流，file模式才完整下载
+            self._set_stage("download")
             download_start = time.time()
-            temp_input_file = self.download_video(bucket_name, object_key)
+            download_stats = {}
+            input_mode, input_source, input_stream = self.resolve_input(
+                bucket_name, object_key, input_mode, stats=download_stats
+            )
+            if input_mode == "file":
+                temp_input_file = input_source
             download_time = time.time() - download_start
 
+            # 无法从S3取得摘要时，在本地文件上计算，仍可在转码前去重
+            if (
+                self.content_index
+                and temp_input_file
+                and "content-digest" not in upload_metadata
+            ):
+                upload_metadata["content-digest"] = self.file_digest(temp_input_file)
+                if not force:
+                    result = self.reuse_proxy_by_digest(
+                        bucket_name,
+                        object_key,
+                        upload_metadata["content-digest"],
+                        upload_metadata["proxy-params"],
+                        upload_metadata,
+                        start_time,
+                    )
+                    if result:
+                        return result
+
             # 创建代理文件
-            process_start = time.time()
-            temp_output_file = self.create_proxy_with_counter(
-                temp_input_file, add_text=add_text
-            )
-            process_time = time.time() - process_start
+            encode_mode = encode_mode or os.environ.get("PROXY_ENCODE_MODE", "single")
+            if encode_mode == "chunked" and input_stream is not None:
+                # 管道输入无法按段定位
+                logger.info("管道输入不支持分段编码，使用单进程编码")
+                encode_mode = "single"
+            if encode_mode == "chunked" and renditions:
+                # 多输出依赖单次解码，不与分段编码组合
+                logger.info("多输出模式使用单次解码，不进行分段编码")
+                encode_mode = "single"
+            output_mode = output_mode or os.environ.get("PROXY_OUTPUT_MODE", "file")
+            if output_mode == "stream" and (renditions or encode_mode == "chunked"):
+                # 多输出和分段编码都需要本地文件
+                logger.info("多输出或分段编码模式不支持流式上传，使用本地文件")
+                output_mode = "file"
+            if output_mode == "hls" and encode_mode == "chunked":
+                # HLS分段由单个ffmpeg按固定时长切分
+                logger.info("HLS输出使用单进程编码")
+                encode_mode = "single"
 
             # 构建代理文件的S3路径
             proxy_key = f"proxy/{os.path.splitext(object_key)[0]}_proxy.mp4"
 
+            # 根据源视频选择直接复制或转码（多输出模式总是解码）
+            plan = None
+            if not renditions and os.environ.get("PROXY_PASSTHROUGH", "auto") == "auto":
+                self._set_stage("probe")
+                try:
+                    plan = self.plan_proxy(
+                        self.source_metadata(
+                            bucket_name,
+                            object_key,
+                            upload_metadata["source-etag"],
+                            input_mode,
+                            input_source,
+                        ),
+                        add_text,
+                    )
+                except Exception as e:
+                    logger.warning(f"无法判断能否直接复制，完整转码: {e}")
+                if plan is not None and plan["video"] == "copy" and output_mode == "hls":
+                    # 复制的视频流只能在源关键帧处切分，HLS需要固定时长的分段
+                    plan = {
+                        "video": "encode",
+                        "audio": plan["audio"],
+                        "path": "audio-copy" if plan["audio"] == "copy" else "transcode",
+                    }
+                if plan is not None and plan["video"] == "copy":
+                    # 视频流直接复制，没有需要并行的编码
+                    encode_mode = "single"
+                elif encode_mode == "chunked":
+                    # 分段编码的音视频都重新编码
+                    plan = None
+                if plan is not None:
+                    logger.info(f"代理文件生成方式: {plan['path']} {object_key}")
+
+            # 长视频按段编码并把完成的分段保存到S3，失败重试时只重新编码缺失的分段
+            # （默认不启用，设置PROXY_CHECKPOINT_SECONDS后生效）
+            checkpoint = None
+            checkpoint_seconds = float(os.environ.get("PROXY_CHECKPOINT_SECONDS", "0"))
+            if (
+                checkpoint_seconds > 0
+                and output_mode == "file"
+                and not renditions
+                and input_stream is None
+                and not (plan is not None and plan["video"] == "copy")
+            ):
+                if encode_mode == "single":
+                    try:
+                        duration = self.source_metadata(
+                            bucket_name,
+                            object_key,
+                            upload_metadata["source-etag"],
+                            input_mode,
+                            input_source,
+                        )["duration"]
+                    except Exception as e:
+                        logger.warning(f"无法获取时长，不使用检查点: {e}")
+                        duration = 0
+                    if duration >= 2 * checkpoint_seconds:
+                        encode_mode = "checkpoint"
+                        # 分段编码的音视频都重新编码
+                        plan = None
+                        if input_mode == "url":
+                            # 逐段编码的总时长可能超过预签名URL的有效期，各段和音频
+                            # 改为读取临时空间中的源文件（同一进程重试时直接命中缓存）
+                            self._set_stage("download")
+                            acquire_start = time.time()
+                            temp_input_file = self.acquire_source(
+                                bucket_name, object_key, download_stats
+                            )
+                            input_mode, input_source = "file", temp_input_file
+                            download_time += time.time() - acquire_start
+                if encode_mode in ("chunked", "checkpoint"):
+                    checkpoint = SegmentCheckpoint.for_source(
+                        self.s3_client,
+                        bucket_name,
+                        object_key,
+                        upload_metadata["source-etag"],
+                        upload_metadata["proxy-params"],
+                    )
+            encode_path = plan["path"] if plan else "transcode"
+
+            if self.scratch is not None and output_mode != "stream":
+                # 输出大小编码前未知，按配置的估计值预留，空间不足时在这里排队
+                reservations.enter_context(
+                    self.scratch.reservation(
+                        int(os.environ.get("SCRATCH_OUTPUT_RESERVE_BYTES", "268435456"))
+                    )
+                )
+
+            self._set_stage("encode")
+            process_start = time.time()
+            if output_mode == "hls":
+                hls_result = self.create_and_upload_hls(
+                    input_source,
+                    bucket_name,
+                    self.primary_proxy_key(object_key, output_mode="hls"),
+                    add_text=add_text,
+                    input_stream=input_stream,
+                    progress_callback=progress_callback,
+                    metadata=upload_metadata,
+                    plan=plan,
+                )
+                return {
+                    "original": {"bucket": bucket_name, "key": object_key},
+                    "proxy": {"bucket": bucket_name, "key": hls_result["keys"][0]},
+                    "hls": hls_result,
+                    "input_mode": input_mode,
+                    "encode_mode": encode_mode,
+                    "encode_path": encode_path,
+                    "output_mode": output_mode,
+                    "processing_times": {
+                        "download": round(download_time, 2),
+                        "process": round(hls_result["encode"], 2),
+                        "upload": round(hls_result["upload"], 2),
+                        "total": round(time.time() - start_time, 2),
+                        "download_mbps": download_stats.get("mbps"),
+                        "download_bytes": download_stats.get("bytes"),
+                        "upload_bytes": hls_result["bytes"],
+                    },
+                }
+            if output_mode == "stream":
+                stream_result = self.create_and_stream_proxy(
+                    input_source,
+                    bucket_name,
+                    proxy_key,
+                    add_text=add_text,
+                    input_stream=input_stream,
+                    progress_callback=progress_callback,
+                    metadata=upload_metadata,
+                    plan=plan,
+                )
+                total_time = time.time() - start_time
+                return {
+                    "original": {"bucket": bucket_name, "key": object_key},
+                    "proxy": {"bucket": bucket_name, "key": proxy_key},
+                    "input_mode": input_mode,
+                    "encode_mode": encode_mode,
+                    "encode_path": encode_path,
+                    "output_mode": output_mode,
+                    "processing_times": {
+                        "download": round(download_time, 2),
+                        "process": round(stream_result["encode"], 2),
+                        "upload": round(stream_result["upload"], 2),
+                        "total": round(total_time, 2),
+                        "download_mbps": download_stats.get("mbps"),
+                        "download_bytes": download_stats.get("bytes"),
+                        "upload_bytes": stream_result["bytes"],
+                    },
+                }
+            if renditions:
+                return self._process_and_upload_renditions(
+                    bucket_name,
+                    object_key,
+                    input_source,
+                    input_stream,
+                    renditions,
+                    add_text,
+                    start_time,
+                    download_time,
+                    input_mode,
+                    download_stats,
+                    progress_callback,
+                    upload_metadata,
+                )
+            if encode_mode == "chunked":
+                temp_output_file = self.create_proxy_chunked(
+                    input_source,
+                    add_text=add_text,
+                    progress_callback=progress_callback,
+                    checkpoint=checkpoint,
+                    input_url=(
+                        lambda: self.generate_presigned_url(bucket_name, object_key)
+                    )
+                    if input_mode == "url"
+                    else None,
+                )
+            elif encode_mode == "checkpoint":
+                # 逐段编码，失败时最多浪费一段的编码时间
+                temp_output_file = self.create_proxy_chunked(
+                    input_source,
+                    add_text=add_text,
+                    progress_callback=progress_callback,
+                    segment_seconds=checkpoint_seconds,
+                    parallel=1,
+                    checkpoint=checkpoint,
+                )
+            else:
+                temp_output_file = self.create_proxy_with_counter(
+                    input_source,
+                    add_text=add_text,
+                    input_stream=input_stream,
+                    progress_callback=progress_callback,
+                    plan=plan,
+                )
+            process_time = time.time() - process_start
+
+            # 帧索引先于代理文件上传，看到代理文件时帧索引已经可用
+            index_format = os.environ.get("PROXY_FRAME_INDEX", "binary")
+            frame_index = None
+            if index_format != "off":
+                self._set_stage("index")
+                frame_index = self.upload_frame_index(
+                    temp_output_file, bucket_name, proxy_key, index_format, upload_metadata
+                )
+
             # 上传代理文件到S3
+            self._set_stage("upload")
             upload_start = time.time()
             logger.info(f"开始上传代理文件到S3: {bucket_name}/{proxy_key}")
-            self.s3_client.upload_file(temp_output_file, bucket_name, proxy_key)
+            upload_stats = transfer.upload_file(
+                self.s3_client,
+                temp_output_file,
+                bucket_name,
+                proxy_key,
+                extra_args={"Metadata": upload_metadata},
+            )
             upload_time = time.time() - upload_start
 
             total_time = time.time() - start_time
 
-            return {
+            result = {
                 "original": {"bucket": bucket_name, "key": object_key},
                 "proxy": {"bucket": bucket_name, "key": proxy_key},
+                "input_mode": input_mode,
+                "encode_mode": encode_mode,
+                "encode_path": encode_path,
+                "output_mode": output_mode,
                 "processing_times": {
                     "download": round(download_time, 2),
                     "process": round(process_time, 2),
                     "upload": round(upload_time, 2),
                     "total": round(total_time, 2),
+                    "download_mbps": download_stats.get("mbps"),
+                    "upload_mbps": upload_stats["mbps"],
+                    "download_bytes": download_stats.get("bytes"),
+                    "upload_bytes": upload_stats["bytes"],
                 },
             }
+            if frame_index is not None:
+                result["frame_index"] = frame_index
+                result["processing_times"]["index"] = frame_index["seconds"]
+            if checkpoint is not None:
+                # 代理文件已上传，检查点不再需要
+                checkpoint.clear()
+                result["checkpoint"] = {
+                    "restored": checkpoint.restored,
+                    "saved": checkpoint.saved,
+                }
+            return result
 
         finally:
             # 清理临时文件
             if temp_input_file:
-                self.cleanup_temp_file(temp_input_file)
+                self.release_source(temp_input_file)
             if temp_output_file:
                 self.cleanup_temp_file(temp_output_file)
+            reservations.close()
+
+    def _process_and_upload_renditions(
+        self,
+        bucket_name,
+        object_key,
+        input_source,
+        input_stream,
+        renditions,
+        add_text,
+        start_time,
+        download_time,
+        input_mode,
+        download_stats,
+        progress_callback=None,
+        upload_metadata=None,
+    ):
+        """
+        生成多个输出并上传到proxy/前缀下，第一个视频输出作为主代理文件
+        """
+        output_dir = tempfile.mkdtemp(prefix="renditions_", dir=self.temp_dir)
+        try:
+            process_start = time.time()
+            specs = self.create_renditions(
+                input_source,
+                renditions,
+                output_dir=output_dir,
+                add_text=add_text,
+                input_stream=input_stream,
+                progress_callback=progress_callback,
+            )
+            process_time = time.time() - process_start
+
+            base_key = f"proxy/{os.path.splitext(object_key)[0]}"
+            self._set_stage("upload")
+            upload_start = time.time()
+            uploaded_bytes = 0
+            outputs = []
+            for spec in specs:
+                keys = []
+                for file_path in spec["files"]:
+                    file_name = os.path.basename(file_path)
+                    proxy_key = f"{base_key}_{file_name}"
+                    logger.info(f"开始上传输出文件到S3: {bucket_name}/{proxy_key}")
+                    upload_stats = transfer.upload_file(
+                        self.s3_client,
+                        file_path,
+                        bucket_name,
+                        proxy_key,
+                        extra_args={"Metadata": upload_metadata}
+                        if upload_metadata
+                        else None,
+                    )
+                    uploaded_bytes += upload_stats["bytes"]
+                    keys.append(proxy_key)
+                outputs.append({"name": spec["name"], "type": spec["type"], "keys": keys})
+            upload_time = time.time() - upload_start
+
+            primary = next((o for o in outputs if o["type"] == "video"), None)
+            total_time = time.time() - start_time
+            return {
+                "original": {"bucket": bucket_name, "key": object_key},
+                "proxy": {"bucket": bucket_name, "key": primary["keys"][0]}
+                if primary
+                else None,
+                "renditions": outputs,
+                "input_mode": input_mode,
+                "encode_mode": "single",
+                "processing_times": {
+                    "download": round(download_time, 2),
+                    "process": round(process_time, 2),
+                    "upload": round(upload_time, 2),
+                    "total": round(total_time, 2),
+                    "download_mbps": download_stats.get("mbps"),
+                    "upload_mbps": round(uploaded_bytes / (1024 * 1024) / upload_time, 2)
+                    if upload_time > 0
+                    else None,
+                    "download_bytes": download_stats.get("bytes"),
+                    "upload_bytes": uploaded_bytes,
+                },
+            }
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    def _thumbnail_times(self, duration, times=None, count=None, interval=None):
+        """
+        计算取帧时间点：指定的时间列表、按数量均匀分布，或按间隔
+        """
+        max_frames = int(os.environ.get("THUMBNAIL_MAX_FRAMES", "1000"))
+        if times:
+            points = sorted(float(t) for t in times)
+        elif interval:
+            # 与times/count相同，超过上限时报错而不是截断（截断后拼图和VTT只覆盖视频前段）
+            total = math.ceil(duration / interval) if duration else 0
+            if total > max_frames:
+                raise Exception(
+                    f"缩略图数量{total}超过上限{max_frames}，"
+                    f"取帧间隔至少为{math.ceil(duration / max_frames)}秒"
+                )
+            points = [round(i * float(interval), 3) for i in range(total)]
+        else:
+            # 取每段的中点，避开片头片尾的黑场
+            count = count or 10
+            points = [round(duration * (i + 0.5) / count, 3) for i in range(count)]
+        if len(points) > max_frames:
+            raise Exception(f"缩略图数量{len(points)}超过上限{max_frames}")
+        # 超出时长的定位点取不到帧
+        if duration:
+            points = [min(max(0.0, t), max(0.0, duration - 0.1)) for t in points]
+        return points
+
+    def _extract_frame(
+        self, input_url, position, output_file, width, height, fmt, exact
+    ):
+        """
+        在输入端用-ss定位并只解码一帧：ffmpeg通过HTTP Range跳到定位点前的关键帧，
+        只读取附近的数据
+
+        Args:
+            exact (bool): True时从关键帧解码到精确时间点；False时直接输出关键帧，
+                只解码一帧
+        """
+        cmd = ["ffmpeg", "-reconnect", "1", "-reconnect_delay_max", "5"]
+        if not exact:
+            cmd += ["-noaccurate_seek", "-skip_frame", "nokey"]
+        cmd += [
+            "-ss",
+            str(position),
+            "-i",
+            input_url,
+            "-frames:v",
+            "1",
+            "-an",
+            "-vf",
+            f"scale={width}:{height}",
+            *THUMBNAIL_FORMATS[fmt][0],
+            "-y",
+            output_file,
+        ]
+        returncode, stderr = self._run_ffmpeg(cmd)
+        if returncode != 0 or not os.path.exists(output_file):
+            logger.error(f"取帧失败: {position}秒 错误码: {returncode}")
+            logger.error(f"错误输出: {stderr}")
+            raise Exception(f"无法提取{position}秒处的画面，错误码: {returncode}")
+
+    def _tile_frames(self, frame_pattern, output_pattern, columns, rows, fmt):
+        """
+        把按序号命名的单帧图片拼成拼图，一张放不下时按序号输出多张
+        """
+        cmd = [
+            "ffmpeg",
+            "-framerate",
+            "1",
+            "-start_number",
+            "0",
+            "-i",
+            frame_pattern,
+            "-vf",
+            f"tile={columns}x{rows}",
+            *THUMBNAIL_FORMATS[fmt][0],
+            "-y",
+            output_pattern,
+        ]
+        returncode, stderr = self._run_ffmpeg(cmd)
+        if returncode != 0:
+            logger.error(f"拼图失败，错误码: {returncode}")
+            logger.error(f"错误输出: {stderr}")
+            raise Exception(f"拼图失败，错误码: {returncode}")
+
+    def create_thumbnails(
+        self,
+        bucket_name,
+        object_key,
+        times=None,
+        count=None,
+        interval=None,
+        height=None,
+        fmt="jpg",
+        sprite=False,
+        columns=10,
+        rows=10,
+        exact=None,
+        progress_callback=None,
+    ):
+        """
+        通过预签名URL按时间点定位取帧，生成海报图或缩略图拼图（附WebVTT索引），
+        上传到 thumbnails/<key>/ 前缀下
+
+        每帧单独启动一个ffmpeg，输入端-ss定位，只读取定位点附近的数据，
+        开销与缩略图数量成正比而与视频长度无关。
+
+        Args:
+            times (list, optional): 取帧时间点（秒）
+            count (int, optional): 均匀分布的帧数，times和interval都未指定时默认10
+            interval (float, optional): 取帧间隔（秒），拼图默认10
+            height (int, optional): 图片高度，默认单帧540、拼图的每格90
+            fmt (str): "jpg"、"webp" 或 "png"
+            sprite (bool): 为True时拼成拼图并生成WebVTT索引
+            columns (int): 拼图列数
+            rows (int): 拼图行数
+            exact (bool, optional): 是否精确到时间点，默认单帧精确、拼图取最近的关键帧
+            progress_callback (callable, optional): 取帧进度回调
+
+        Returns:
+            dict: 上传的图片（和VTT）对象键及处理耗时
+        """
+        if fmt not in THUMBNAIL_FORMATS:
+            raise Exception(f"不支持的图片格式: {fmt}")
+        start_time = time.time()
+        if exact is None:
+            exact = not sprite
+        if sprite and not times and not count:
+            interval = interval or 10
+        height = height or (90 if sprite else PROXY_HEIGHT)
+
+        # 只需要时长和画面尺寸，元数据缓存或头部探测即可
+        self._set_stage("probe")
+        head = self.s3_client.head_object(Bucket=bucket_name, Key=object_key)
+        input_url = self.generate_presigned_url(bucket_name, object_key)
+        metadata = self.source_metadata(
+            bucket_name, object_key, head["ETag"], "url", input_url
+        )
+        video = metadata.get("video")
+        if not video:
+            raise Exception(f"没有视频流: {object_key}")
+        display_width, display_height = video["width"], video["height"]
+        if abs(video.get("rotation") or 0) in (90, 270):
+            # ffmpeg解码时自动旋转，输出按显示方向计算尺寸
+            display_width, display_height = display_height, display_width
+        # 与scale=-2:h相同的取整方式，拼图的每格尺寸需要事先确定
+        height = height - height % 2
+        width = max(2, round(height * display_width / (display_height * 2)) * 2)
+        points = self._thumbnail_times(metadata["duration"], times, count, interval)
+
+        self._set_stage("encode")
+        extension = fmt
+        work_dir = tempfile.mkdtemp(prefix="thumbnails_", dir=self.temp_dir)
+        try:
+            process_start = time.time()
+            frame_files = [
+                os.path.join(work_dir, f"frame_{i:05d}.{extension}")
+                for i in range(len(points))
+            ]
+            completed = 0
+            lock = threading.Lock()
+
+            def extract(index):
+                nonlocal completed
+                self._extract_frame(
+                    input_url,
+                    points[index],
+                    frame_files[index],
+                    width,
+                    height,
+                    fmt,
+                    exact,
+                )
+                with lock:
+                    completed += 1
+                    if progress_callback is not None:
+                        progress_callback(
+                            {
+                                "frame": completed,
+                                "total": len(points),
+                                "percent": round(completed / len(points) * 100, 1),
+                                "done": completed == len(points),
+                            }
+                        )
+
+            concurrency = int(os.environ.get("THUMBNAIL_CONCURRENCY", "4"))
+            with ThreadPoolExecutor(
+                max_workers=max(1, concurrency), thread_name_prefix="thumbnail"
+            ) as pool:
+                list(pool.map(extract, range(len(points))))
+
+            base_key = f"thumbnails/{os.path.splitext(object_key)[0]}"
+            uploads = []
+            result = {"original": {"bucket": bucket_name, "key": object_key}}
+            if sprite:
+                sprite_pattern = os.path.join(work_dir, f"sprite_%03d.{extension}")
+                self._tile_frames(
+                    os.path.join(work_dir, f"frame_%05d.{extension}"),
+                    sprite_pattern,
+                    columns,
+                    rows,
+                    fmt,
+                )
+                per_sheet = columns * rows
+                sheets = [
+                    sprite_pattern % (i + 1)
+                    for i in range((len(points) + per_sheet - 1) // per_sheet)
+                ]
+                vtt_file = os.path.join(work_dir, "sprite.vtt")
+                with open(vtt_file, "w") as f:
+                    f.write(
+                        self._sprite_vtt(
+                            points,
+                            metadata["duration"],
+                            sheets,
+                            width,
+                            height,
+                            columns,
+                            rows,
+                        )
+                    )
+                uploads = [
+                    (path, f"{base_key}/{os.path.basename(path)}") for path in sheets
+                ]
+                uploads.append((vtt_file, f"{base_key}/sprite.vtt"))
+                result["sprites"] = [key for _, key in uploads[:-1]]
+                result["vtt"] = f"{base_key}/sprite.vtt"
+                result["tile"] = {
+                    "width": width,
+                    "height": height,
+                    "columns": columns,
+                    "rows": rows,
+                }
+            else:
+                uploads = [
+                    (path, f"{base_key}/thumb_{i:04d}.{extension}")
+                    for i, path in enumerate(frame_files)
+                ]
+                result["thumbnails"] = [
+                    {"time": points[i], "key": key}
+                    for i, (_, key) in enumerate(uploads)
+                ]
+            process_time = time.time() - process_start
+
+            self._set_stage("upload")
+            upload_start = time.time()
+            uploaded_bytes = 0
+            with ThreadPoolExecutor(
+                max_workers=max(1, concurrency), thread_name_prefix="thumbnail-upload"
+            ) as pool:
+                for stats in pool.map(
+                    lambda item: transfer.upload_file(
+                        self.s3_client,
+                        item[0],
+                        bucket_name,
+                        item[1],
+                        extra_args={
+                            "ContentType": "text/vtt"
+                            if item[1].endswith(".vtt")
+                            else THUMBNAIL_FORMATS[fmt][1]
+                        },
+                    ),
+                    uploads,
+                ):
+                    uploaded_bytes += stats["bytes"]
+            upload_time = time.time() - upload_start
+
+            result["count"] = len(points)
+            result["processing_times"] = {
+                "process": round(process_time, 2),
+                "upload": round(upload_time, 2),
+                "total": round(time.time() - start_time, 2),
+                "upload_bytes": uploaded_bytes,
+            }
+            logger.info(f"缩略图已上传: {bucket_name}/{base_key}/ ({len(points)}帧)")
+            return result
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _sprite_vtt(self, points, duration, sheets, width, height, columns, rows):
+        """
+        生成拼图的WebVTT索引：每个时间段指向拼图中的一格（#xywh=x,y,w,h）
+        """
+
+        def timestamp(seconds):
+            hours, rest = divmod(seconds, 3600)
+            minutes, secs = divmod(rest, 60)
+            return f"{int(hours):02d}:{int(minutes):02d}:{secs:06.3f}"
+
+        per_sheet = columns * rows
+        lines = ["WEBVTT", ""]
+        for i, start in enumerate(points):
+            end = points[i + 1] if i + 1 < len(points) else max(duration, start)
+            sheet = os.path.basename(sheets[i // per_sheet])
+            cell = i % per_sheet
+            x = (cell % columns) * width
+            y = (cell // columns) * height
+            lines.append(f"{timestamp(start)} --> {timestamp(end)}")
+            lines.append(f"{sheet}#xywh={x},{y},{width},{height}")
+            lines.append("")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python -m video_processor worker：从持久队列领取任务的独立工作进程
+    import sys
+    from worker import main
+
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,377 @@
+import os
+import time
+import sqlite3
+import threading
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 本服务写入同一存储桶的输出前缀，监听时跳过，避免为代理文件再生成代理
+OUTPUT_PREFIXES = ("proxy/", "thumbnails/", "checkpoints/")
+
+# 默认只为这些扩展名的对象生成代理文件
+VIDEO_EXTENSIONS = ".mp4,.mov,.m4v,.mkv,.webm,.avi,.mxf,.mts"
+
+
+def source_extensions(extensions=None):
+    """
+    解析逗号分隔的扩展名，默认读取环境变量WATCH_EXTENSIONS
+
+    Returns:
+        tuple: 小写的扩展名
+    """
+    extensions = extensions or os.environ.get("WATCH_EXTENSIONS", VIDEO_EXTENSIONS)
+    return tuple(e.strip().lower() for e in extensions.split(",") if e.strip())
+
+
+def is_source_key(object_key, extensions=None):
+    """
+    判断对象键是否为需要处理的源视频：跳过本服务的输出前缀，只保留视频扩展名
+    （前缀监听和/batch的prefix列表共用）
+
+    Args:
+        object_key (str): 对象键
+        extensions (tuple, optional): source_extensions()的返回值，默认读取环境变量
+    """
+    if object_key.startswith(OUTPUT_PREFIXES):
+        return False
+    return object_key.lower().endswith(extensions or source_extensions())
+
+
+class WatchIndex:
+    def __init__(self, db_path):
+        """
+        已处理对象的本地索引：(bucket, key) -> ETag、代理文件键、状态、任务ID
+
+        Args:
+            db_path (str): sqlite数据库路径，":memory:"时重启后重新检查所有对象
+                （已有最新代理文件的对象在任务中直接跳过，不会重新编码）
+        """
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS watched_objects (
+                bucket TEXT NOT NULL,
+                object_key TEXT NOT NULL,
+                etag TEXT NOT NULL,
+                proxy_key TEXT,
+                status TEXT NOT NULL,
+                job_id TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (bucket, object_key)
+            )
+            """
+        )
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS watch_state (
+                bucket TEXT NOT NULL,
+                prefix TEXT NOT NULL,
+                start_after TEXT,
+                full_scan_at REAL,
+                PRIMARY KEY (bucket, prefix)
+            )
+            """
+        )
+        self.db.commit()
+
+    def get(self, bucket_name, object_key):
+        """
+        Returns:
+            dict: etag、proxy_key、status、job_id，未记录时返回None
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT etag, proxy_key, status, job_id FROM watched_objects "
+                "WHERE bucket = ? AND object_key = ?",
+                (bucket_name, object_key),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("etag", "proxy_key", "status", "job_id"), row))
+
+    def put(self, bucket_name, object_key, etag, proxy_key, status, job_id=None):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO watched_objects "
+                "(bucket, object_key, etag, proxy_key, status, job_id, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, NULL, ?)",
+                (bucket_name, object_key, etag, proxy_key, status, job_id, time.time()),
+            )
+            self.db.commit()
+
+    def set_status(self, bucket_name, object_key, job_id, status, error=None):
+        # 只更新同一任务的记录，对象被覆盖后重新提交的任务不受旧任务结果影响
+        with self.lock:
+            self.db.execute(
+                "UPDATE watched_objects SET status = ?, error = ?, updated_at = ? "
+                "WHERE bucket = ? AND object_key = ? AND job_id = ?",
+                (status, error, time.time(), bucket_name, object_key, job_id),
+            )
+            self.db.commit()
+
+    def submitted(self, bucket_name):
+        """
+        返回已提交但未记录结果的 (key, job_id)
+        """
+        with self.lock:
+            return self.db.execute(
+                "SELECT object_key, job_id FROM watched_objects "
+                "WHERE bucket = ? AND status = 'submitted'",
+                (bucket_name,),
+            ).fetchall()
+
+    def counts(self, bucket_name):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT status, COUNT(*) FROM watched_objects WHERE bucket = ? "
+                "GROUP BY status",
+                (bucket_name,),
+            ).fetchall()
+        return dict(rows)
+
+    def get_state(self, bucket_name, prefix):
+        """
+        Returns:
+            tuple: (start_after, full_scan_at)，没有记录时为 (None, None)
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT start_after, full_scan_at FROM watch_state "
+                "WHERE bucket = ? AND prefix = ?",
+                (bucket_name, prefix),
+            ).fetchone()
+        return row or (None, None)
+
+    def set_state(self, bucket_name, prefix, start_after, full_scan_at):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO watch_state "
+                "(bucket, prefix, start_after, full_scan_at) VALUES (?, ?, ?, ?)",
+                (bucket_name, prefix, start_after, full_scan_at),
+            )
+            self.db.commit()
+
+
+class PrefixWatcher:
+    def __init__(
+        self,
+        job_manager,
+        bucket_name,
+        prefix="",
+        index=None,
+        interval=None,
+        full_scan_interval=None,
+        add_text=None,
+        extensions=None,
+    ):
+        """
+        监听存储桶前缀，为新上传或内容变化的视频提交代理任务
+
+        每轮用list_objects_v2从上次扫描到的最大键之后（StartAfter）增量列出，
+        只读取新增的键；本地索引按 (bucket, key) 记录ETag，已处理过的对象不再提交。
+        S3按字典序列出，键小于已扫描位置的新对象和原地覆盖的对象在增量扫描中不可见，
+        因此每隔full_scan_interval从头完整扫描一次，按ETag找出这些对象。
+
+        Args:
+            job_manager: JobManager或DurableJobManager
+            bucket_name (str): S3存储桶名称
+            prefix (str): 监听的对象键前缀
+            index (WatchIndex, optional): 已处理对象索引，默认使用内存数据库
+            interval (float, optional): 增量扫描间隔（秒），默认读取环境变量WATCH_INTERVAL，
+                未设置时为60
+            full_scan_interval (float, optional): 完整扫描间隔（秒），默认读取环境变量
+                WATCH_FULL_SCAN_SECONDS，未设置时为3600
+            add_text (bool, optional): 是否添加帧数计数器，默认读取环境变量WATCH_ADD_TEXT
+            extensions (str, optional): 逗号分隔的扩展名，默认读取环境变量WATCH_EXTENSIONS
+        """
+        self.job_manager = job_manager
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.index = index or WatchIndex(":memory:")
+        self.interval = interval or float(os.environ.get("WATCH_INTERVAL", "60"))
+        self.full_scan_interval = full_scan_interval or float(
+            os.environ.get("WATCH_FULL_SCAN_SECONDS", "3600")
+        )
+        if add_text is None:
+            add_text = os.environ.get("WATCH_ADD_TEXT", "true").lower() == "true"
+        self.add_text = add_text
+        self.extensions = source_extensions(extensions)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.last_scan = None
+
+    @classmethod
+    def from_env(cls, job_manager):
+        """
+        根据环境变量创建监听器：WATCH_PREFIX（未设置时返回None，不启用监听）、
+        WATCH_BUCKET（默认AWS_BUCKET_NAME）、WATCH_INDEX_DB
+        """
+        prefix = os.environ.get("WATCH_PREFIX")
+        if prefix is None:
+            return None
+        bucket_name = os.environ.get("WATCH_BUCKET") or os.environ.get("AWS_BUCKET_NAME")
+        if not bucket_name:
+            raise Exception("环境变量WATCH_BUCKET或AWS_BUCKET_NAME未设置")
+        db_path = os.environ.get("WATCH_INDEX_DB")
+        if not db_path:
+            logger.warning("WATCH_INDEX_DB未设置，已处理对象索引只保存在内存中")
+        return cls(
+            job_manager, bucket_name, prefix, index=WatchIndex(db_path or ":memory:")
+        )
+
+    def start(self):
+        """
+        在后台线程中循环扫描
+        """
+        self.thread = threading.Thread(target=self._loop, name="prefix-watch", daemon=True)
+        self.thread.start()
+        logger.info(
+            f"开始监听: {self.bucket_name}/{self.prefix} 每{self.interval:.0f}秒增量扫描，"
+            f"每{self.full_scan_interval:.0f}秒完整扫描"
+        )
+
+    def stop(self):
+        self.stopped.set()
+
+    def _loop(self):
+        self.resubmit_lost()
+        while not self.stopped.is_set():
+            try:
+                self.scan()
+            except Exception as e:
+                logger.error(f"扫描失败: {self.bucket_name}/{self.prefix} {e}")
+            self.stopped.wait(self.interval)
+
+    def _wanted(self, object_key):
+        return is_source_key(object_key, self.extensions)
+
+    def scan(self):
+        """
+        执行一轮扫描（到期时为完整扫描，否则从上次位置增量扫描）
+
+        Returns:
+            dict: listed（列出的对象数）、submitted（提交的任务数）、full（是否完整扫描）
+        """
+        import tasks
+
+        processor = tasks.get_processor()
+        start_after, full_scan_at = self.index.get_state(self.bucket_name, self.prefix)
+        now = time.time()
+        full = full_scan_at is None or now - full_scan_at >= self.full_scan_interval
+        listed = 0
+        submitted = 0
+        last_key = start_after
+        for item in processor.list_keys(
+            self.bucket_name, self.prefix, start_after=None if full else start_after
+        ):
+            listed += 1
+            object_key = item["Key"]
+            if last_key is None or object_key > last_key:
+                last_key = object_key
+            if not self._wanted(object_key):
+                continue
+            known = self.index.get(self.bucket_name, object_key)
+            if known is not None and known["etag"] == item["ETag"]:
+                continue
+            self.submit(processor, object_key, item["ETag"])
+            submitted += 1
+
+        self.index.set_state(
+            self.bucket_name,
+            self.prefix,
+            last_key,
+            now if full else full_scan_at,
+        )
+        self.last_scan = {
+            "time": now,
+            "full": full,
+            "listed": listed,
+            "submitted": submitted,
+            "start_after": None if full else start_after,
+        }
+        if submitted or full:
+            logger.info(
+                f"{'完整' if full else '增量'}扫描完成: 列出{listed}个对象，提交{submitted}个任务"
+            )
+        return {"listed": listed, "submitted": submitted, "full": full}
+
+    def submit(self, processor, object_key, etag):
+        """
+        提交代理任务并记录到索引，任务结束时更新状态
+        """
+        import tasks
+
+        proxy_key = processor.primary_proxy_key(
+            object_key, output_mode=os.environ.get("PROXY_OUTPUT_MODE", "file")
+        )
+        job_id = self.job_manager.submit(
+            "create-proxy",
+            tasks.run_create_proxy,
+            self.bucket_name,
+            object_key,
+            with_progress=True,
+            schedule=tasks.proxy_schedule(self.bucket_name, object_key, self.add_text),
+            add_text=self.add_text,
+            endpoint="watch",
+        )
+        self.index.put(
+            self.bucket_name, object_key, etag, proxy_key, "submitted", job_id
+        )
+        self._track(object_key, job_id)
+        logger.info(f"新对象已提交代理任务: {object_key} {job_id}")
+
+    def _track(self, object_key, job_id):
+        future = self.job_manager.get_future(job_id)
+        if future is None:
+            return
+
+        def on_done(f):
+            error = f.exception()
+            if error is None:
+                self.index.set_status(self.bucket_name, object_key, job_id, "succeeded")
+            else:
+                self.index.set_status(
+                    self.bucket_name, object_key, job_id, "failed", str(error)
+                )
+
+        future.add_done_callback(on_done)
+
+    def resubmit_lost(self):
+        """
+        启动时检查已提交但未记录结果的任务：任务管理器中已不存在（进程内工作池随重启丢失）
+        的重新提交，仍存在的（持久队列）继续跟踪结果
+        """
+        lost = 0
+        for object_key, job_id in self.index.submitted(self.bucket_name):
+            if job_id and self.job_manager.get(job_id) is not None:
+                self._track(object_key, job_id)
+                continue
+            # 清除ETag，下一轮扫描时重新提交
+            self.index.put(self.bucket_name, object_key, "", None, "lost", job_id)
+            lost += 1
+        if lost:
+            logger.info(f"{lost}个已提交的任务在重启后丢失，将重新提交")
+            # 丢失的对象可能在已扫描位置之前，下一轮做完整扫描
+            start_after, _ = self.index.get_state(self.bucket_name, self.prefix)
+            self.index.set_state(self.bucket_name, self.prefix, start_after, None)
+
+    def status(self):
+        """
+        返回监听配置、最近一次扫描和索引中各状态的对象数
+        """
+        return {
+            "bucket": self.bucket_name,
+            "prefix": self.prefix,
+            "interval": self.interval,
+            "full_scan_interval": self.full_scan_interval,
+            "last_scan": self.last_scan,
+            "objects": self.index.counts(self.bucket_name),
+        }
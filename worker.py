@@ -0,0 +1,201 @@
+import os
+import sys
+import socket
+import signal
+import argparse
+import threading
+import logging
+from durable_queue import DurableQueue
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 用法:
+#   JOB_QUEUE_DB=/data/jobs.db python -m video_processor worker --concurrency 2
+#   WATCH_PREFIX=uploads/ python -m video_processor watch
+#
+# API进程设置 JOB_BACKEND=queue 和相同的 JOB_QUEUE_DB 后只负责入队。
+# 同一台机器上可以启动多个工作进程；多台机器共用队列时数据库文件必须位于
+# 支持文件锁的共享存储上。
+
+
+class Worker:
+    def __init__(self, queue, concurrency=None, lease_seconds=None, poll_interval=1.0):
+        """
+        从持久队列领取任务并执行的工作进程
+
+        Args:
+            queue (DurableQueue): 持久任务队列
+            concurrency (int, optional): 同时执行的任务数，默认读取环境变量JOB_WORKERS
+            lease_seconds (float, optional): 租约时长，默认读取环境变量JOB_LEASE_SECONDS，
+                未设置时为60；心跳间隔为租约的三分之一
+            poll_interval (float): 队列为空时的轮询间隔（秒）
+        """
+        self.queue = queue
+        self.concurrency = concurrency or int(os.environ.get("JOB_WORKERS", "2"))
+        self.lease_seconds = lease_seconds or float(
+            os.environ.get("JOB_LEASE_SECONDS", "60")
+        )
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = threading.Event()
+
+    def run(self):
+        """
+        启动工作线程并阻塞到收到SIGTERM/SIGINT且正在执行的任务全部结束
+        """
+        import tasks
+
+        self.tasks = tasks
+        tasks.init_worker()
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._stop)
+
+        threads = [
+            threading.Thread(target=self._loop, name=f"worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        logger.info(f"工作进程已启动: {self.worker_id} 并发{self.concurrency}")
+        # 主线程等待信号
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
+        logger.info(f"工作进程已退出: {self.worker_id}")
+
+    def _stop(self, signum, frame):
+        # 停止领取新任务，正在执行的任务继续完成；被强制结束时租约过期后由其他进程重试
+        logger.info(f"收到信号{signum}，完成当前任务后退出")
+        self.stopping.set()
+
+    def _loop(self):
+        while not self.stopping.is_set():
+            try:
+                job = self.queue.claim(self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"领取任务失败: {e}")
+                job = None
+            if job is None:
+                self.stopping.wait(self.poll_interval)
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        logger.info(f"开始执行任务: {job['kind']} {job['id']} 第{job['attempts']}次")
+        func = getattr(self.tasks, job["func"], None)
+        if func is None or not job["func"].startswith("run_"):
+            self.queue.fail(job["id"], self.worker_id, f"未知的任务函数: {job['func']}")
+            return
+
+        kwargs = dict(job["kwargs"])
+        latest = {}
+        if job["with_progress"]:
+            kwargs["progress_callback"] = lambda progress: latest.update(
+                progress=progress
+            )
+
+        # 心跳线程定期续约并写入最新进度
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(self.lease_seconds / 3):
+                try:
+                    if not self.queue.heartbeat(
+                        job["id"],
+                        self.worker_id,
+                        self.lease_seconds,
+                        latest.get("progress"),
+                    ):
+                        logger.warning(f"任务租约已被接管: {job['id']}")
+                        return
+                except Exception as e:
+                    logger.error(f"任务续约失败: {job['id']} {e}")
+
+        beat = threading.Thread(target=heartbeat, name=f"heartbeat-{job['id'][:8]}")
+        beat.start()
+        try:
+            result = func(*job["args"], **kwargs)
+        except Exception as e:
+            logger.error(f"任务失败: {job['kind']} {job['id']} {e}")
+            done.set()
+            beat.join()
+            self.queue.fail(job["id"], self.worker_id, str(e))
+            return
+        done.set()
+        beat.join()
+        if job["with_progress"] and latest.get("progress") is not None:
+            self.queue.heartbeat(
+                job["id"], self.worker_id, self.lease_seconds, latest["progress"]
+            )
+        self.queue.complete(job["id"], self.worker_id, result)
+        logger.info(f"任务完成: {job['kind']} {job['id']}")
+
+
+def watch(once=False):
+    """
+    独立运行前缀监听器：JOB_BACKEND=queue时只向持久队列提交任务，
+    否则在本进程的工作池中执行
+    """
+    import tasks
+    from job_queue import create_job_manager
+    from watcher import PrefixWatcher
+
+    job_manager = create_job_manager(initializer=tasks.init_worker)
+    watcher = PrefixWatcher.from_env(job_manager)
+    if watcher is None:
+        raise Exception("环境变量WATCH_PREFIX未设置")
+    if once:
+        watcher.resubmit_lost()
+        logger.info(f"扫描结果: {watcher.scan()}")
+    else:
+        stopping = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: stopping.set())
+        watcher.start()
+        stopping.wait()
+        watcher.stop()
+    # 等待本进程工作池中的任务完成（持久队列模式下立即返回）
+    job_manager.shutdown(wait=True)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m video_processor")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    worker_parser = subcommands.add_parser("worker", help="从持久队列领取并执行任务")
+    worker_parser.add_argument("--concurrency", type=int, help="同时执行的任务数")
+    worker_parser.add_argument("--lease", type=float, help="租约时长（秒）")
+    worker_parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.environ.get("WORKER_METRICS_PORT", "0")),
+        help="Prometheus指标端口，0为不启用",
+    )
+    watch_parser = subcommands.add_parser(
+        "watch", help="监听WATCH_PREFIX，为新上传的视频提交代理任务"
+    )
+    watch_parser.add_argument("--once", action="store_true", help="只扫描一轮后退出")
+    args = parser.parse_args(argv)
+
+    if args.command == "watch":
+        return watch(once=args.once)
+
+    if args.metrics_port:
+        # 工作进程的阶段耗时等指标在本进程记录，单独暴露给Prometheus抓取
+        from prometheus_client import start_http_server
+
+        start_http_server(args.metrics_port)
+
+    Worker(
+        DurableQueue.from_env(),
+        concurrency=args.concurrency,
+        lease_seconds=args.lease,
+    ).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())